@@ -1,25 +1,70 @@
+import atexit
+import io
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, flash
+import sys
+import time
+from contextlib import contextmanager
+from functools import wraps
+import click
+from flask import Flask, render_template, request, redirect, url_for, session, flash, abort, make_response, \
+    Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
-import matplotlib
-
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-import io
-import base64
+from markupsafe import Markup
+from sqlalchemy import event, inspect as sa_inspect
+from sqlalchemy.orm import defer
 from datetime import datetime, timedelta
-from textblob import TextBlob
-from transformers import pipeline
+from emotion_model import EmotionModelProvider, EMOTION_MODEL_NAME, BACKENDS as EMOTION_BACKENDS
+from enrichment import EnrichmentQueue
+from nlp_cache import NLPCache, MISSING
+from mood_rules import mood_from_label
+from charts import chart_etag, render_mood_svg, render_mood_png, render_trend_svg
+import search_index
+import entry_tags
+import mood_rollup
+import mood_analytics
+import embeddings
+import tagging
+from embeddings import EmbeddingProvider
+from vector_index import IndexCache, build_index
+from pagination import TotalCountCache, keyset_paginate
+import migrations
+import entry_transfer
+import excerpts
+import recalc
+import auth
+import sharding
+import text_codec
+import response_cache
+from database import database_config, configure_sqlite, init_read_engine, init_shard_router, RoutingSession, \
+    read_only
+import instrumentation
+from instrumentation import span, timed
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 app = Flask(__name__)
 app.secret_key = 'supersecretkey'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'diary.db')
+app.config.update(database_config(basedir))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
+# 性能观测默认关闭，见 instrumentation.py
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '0') == '1'
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['PROFILE_SLOW_MS'] = int(os.environ.get('PROFILE_SLOW_MS', 0))
+app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(basedir, 'profiles'))
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+with app.app_context():
+    # WAL / busy_timeout 等在每个新连接上设置；只读页面可选走只读连接
+    configure_sqlite(db.engine, app.config)
+    read_engine = init_read_engine(app, db.engine)
+    # DB_SHARDS 没设时为 None，一切照旧走单个 diary.db
+    shard_router = init_shard_router(app, db.engine)
+    shard_engines = list(shard_router.engines.values()) if shard_router is not None else []
+    instrumentation.init_app(app, engines=[e for e in (db.engine, read_engine, *shard_engines) if e is not None],
+                             session_class=RoutingSession)
 PER_PAGE = 7
+# 分页按钮用的总数：缓存一会儿，不必每翻一页都 COUNT(*)
+total_counts = TotalCountCache(ttl=int(os.environ.get('PAGE_COUNT_TTL', 60)))
 def build_page_window(pagination, max_buttons=5):
     total = pagination.pages
     current = pagination.page
@@ -50,174 +95,795 @@ MOOD_MAP = {
 }
 # ========== 情绪模型：HuggingFace ==========
 
-try:
-    emotion_classifier = pipeline(
-        "text-classification",
-        model="j-hartmann/emotion-english-distilroberta-base",
-        top_k=1  # 只要得分最高的那一个标签
-    )
-    print("✅ Emotion model loaded.")
-except Exception as e:
-    emotion_classifier = None
-    print("⚠️ Could not load emotion model, fallback to TextBlob rules:", e)
-
-def predict_mood(text):
+# 模型不在 import 时加载：EMOTION_MODEL_WARMUP = lazy / background / preload
+app.config['EMOTION_MODEL_NAME'] = os.environ.get('EMOTION_MODEL_NAME', EMOTION_MODEL_NAME)
+# 后端：transformers / quantized / onnx / sklearn / rules，见 emotion_model.py
+app.config['EMOTION_BACKEND'] = os.environ.get('EMOTION_BACKEND', 'transformers')
+# onnx：已导出模型的目录；sklearn：joblib 所在目录（默认 models/）
+app.config['EMOTION_MODEL_PATH'] = os.environ.get('EMOTION_MODEL_PATH')
+app.config['EMOTION_MODEL_WARMUP'] = os.environ.get('EMOTION_MODEL_WARMUP', 'lazy')
+app.config['EMOTION_BATCH_SIZE'] = int(os.environ.get('EMOTION_BATCH_SIZE', 32))
+app.config['EMOTION_MAX_LENGTH'] = int(os.environ.get('EMOTION_MAX_LENGTH', 512))
+
+
+def make_emotion_model(backend):
+    model_path = app.config['EMOTION_MODEL_PATH']
+    if backend == 'sklearn' and not model_path:
+        model_path = os.path.join(basedir, 'models')
+    return EmotionModelProvider(app.config['EMOTION_MODEL_NAME'], backend=backend, model_path=model_path)
+
+
+emotion_model = make_emotion_model(app.config['EMOTION_BACKEND'])
+emotion_model.start(app.config['EMOTION_MODEL_WARMUP'])
+# 1 = 已经加载过（lazy 模式下第一次用到之前是 0）；available = 加载成功，不是在用规则兜底
+instrumentation.register_gauges(lambda: {
+    "diary_emotion_model_loaded": int(emotion_model.is_loaded),
+    "diary_emotion_model_available": int(emotion_model.is_loaded and not emotion_model.failed),
+})
+
+# ========== 结果缓存：文本没变就不再跑模型 ==========
+# 改了 mood_rules.py 的规则 / extract_tags 的逻辑时，把对应版本号 +1
+MOOD_RULES_VERSION = 3
+TAGS_VERSION = 2
+app.config['NLP_CACHE_SIZE'] = int(os.environ.get('NLP_CACHE_SIZE', 10000))
+app.config['NLP_CACHE_PATH'] = os.environ.get('NLP_CACHE_PATH')  # 例如 nlp_cache.db；不设则只用内存
+nlp_cache = NLPCache(
+    max_entries=app.config['NLP_CACHE_SIZE'],
+    sqlite_path=app.config['NLP_CACHE_PATH'],
+)
+instrumentation.register_gauges(
+    lambda: {f"diary_nlp_cache_{k}": v for k, v in nlp_cache.stats().items()})
+
+
+def mood_cache_version(use_model=True):
+    # 模型加载失败时结果来自规则版，单独一个版本，模型恢复后不会误用
+    # 不同后端（量化 / ONNX / sklearn）给出的标签不一定相同，各自一个版本
+    # 同一个字符串也写进 entry.mood_model，记录每篇日记的情绪是哪个版本算的
+    backend = 'rules-only' if emotion_model.failed or not use_model else emotion_model.version
+    return f"{backend}/rules-{MOOD_RULES_VERSION}"
+
+
+def _predict_moods(texts, batch_size=None):
+    """Uncached batch prediction; returns (moods, reliable) where reliable=False means the model errored."""
+    labels = [None] * len(texts)
+    reliable = True
+    todo = [i for i, t in enumerate(texts) if t.strip()]
+    if todo and emotion_model.get() is not None:
+        try:
+            with span('model.classify'):
+                predicted = emotion_model.classify(
+                    [texts[i] for i in todo],
+                    batch_size=batch_size or app.config['EMOTION_BATCH_SIZE'],
+                    max_length=app.config['EMOTION_MAX_LENGTH'],
+                )
+            for i, label in zip(todo, predicted):
+                labels[i] = label
+        except Exception as e:
+            print("Emotion model error:", e)
+            reliable = False
+    with span('mood.rules'):
+        return [mood_from_label(t, label) for t, label in zip(texts, labels)], reliable
+
+
+def predict_moods(texts, batch_size=None, use_cache=True):
     """
-    情绪预测（升级版）：
-    1. 优先使用 HuggingFace 情绪模型；
-    2. 如果模型不可用 / 出错，则回退到 TextBlob + 关键词规则。
+    批量情绪预测：
+    1. 优先使用 HuggingFace 情绪模型，按批次做前向计算；
+    2. 如果模型不可用 / 出错，则回退到 TextBlob + 关键词规则；
+    3. 命中缓存的文本直接返回，只有没算过的才进模型。
     """
-    blob = TextBlob(text)
-    polarity = blob.sentiment.polarity
-    text_lower = text.lower()
-
-    # 关键词表：后面既给 transformer 做细分，也给 fallback 用
-    angry_words = ["angry", "mad", "furious", "irritated", "annoyed", "rage", "pissed"]
-    fear_words = ["scared", "afraid", "fear", "terrified", "worried", "anxious", "nervous"]
-    sad_words = ["sad", "depressed", "unhappy", "down", "miserable", "cry", "lonely"]
-    joyful_words = ["happy", "joy", "delighted", "glad", "cheerful", "grateful"]
-    excited_words = ["excited", "thrilled", "energetic", "pumped", "ecstatic", "hyped"]
-    calm_words = ["calm", "relaxed", "peaceful", "chill", "okay", "fine"]
-
-    # ------- 旧的规则版（用于回退） -------
-    def rule_based():
-        if any(w in text_lower for w in angry_words):
-            return "angry"
-        if any(w in text_lower for w in fear_words):
-            return "fearful"
-        if any(w in text_lower for w in excited_words):
-            return "excited"
-        if any(w in text_lower for w in sad_words):
-            return "sad"
-        if any(w in text_lower for w in joyful_words):
-            return "joyful"
-        if any(w in text_lower for w in calm_words):
-            return "calm"
-
-        if polarity > 0.3:
-            return "joyful"
-        elif polarity < -0.3:
-            return "sad"
-        else:
-            return "neutral"
+    texts = list(texts)
+    if not use_cache:
+        return _predict_moods(texts, batch_size)[0]
+
+    version = mood_cache_version()
+    moods = [nlp_cache.get('mood', version, t) for t in texts]
+    missing = [i for i, m in enumerate(moods) if m is MISSING]
+    if missing:
+        computed, reliable = _predict_moods([texts[i] for i in missing], batch_size)
+        for i, mood in zip(missing, computed):
+            moods[i] = mood
+        # 模型临时出错时的回退结果不缓存，下次再试
+        if reliable:
+            nlp_cache.set_many('mood', mood_cache_version(),
+                               [(texts[i], moods[i]) for i in missing])
+    return moods
 
-    # 空文本直接 Neutral
-    if not text_lower.strip():
-        return "neutral"
 
-    # 如果模型没成功加载，直接用旧规则
-    if emotion_classifier is None:
-        return rule_based()
+def predict_mood(text):
+    """单条情绪预测，等价于 predict_moods([text])[0]。"""
+    return predict_moods([text])[0]
 
-    # ------- 使用 HuggingFace 模型 -------
-    try:
-        preds = emotion_classifier(text)
-        # 兼容不同返回格式：可能是 [ {label,score} ] 或 [ [ {..} ] ]
-        if isinstance(preds, list):
-            first = preds[0]
-            if isinstance(first, list):
-                first = first[0]
-            label = first["label"].lower()
-        else:
-            label = preds["label"].lower()
-    except Exception as e:
-        print("Emotion model error:", e)
-        return rule_based()
-
-    # ------- 将 HuggingFace 标签映射到我们的 7 种情绪 -------
-    # 模型标签：大概是 joy, anger, sadness, fear, neutral, surprise
-
-    # 辅助：有没有强烈“负面词”
-    has_negative_hint = (
-            any(w in text_lower for w in sad_words)
-            or any(w in text_lower for w in fear_words)
-            or any(w in text_lower for w in angry_words)
-    )
 
-    # 🎯 特别照顾 calm：如果用户一直在强调 calm / relaxed，
-    # 但整体情绪不是很强烈，就倾向于给 calm。
-    def try_calm():
-        if any(w in text_lower for w in calm_words) \
-                and polarity > -0.1 and polarity < 0.5 \
-                and not has_negative_hint:
-            # 有 calm 词、没有明显负面、极性在 -0.1 ~ 0.5 之间 → 认为是 calm
-            return "calm"
-        return None
+def cached_mood(text):
+    """The cached mood for ``text``, or None if it would need the model."""
+    mood = nlp_cache.get('mood', mood_cache_version(), text)
+    return None if mood is MISSING else mood
 
-    # 1) joy
-    if label == "joy":
-        # 先看看能不能判成 calm（比如 "I'm really calm now."）
-        calm_result = try_calm()
-        if calm_result:
-            return calm_result
 
-        # 很开心、极端正向 → excited
-        if any(w in text_lower for w in excited_words) or polarity > 0.6:
-            return "excited"
-        else:
-            return "joyful"
-
-    # 2) sadness
-    if label == "sadness":
-        return "sad"
-
-    # 3) anger
-    if label == "anger":
-        return "angry"
-
-    # 4) fear
-    if label == "fear":
-        return "fearful"
-
-    # 5) neutral
-    if label == "neutral":
-        # neutral 里优先给 calm，但要确保没有强烈负面词
-        calm_result = try_calm()
-        if calm_result:
-            return calm_result
-        return "neutral"
-
-    # 6) surprise
-    if label == "surprise":
-        # 惊喜 or 受惊吓：看一下极性
-        if polarity >= 0:
-            return "excited"
-        else:
-            return "fearful"
+# ========== 自动标签：名词候选 + TF-IDF 排序（见 tagging.py） ==========
+# 用户日记少于这么多篇时，IDF 用训练好的 TF-IDF 向量器，而不是用户自己的语料
+app.config['TAG_MIN_CORPUS'] = int(os.environ.get('TAG_MIN_CORPUS', 20))
+tagger = tagging.Tagger()
+_shipped_idf = []
+
+
+def tags_version():
+    # 同一个字符串也写进 entry.tags_model；没有词性标注数据时结果不同，单独一个版本
+    return f"{TAGS_VERSION}/{tagger.kind}"
+
 
-    # 兜底：遇到奇怪标签就退回规则版
-    return rule_based()
+def shipped_idf():
+    if not _shipped_idf:
+        _shipped_idf.append(tagging.load_vectorizer_idf(os.path.join(basedir, 'models', 'tfidf_vectorizer.joblib')))
+    return _shipped_idf[0]
 
 
-def extract_tags(text):
-    blob = TextBlob(text)
-    nouns = []
-    for word, pos in blob.tags:
-        if pos.startswith('NN') and len(word) > 2:
-            nouns.append(word.lower())
-    unique = sorted(set(nouns))
-    return ", ".join(unique[:5])
+def user_idf(user_id, words):
+    """IDF from the user's own entries when there are enough of them, else from the shipped vectorizer."""
+    if user_id is not None and app.config['SEARCH_FTS']:
+        conn = db.session.connection()
+        doc_count = db.session.query(db.func.count(Entry.id)).filter(Entry.user_id == user_id).scalar()
+        if doc_count >= app.config['TAG_MIN_CORPUS']:
+            return tagging.corpus_idf(doc_count, search_index.document_frequencies(conn, user_id, words))
+    return shipped_idf()
+
+
+@timed('tags.extract')
+def tag_candidates_many(texts, use_cache=True):
+    """Noun counts per text; the POS tagging (the slow part) is cached by text."""
+    version = tags_version()
+    values = [nlp_cache.get('tag-candidates', version, t) if use_cache else MISSING for t in texts]
+    missing = [i for i, v in enumerate(values) if v is MISSING]
+    if missing:
+        computed = tagger.candidates_many([texts[i] for i in missing])
+        encoded = [tagging.encode_counts(c) for c in computed]
+        for i, value in zip(missing, encoded):
+            values[i] = value
+        nlp_cache.set_many('tag-candidates', version, [(texts[i], v) for i, v in zip(missing, encoded)])
+    return [tagging.decode_counts(v) for v in values]
+
+
+def rank_tags(user_id, candidates):
+    """Tag strings for one user's candidate counts, one IDF lookup for the whole batch."""
+    if not any(candidates):
+        return ['' for _ in candidates]
+    idf = user_idf(user_id, set().union(*candidates))
+    return [tagging.format_tags(tagging.rank(c, idf)) for c in candidates]
+
+
+def extract_tags_many(texts, user_id=None):
+    return rank_tags(user_id, tag_candidates_many(list(texts)))
+
+
+def extract_tags(text, user_id=None):
+    return extract_tags_many([text], user_id)[0]
+
+
+def cached_tags(text, user_id=None):
+    """The auto tags for ``text`` if its candidates are cached, or None if they still need computing."""
+    value = nlp_cache.get('tag-candidates', tags_version(), text)
+    if value is MISSING:
+        return None
+    return rank_tags(user_id, [tagging.decode_counts(value)])[0]
+
+
+def _extract_tags(text):
+    """Uncached, corpus-independent extraction (used by the benchmarks)."""
+    return tagging.format_tags(tagging.rank(tagger.candidates_many([text])[0], shipped_idf()))
+
+
+# ========== 正文压缩，见 text_codec.py ==========
+app.config['ENTRY_TEXT_COMPRESSION'] = os.environ.get('ENTRY_TEXT_COMPRESSION', 'none')  # none / zlib / zstd
+app.config['ENTRY_TEXT_COMPRESSION_LEVEL'] = int(os.environ.get('ENTRY_TEXT_COMPRESSION_LEVEL', 6))
+app.config['ENTRY_TEXT_COMPRESSION'] = text_codec.configure(app.config['ENTRY_TEXT_COMPRESSION'],
+                                                            app.config['ENTRY_TEXT_COMPRESSION_LEVEL'])
 
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(150), unique=True, nullable=False)
-    password = db.Column(db.String(150), nullable=False)
+    # scrypt 哈希约 160 个字符；SQLite 不检查长度，老库不用迁移
+    password = db.Column(db.String(255), nullable=False)
+    # 这个用户的日记每次增 / 改 / 删都 +1（_sync_derived_tables），整页缓存按它失效
+    data_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     entries = db.relationship('Entry', backref='user', lazy=True)
 
 
 class Entry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(150), nullable=False, default="")
-    text = db.Column(db.Text, nullable=False)
+    text = db.Column(text_codec.CompressedText, nullable=False)
     tags = db.Column(db.String(200), nullable=True)
     mood = db.Column(db.String(50), nullable=True)
+    # 情绪是谁给的：mood_cache_version() / 'manual'（用户手选）/ NULL（旧数据、导入）
+    mood_model = db.Column(db.String(200), nullable=True)
+    # 自动标签是哪个版本生成的：tags_version() / 'manual' / NULL（旧数据）
+    tags_model = db.Column(db.String(50), nullable=True)
+    # 列表卡片用的摘要和字数，随 text 一起更新（见 _update_excerpt）
+    excerpt = db.Column(db.String(excerpts.EXCERPT_LENGTH + 3), nullable=True)
+    word_count = db.Column(db.Integer, nullable=True)
     date_created = db.Column(db.DateTime, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    __table_args__ = (
+        # dashboard 的 GROUP BY mood 只扫这个索引，不碰正文
+        db.Index('ix_entry_user_mood', 'user_id', 'mood'),
+        # 列表 / 搜索按时间倒序的 keyset 分页
+        db.Index('ix_entry_user_date_id', 'user_id', 'date_created', 'id'),
+    )
+
+
+@event.listens_for(Entry.text, 'set')
+def _update_excerpt(target, value, oldvalue, initiator):
+    target.excerpt = excerpts.make_excerpt(value)
+    target.word_count = excerpts.word_count(value)
+
+
+# 列表 / 搜索页不读正文；模板里误用 e.text 会直接报错，而不是悄悄每行多查一次
+LIST_VIEW = defer(Entry.text, raiseload=True)
+
+
+class EntryTag(db.Model):
+    """One row per (entry, tag); Entry.tags keeps the display string."""
+    __tablename__ = entry_tags.TAG_TABLE
+    entry_id = db.Column(db.Integer, db.ForeignKey('entry.id', ondelete='CASCADE'), primary_key=True)
+    tag = db.Column(db.String(entry_tags.MAX_TAG_LENGTH), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        # 精确标签查询 / 标签统计都是这个索引上的范围扫描
+        db.Index('ix_entry_tag_user_tag', 'user_id', 'tag', 'entry_id'),
+    )
+
+
+class EntryEmbedding(db.Model):
+    """One float16 vector per entry (see embeddings.py); model says which encoder produced it."""
+    __tablename__ = embeddings.EMBEDDING_TABLE
+    entry_id = db.Column(db.Integer, db.ForeignKey('entry.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    model = db.Column(db.String(200), nullable=False)
+    dim = db.Column(db.Integer, nullable=False)
+    vector = db.Column(db.LargeBinary, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_entry_embedding_user_model', 'user_id', 'model'),
+    )
+
+
+class RecalcCheckpoint(db.Model):
+    """Progress of a resumable recalc job (see recalc.py)."""
+    __tablename__ = recalc.CHECKPOINT_TABLE
+    job = db.Column(db.String(100), primary_key=True)
+    params = db.Column(db.Text)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    changed = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.String(32))
+    updated_at = db.Column(db.String(32))
+    finished_at = db.Column(db.String(32))
+
+
+class MoodRollup(db.Model):
+    """Entries per (user, day, mood), kept in step with Entry by _sync_derived_tables."""
+    __tablename__ = mood_rollup.ROLLUP_TABLE
+    user_id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.String(10), primary_key=True)  # 'YYYY-MM-DD'，和 SQLite date() 一致
+    mood = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+# 启动时自动跑还没应用的迁移（AUTO_MIGRATE=0 关掉，改用 flask db_upgrade 手动跑）
+app.config['AUTO_MIGRATE'] = os.environ.get('AUTO_MIGRATE', '1') == '1'
 
 with app.app_context():
+    # 新库：create_all 建好全部表和索引；老库：缺的列 / 索引 / 回填交给迁移
     db.create_all()
+    with db.engine.begin() as conn:
+        app.config['SEARCH_FTS'] = search_index.ensure_schema(conn)
+    if not app.config['SEARCH_FTS'] and app.config['ENTRY_TEXT_COMPRESSION'] != 'none':
+        # 没有 FTS5 时 /search 退回 SQL 里的 LIKE，压缩存储的正文匹配不到
+        raise RuntimeError("ENTRY_TEXT_COMPRESSION requires SQLite FTS5 for /search; "
+                           "set ENTRY_TEXT_COMPRESSION=none on this database")
+    if app.config['AUTO_MIGRATE']:
+        migrations.upgrade(db.engine)
+    elif migrations.pending(db.engine):
+        print("⚠️ Database has pending migrations, run `flask db_upgrade`.")
+    if shard_router is not None:
+        with db.engine.begin() as conn:
+            sharding.ensure_schema(conn)
+        # 每个分片都是完整的一套表；FTS 是否可用以主库为准
+        for shard_engine in shard_engines:
+            db.metadata.create_all(shard_engine)
+            with shard_engine.begin() as conn:
+                search_index.ensure_schema(conn)
+            if app.config['AUTO_MIGRATE']:
+                migrations.upgrade(shard_engine)
+            elif migrations.pending(shard_engine):
+                print(f"⚠️ Shard {shard_engine.url.database} has pending migrations, run `flask db_upgrade`.")
+
+# 分片模式下 entry.id 由主库统一按块分配，各分片之间不重复（见 sharding.IdAllocator）
+entry_ids = None
+if shard_router is not None:
+    entry_ids = sharding.IdAllocator(shard_router.primary, 'entry')
+    first_id = 1
+    for engine in (shard_router.primary, *shard_engines):
+        with engine.connect() as conn:
+            first_id = max(first_id, (conn.execute(db.text("SELECT max(id) FROM entry")).scalar() or 0) + 1)
+    entry_ids.start_at(first_id)
+
+
+@event.listens_for(Entry, 'before_insert')
+def _assign_entry_id(mapper, connection, target):
+    if entry_ids is not None and target.id is None:
+        target.id = entry_ids.next_id()
+
+
+def data_engine():
+    """Engine holding the entries of the active shard (the primary when sharding is off)."""
+    return sharding.active_engine() or db.engine
+
+
+@contextmanager
+def on_shard(name):
+    """Run the block against shard ``name``; None keeps whatever is active."""
+    if shard_router is None or name is None:
+        yield
+        return
+    with shard_router.activate(name):
+        yield
+
+
+# ========== 派生表同步：全文索引 entry_fts、标签表 entry_tag、每日情绪汇总 mood_rollup ==========
+# 每次 flush 结束后按批处理，批量导入时不会变成每行好几条 SQL
+def _changed(entry, names):
+    state = sa_inspect(entry)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+def _old_value(entry, name):
+    # after_flush 里 history 还是 flush 前的：deleted 就是改之前的值
+    history = sa_inspect(entry).attrs[name].history
+    return history.deleted[0] if history.deleted else getattr(entry, name)
+
+
+def _rollup_key(entry, old=False):
+    if old:
+        return entry.user_id, _old_value(entry, 'date_created'), _old_value(entry, 'mood')
+    return entry.user_id, entry.date_created, entry.mood
+
+
+def bump_data_version(conn, user_ids):
+    """Invalidate the cached pages of ``user_ids`` (in the caller's transaction)."""
+    if user_ids:
+        conn.execute(User.__table__.update().where(User.id.in_(sorted(user_ids)))
+                     .values(data_version=User.data_version + 1))
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _sync_derived_tables(session, flush_context):
+    inserted = [o for o in session.new if isinstance(o, Entry)]
+    updated = [o for o in session.dirty if isinstance(o, Entry)]
+    deleted = [o for o in session.deleted if isinstance(o, Entry)]
+    if not (inserted or updated or deleted):
+        return
+    conn = session.connection()
+    bump_data_version(conn, {e.user_id for e in inserted + deleted}
+                      | {e.user_id for e in updated if session.is_modified(e)})
+
+    fts_rows = [(e.id, e.user_id, e.title, e.text, e.tags) for e in inserted]
+    tag_rows = [(e.id, e.user_id, e.tags) for e in inserted]
+    if app.config['SEARCH_FTS']:
+        search_index.index_entries(conn, fts_rows)
+    entry_tags.backfill(conn, tag_rows)
+
+    if app.config['SEARCH_FTS']:
+        search_index.reindex_entries(conn, [
+            (e.id, e.user_id, e.title, e.text, e.tags)
+            for e in updated if _changed(e, ('title', 'text', 'tags'))
+        ])
+    entry_tags.replace_many(conn, [
+        (e.id, e.user_id, e.tags) for e in updated if _changed(e, ('tags',))
+    ])
+
+    if deleted:
+        ids = [e.id for e in deleted]
+        if app.config['SEARCH_FTS']:
+            search_index.remove_entries(conn, ids)
+        entry_tags.delete_for_entries(conn, ids)
+
+    # 正文变了的向量作废，之后由 enrichment / 查询时补算
+    stale = deleted + [e for e in updated if _changed(e, ('title', 'text'))]
+    if stale:
+        embeddings.delete_for_entries(conn, [e.id for e in stale])
+        for user_id in {e.user_id for e in stale}:
+            vector_indexes.invalidate_user(user_id)
+
+    mood_rollup.apply_deltas(conn, mood_rollup.entry_deltas(
+        inserted=[_rollup_key(e) for e in inserted],
+        deleted=[_rollup_key(e, old=True) for e in deleted],
+        moved=[(_rollup_key(e, old=True), _rollup_key(e))
+               for e in updated if _changed(e, ('mood', 'date_created'))],
+    ))
+
+
+def get_mood_counts(user_id):
+    """{mood: count} for one user, summed from the daily rollup (O(days), not O(entries))."""
+    return mood_rollup.mood_totals(db.session.connection(), user_id)
+
+
+def get_mood_summary(user_id, days=90, window=7):
+    rows = mood_rollup.daily_rows(db.session.connection(), user_id)
+    return mood_analytics.summary(rows, today=datetime.utcnow().date(), days=days, window=window)
+
+# ========== 相似日记：embedding + 向量索引 ==========
+app.config['EMBEDDINGS_ENABLED'] = os.environ.get('EMBEDDINGS_ENABLED', '1') == '1'
+# hashing：纯 NumPy，不用下载模型；sentence-transformers：更准，需要装 sentence-transformers
+app.config['EMBEDDING_BACKEND'] = os.environ.get('EMBEDDING_BACKEND', 'hashing')
+app.config['EMBEDDING_MODEL'] = os.environ.get('EMBEDDING_MODEL', embeddings.DEFAULT_ST_MODEL)
+app.config['EMBEDDING_BATCH_SIZE'] = int(os.environ.get('EMBEDDING_BATCH_SIZE', 64))
+# 请求里最多顺手补算多少条缺失的向量，剩下的交给 flask build_embeddings
+app.config['EMBEDDING_LAZY_LIMIT'] = int(os.environ.get('EMBEDDING_LAZY_LIMIT', 256))
+# 一个用户的向量超过这个数就用 IVF 近似索引，否则暴力矩阵乘
+app.config['EMBEDDING_IVF_THRESHOLD'] = int(os.environ.get('EMBEDDING_IVF_THRESHOLD', 5000))
+app.config['SIMILAR_ENTRIES'] = int(os.environ.get('SIMILAR_ENTRIES', 5))
+SEMANTIC_CANDIDATES = 100  # /search?sort=similar 最多返回多少条
+embedder = EmbeddingProvider(app.config['EMBEDDING_BACKEND'], model_name=app.config['EMBEDDING_MODEL'])
+vector_indexes = IndexCache(ttl=int(os.environ.get('EMBEDDING_INDEX_TTL', 300)))
+
+
+def _embed_missing(conn, model, user_id, limit, after_id):
+    rows = embeddings.missing_entries(conn, model, user_id=user_id, limit=limit, after_id=after_id)
+    if rows:
+        with span('embeddings.encode'):
+            vectors = embedder.encode([embeddings.entry_text(r.title, text_codec.decode(r.text)) for r in rows],
+                                      batch_size=app.config['EMBEDDING_BATCH_SIZE'])
+        embeddings.store(conn, [(r.id, r.user_id, v) for r, v in zip(rows, vectors)], model)
+        # 新向量会改变别的日记页上的「相似日记」
+        bump_data_version(conn, {r.user_id for r in rows})
+        for uid in {r.user_id for r in rows}:
+            vector_indexes.invalidate_user(uid)
+    return rows
+
+
+def ensure_embeddings(user_id=None, limit=None, connection=None, after_id=0):
+    """
+    Compute missing vectors (one user's or everyone's), up to ``limit``;
+    returns how many. Only entries with id > ``after_id`` are looked at.
+    With ``connection`` the rows are written in the caller's transaction,
+    otherwise each batch is committed on its own.
+    """
+    model = embedder.version
+    batch_size = app.config['EMBEDDING_BATCH_SIZE']
+    done, last_id = 0, after_id
+    while limit is None or done < limit:
+        size = batch_size if limit is None else min(batch_size, limit - done)
+        if connection is not None:
+            rows = _embed_missing(connection, model, user_id, size, last_id)
+        else:
+            # 写主库（或当前分片）：只读页面里调用时 session 可能连的是只读连接
+            with data_engine().begin() as conn:
+                rows = _embed_missing(conn, model, user_id, size, last_id)
+        if not rows:
+            break
+        done += len(rows)
+        last_id = rows[-1].id
+    return done
+
+
+def user_vector_index(user_id):
+    model = embedder.version
+    # 大多数时候向量都已由 enrichment 算好：先用当前连接看一眼，缺了才开写连接
+    if embeddings.missing_entries(db.session.connection(), model, user_id=user_id, limit=1):
+        ensure_embeddings(user_id, limit=app.config['EMBEDDING_LAZY_LIMIT'])
+
+    def build():
+        ids, vectors = embeddings.load_user_vectors(db.session.connection(), user_id, model)
+        if vectors is None:
+            return None
+        return build_index(ids, vectors.astype('float32'), ivf_threshold=app.config['EMBEDDING_IVF_THRESHOLD'])
+
+    return vector_indexes.get_or_build(user_id, model, build)
+
+
+def similar_entry_ids(user_id, entry=None, text=None, k=None):
+    """[(entry_id, cosine similarity)] of the user's entries closest to ``entry`` or to free ``text``."""
+    if not app.config['EMBEDDINGS_ENABLED']:
+        return []
+    k = k or app.config['SIMILAR_ENTRIES']
+    with span('embeddings.search'):
+        index = user_vector_index(user_id)
+        if index is None:
+            return []
+        query = None
+        if entry is not None:
+            query = embeddings.load_vector(db.session.connection(), entry.id, embedder.version)
+            text = embeddings.entry_text(entry.title, entry.text)
+        if query is None:
+            query = embedder.encode([text])[0]
+        exclude = {entry.id} if entry is not None else ()
+        # 一个共同词都没有的（相似度 <= 0）不算相似
+        return [(i, score) for i, score in index.search(query, k=k, exclude=exclude) if score > 0]
+
+
+def similar_entries(user_id, entry=None, text=None, k=None):
+    """[(Entry, similarity)] best first."""
+    hits = similar_entry_ids(user_id, entry=entry, text=text, k=k)
+    if not hits:
+        return []
+    by_id = {e.id: e for e in Entry.query.options(LIST_VIEW).filter(Entry.id.in_([i for i, _ in hits]))}
+    return [(by_id[i], score) for i, score in hits if i in by_id]
+
+
+# ========== 后台 enrichment：保存先返回，情绪 / 标签异步补全 ==========
+# mood == 'pending' / tags 为 NULL 表示还在等后台计算
+MOOD_PENDING = 'pending'
+# mood_model / tags_model == 'manual' 表示是用户自己选 / 填的
+MANUAL = 'manual'
+app.config['ENRICH_MODE'] = os.environ.get('ENRICH_MODE', 'thread')  # thread / sync
+app.config['ENRICH_WORKERS'] = int(os.environ.get('ENRICH_WORKERS', 2))
+app.config['ENRICH_QUEUE_SIZE'] = int(os.environ.get('ENRICH_QUEUE_SIZE', 1000))
+app.config['ENRICH_MAX_RETRIES'] = int(os.environ.get('ENRICH_MAX_RETRIES', 3))
+app.config['ENRICH_DRAIN_TIMEOUT'] = float(os.environ.get('ENRICH_DRAIN_TIMEOUT', 10))
+
+
+def enrich_entry(entry_id, use_model=True, shard=None):
+    """Fill in the pending mood and/or auto tags of one entry (on ``shard``, default the active one)."""
+    with app.app_context(), on_shard(shard):
+        entry = db.session.get(Entry, entry_id)
+        if entry is None:
+            return
+        text = entry.text
+        mood = tags = None
+        if entry.mood == MOOD_PENDING:
+            mood = predict_mood(text) if use_model else mood_from_label(text)
+        if entry.tags is None:
+            tags = extract_tags(text, entry.user_id) if use_model else ''
+
+        # 计算期间用户可能又改了这篇日记：只覆盖仍然 pending 的字段
+        db.session.refresh(entry)
+        if entry.text != text:
+            return
+        if mood is not None and entry.mood == MOOD_PENDING:
+            entry.mood = mood
+            entry.mood_model = mood_cache_version(use_model)
+        if tags is not None and entry.tags is None:
+            entry.tags = tags
+            entry.tags_model = tags_version() if use_model else None
+        if app.config['EMBEDDINGS_ENABLED']:
+            # 和 mood / tags 同一个事务写入，不另占一个连接
+            db.session.flush()
+            ensure_embeddings(entry.user_id, limit=app.config['EMBEDDING_BATCH_SIZE'],
+                              connection=db.session.connection())
+        if shard is not None and _enrichment_shard(entry.user_id) != shard:
+            # 算的过程中用户开始搬家了：写进旧分片会随搬家一起丢掉，
+            # 这次不写，搬完后 move_user_to_shard 会在新分片上重新排队
+            db.session.rollback()
+            return
+        db.session.commit()
+        vector_indexes.invalidate_user(entry.user_id)
+
+
+def _enrichment_shard(user_id):
+    """The shard a queued job for ``user_id`` should write to now; None while the user is being moved."""
+    if shard_router is None:
+        return sharding.MAIN
+    shard, state = shard_router.lookup(user_id)
+    return None if state == sharding.MOVING else shard
+
+
+def _enrichment_job(key, use_model=True):
+    # 队列里的 key 是 (user id, entry id)：分片在执行时才查，排队期间用户可能已经搬走
+    user_id, entry_id = key
+    shard = _enrichment_shard(user_id)
+    if shard is None:
+        return
+    enrich_entry(entry_id, use_model=use_model, shard=shard)
+
+
+def _enrichment_failed(key, exc):
+    # 重试都失败了：退回纯规则版，不让日记一直卡在 pending
+    _enrichment_job(key, use_model=False)
+
+
+enrichment_queue = EnrichmentQueue(
+    _enrichment_job,
+    workers=app.config['ENRICH_WORKERS'],
+    maxsize=app.config['ENRICH_QUEUE_SIZE'],
+    max_retries=app.config['ENRICH_MAX_RETRIES'],
+    on_failure=_enrichment_failed,
+)
+instrumentation.register_gauges(
+    lambda: {f"diary_enrichment_{k}": v for k, v in enrichment_queue.stats().items()})
+
+
+@atexit.register
+def _drain_enrichment():
+    # worker 线程是 daemon：退出前给排队的任务一点时间做完，剩下的留着 pending 给 flask enrich_pending
+    if not enrichment_queue.join(timeout=app.config['ENRICH_DRAIN_TIMEOUT']):
+        print(f"⚠️ Enrichment queue not drained at exit, {enrichment_queue.stats()['queued']} entries left pending "
+              "(run `flask enrich_pending`)")
+
+
+def needs_enrichment(entry):
+    # 开了相似日记时，新写 / 改过的日记也要在后台算向量
+    return entry.mood == MOOD_PENDING or entry.tags is None or app.config['EMBEDDINGS_ENABLED']
+
+
+def schedule_enrichment(entry):
+    """Enrich in the background; run inline in sync mode or when the queue is full."""
+    if app.config['ENRICH_MODE'] == 'sync' or not enrichment_queue.submit((entry.user_id, entry.id)):
+        enrich_entry(entry.id)
+
+
+# ========== 批量导入 / 导出 ==========
+IMPORT_ENRICH_MODES = ('batch', 'defer', 'none')
+
+
+def import_entries(user_id, records, batch_size=500, enrich='batch'):
+    """
+    Insert ``records`` (dicts from entry_transfer.read_records) for one user,
+    one transaction per batch. enrich='batch' scores moods / tags per batch,
+    'defer' leaves them pending for the enrichment queue, 'none' stores
+    imported values only. Returns (imported, skipped); an unreadable file
+    raises entry_transfer.ImportStopped with the counts committed so far.
+    """
+    imported = skipped = 0
+    valid_moods = set(MOOD_MAP)
+    batches = entry_transfer.batched(records, batch_size)
+    while True:
+        try:
+            batch = next(batches)
+        except StopIteration:
+            break
+        except (ValueError, UnicodeDecodeError) as e:
+            # 文件读到一半出错：已经提交的批次留着，告诉调用方提交到了哪里
+            db.session.rollback()
+            total_counts.invalidate_user(user_id)
+            raise entry_transfer.ImportStopped(e, imported, skipped) from e
+        rows = []
+        for record in batch:
+            try:
+                rows.append(entry_transfer.normalize_record(record, valid_moods))
+            except ValueError as e:
+                skipped += 1
+                print(f"Skipped record: {e}")
+        if not rows:
+            continue
+
+        for r in rows:
+            # 文件里带了标签的按用户自己填的算
+            r['tags_model'] = MANUAL if r['tags'] else None
+        if enrich == 'batch':
+            need_mood = [r for r in rows if r['mood'] is None]
+            for r, mood in zip(need_mood, predict_moods([r['text'] for r in need_mood])):
+                r['mood'] = mood
+                r['mood_model'] = mood_cache_version()
+            need_tags = [r for r in rows if r['tags'] is None]
+            for r, tags in zip(need_tags, extract_tags_many([r['text'] for r in need_tags], user_id)):
+                r['tags'] = tags
+                r['tags_model'] = tags_version()
+        elif enrich == 'defer':
+            for r in rows:
+                r['mood'] = r['mood'] or MOOD_PENDING
+        else:
+            for r in rows:
+                r['mood'] = r['mood'] or 'neutral'
+                r['tags'] = r['tags'] or ''
+
+        entries = [Entry(user_id=user_id, title=r['title'], text=r['text'], tags=r['tags'],
+                         mood=r['mood'], mood_model=r.get('mood_model'), tags_model=r.get('tags_model'),
+                         date_created=r['date_created'] or datetime.utcnow())
+                   for r in rows]
+        db.session.add_all(entries)
+        if enrich == 'batch' and app.config['EMBEDDINGS_ENABLED']:
+            db.session.flush()
+            ensure_embeddings(user_id, limit=len(entries), connection=db.session.connection(),
+                              after_id=min(e.id for e in entries) - 1)
+        db.session.commit()
+        vector_indexes.invalidate_user(user_id)
+        imported += len(entries)
+
+        if enrich == 'defer':
+            # 队列满了就先留着 pending，之后由 flask enrich_pending 补上
+            for e in entries:
+                if e.mood == MOOD_PENDING or e.tags is None:
+                    enrichment_queue.submit((user_id, e.id))
+    total_counts.invalidate_user(user_id)
+    return imported, skipped
+
+
+def export_rows(user_id, batch_size=1000):
+    """Stream one user's entries as tuples of entry_transfer.EXPORT_FIELDS."""
+    columns = [getattr(Entry, name) for name in entry_transfer.EXPORT_FIELDS]
+    return (
+        db.session.query(*columns)
+        .filter(Entry.user_id == user_id)
+        .order_by(Entry.id)
+        .yield_per(batch_size)
+    )
+
+
+def export_stream(user_id, fmt):
+    rows = export_rows(user_id)
+    if fmt == 'csv':
+        return entry_transfer.export_csv(rows)
+    return entry_transfer.export_jsonl(rows)
+
+
+# ========== 整页缓存：dashboard / 列表 / 单篇，按用户数据版本号失效 ==========
+# 改了这几个页面的模板时 +1，旧的缓存页（包括 SQLite 里的）就不会再用
+PAGE_CACHE_VERSION = 1
+app.config['RESPONSE_CACHE_BACKEND'] = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')  # memory / sqlite / none
+app.config['RESPONSE_CACHE_PATH'] = os.environ.get('RESPONSE_CACHE_PATH', os.path.join(basedir, 'page_cache.db'))
+app.config['RESPONSE_CACHE_SIZE'] = int(os.environ.get('RESPONSE_CACHE_SIZE', 500))
+app.config['RESPONSE_CACHE_TTL'] = int(os.environ.get('RESPONSE_CACHE_TTL', 600))
+
+
+def data_version(user_id):
+    return db.session.query(User.data_version).filter_by(id=user_id).scalar()
+
+
+page_cache = response_cache.ResponseCache(
+    response_cache.make_backend(
+        app.config['RESPONSE_CACHE_BACKEND'],
+        path=app.config['RESPONSE_CACHE_PATH'],
+        max_entries=app.config['RESPONSE_CACHE_SIZE'],
+        ttl=app.config['RESPONSE_CACHE_TTL'],
+    ),
+    version_of=data_version,
+    namespace=PAGE_CACHE_VERSION,
+)
+instrumentation.register_gauges(
+    lambda: {f"diary_page_cache_{k}": v for k, v in page_cache.stats().items()})
+
+
+# ========== 登录：当前用户 / 密码哈希，见 auth.py ==========
+# 例如 scrypt:65536:8:1 或 pbkdf2:sha256:1000000；改了之后老用户下次登录时自动重算
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', auth.DEFAULT_METHOD)
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 2))
+
+password_hasher = auth.PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_waiting=app.config['PASSWORD_HASH_QUEUE'],
+    timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+)
+instrumentation.register_gauges(
+    lambda: {f"diary_password_hash_{k}": v for k, v in password_hasher.stats().items()})
+
+
+def _load_user(user_id):
+    return db.session.query(User.id, User.username).filter_by(id=user_id).first()
+
+
+current_user = auth.CurrentUser(_load_user)
+BUSY_MESSAGE = 'The server is busy, please try again in a moment.'
+
+
+# ========== 分片路由：每个请求按登录用户切到他的分片，见 sharding.py ==========
+# 登录 / 注册查的是主库的账号表，不切
+PRIMARY_ENDPOINTS = {'index', 'signup', 'login', 'logout', 'static'}
+
+if shard_router is not None:
+    @app.before_request
+    def _enter_user_shard():
+        user_id = session.get('user_id')
+        if user_id is None or request.endpoint in PRIMARY_ENDPOINTS:
+            return
+        shard, state = shard_router.lookup(user_id)
+        # 正在搬家：还能看（读旧分片），不能写
+        if state == sharding.MOVING and request.method != 'GET':
+            abort(503, description='Your diary is being moved to new storage, please try again in a minute.')
+        g.shard_token = shard_router.enter(shard)
+
+    @app.teardown_request
+    def _leave_user_shard(exc):
+        token = g.pop('shard_token', None)
+        if token is not None:
+            sharding.leave(token)
 
 
 @app.route('/')
@@ -234,10 +900,16 @@ def signup():
         if existing_user:
             flash('Username already exists. Please choose another.', 'danger')
             return redirect(url_for('signup'))
-        hashed_password = generate_password_hash(password)
+        try:
+            hashed_password = password_hasher.hash(password)
+        except auth.HasherBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('signup.html'), 503
         new_user = User(username=username, password=hashed_password)
         db.session.add(new_user)
         db.session.commit()
+        if shard_router is not None:
+            shard_router.assign(new_user.id, new_user.username)
         flash('Account created successfully! Please log in.', 'success')
         return redirect(url_for('login'))
     return render_template('signup.html')
@@ -249,8 +921,17 @@ def login():
         username = request.form['username']
         password = request.form['password']
         user = User.query.filter_by(username=username).first()
-        if user and check_password_hash(user.password, password):
-            session['user_id'] = user.id
+        try:
+            ok, new_hash = password_hasher.verify_and_update(user.password, password) if user else (False, None)
+        except auth.HasherBusy:
+            flash(BUSY_MESSAGE, 'danger')
+            return render_template('login.html'), 503
+        if ok:
+            if new_hash:
+                # 哈希参数换过了：趁有明文密码的时候按新参数重存
+                user.password = new_hash
+                db.session.commit()
+            current_user.remember(user)
             flash('Logged in successfully!', 'success')
             return redirect(url_for('dashboard'))
         else:
@@ -260,18 +941,71 @@ def login():
 
 
 @app.route('/dashboard')
+@read_only
+@page_cache.cached
 def dashboard():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['user_id'])
-    entries = Entry.query.filter_by(user_id=user.id).all()
-    mood_counts = {}
-    for e in entries:
-        mood_counts[e.mood] = mood_counts.get(e.mood, 0) + 1
-    pie_chart = None
-    if entries:
-        pie_chart = generate_pie_chart(mood_counts)
-    return render_template('dashboard.html', entries=entries, pie_chart=pie_chart, username=user.username)
+    user = current_user.get()
+    mood_counts = get_mood_counts(user.id)
+    total_entries = sum(mood_counts.values())
+    # 图本身走 /chart/mood.svg；URL 里带上分布的 hash，分布不变浏览器就直接用缓存
+    chart_version = chart_etag(mood_counts) if total_entries else None
+    top_tags = entry_tags.tag_counts(db.session.connection(), user.id, limit=12)
+    trends = get_mood_summary(user.id)
+    trend_svg = Markup(render_trend_svg(trends['rolling_score'])) if trends['has_data'] else None
+    return render_template('dashboard.html', total_entries=total_entries, chart_version=chart_version,
+                           top_tags=top_tags, trends=trends, trend_svg=trend_svg, username=user.username)
+
+
+@app.route('/analytics/moods')
+@read_only
+def mood_trends():
+    """JSON mood counts / scores per day, week or month, for charts."""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    period = request.args.get('period', 'week')
+    if period not in mood_analytics.PERIODS:
+        abort(400)
+    days = min(max(request.args.get('days', 365, type=int), 1), 3660)
+    window = request.args.get('window', type=int)
+    if window is not None:
+        window = min(max(window, 1), days)
+    end = datetime.utcnow().date()
+    start = end - timedelta(days=days - 1)
+    rows = mood_rollup.daily_rows(db.session.connection(), session['user_id'],
+                                  start.isoformat(), end.isoformat())
+    return {
+        'period': period,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'points': mood_analytics.trend(rows, start, end, period=period, window=window),
+    }
+
+
+@app.route('/chart/mood.<fmt>')
+@read_only
+def mood_chart(fmt):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    if fmt not in ('svg', 'png'):
+        abort(404)
+    mood_counts = get_mood_counts(session['user_id'])
+    etag = chart_etag(mood_counts)
+    with span('chart.render'):
+        if fmt == 'svg':
+            response = make_response(render_mood_svg(mood_counts))
+            response.mimetype = 'image/svg+xml'
+        else:
+            response = make_response(render_mood_png(mood_counts))
+            response.mimetype = 'image/png'
+    response.set_etag(etag)
+    if request.args.get('v') == etag:
+        # 带版本号的 URL 内容永远不变
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
 
 
 @app.route('/add_entry', methods=['GET', 'POST'])
@@ -288,41 +1022,47 @@ def add_entry():
         else:
             date_created = datetime.utcnow()
         manual_tags = request.form.get('tags', '').strip()
-        if manual_tags:
-            tags = manual_tags
-        else:
-            tags = extract_tags(text)  # 用户没填 → 自动生成一份
+        # 用户没填 tags → 先查缓存，没有就留空（NULL），由后台自动生成一份
+        tags = manual_tags or cached_tags(text, session['user_id'])
+        mood = cached_mood(text)
 
-        mood = predict_mood(text)
         new_entry = Entry(
             title=title,
             text=text,
             tags=tags,
-            mood=mood,
+            tags_model=MANUAL if manual_tags else (tags_version() if tags is not None else None),
+            mood=mood or MOOD_PENDING,
+            mood_model=mood_cache_version() if mood else None,
             date_created=date_created,
             user_id=session['user_id']
         )
         db.session.add(new_entry)
         db.session.commit()
+        total_counts.invalidate_user(session['user_id'])
+        if needs_enrichment(new_entry):
+            schedule_enrichment(new_entry)
         flash('Entry added successfully! 🎉', 'success')
         return redirect(url_for('dashboard'))
     return render_template('add_entry.html', datetime=datetime, from_dashboard=from_dashboard)
 
 
 @app.route('/view_entries')
+@read_only
+@page_cache.cached
 def view_entries():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    user = User.query.get(session['user_id'])
+    user = current_user.get()
 
     page = request.args.get('page', 1, type=int)
 
-    pagination = (
-        Entry.query
-        .filter_by(user_id=user.id)
-        .order_by(Entry.date_created.desc())
-        .paginate(page=page, per_page=PER_PAGE, error_out=False)
+    query = Entry.query.options(LIST_VIEW).filter_by(user_id=user.id)
+    total = total_counts.get_or_count(user.id, 'all', lambda: query.with_entities(Entry.id).count())
+    pagination = keyset_paginate(
+        query, Entry.date_created, Entry.id,
+        page=page, per_page=PER_PAGE, total=total,
+        after=request.args.get('after'), before=request.args.get('before'),
     )
     entries = pagination.items
     page_window = build_page_window(pagination)
@@ -334,6 +1074,7 @@ def view_entries():
         page_window=page_window
     )
 @app.route('/entry/<int:entry_id>')
+@page_cache.cached
 def view_entry(entry_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -351,24 +1092,30 @@ def view_entry(entry_id):
         'keyword':   request.args.get('keyword', ''),
         'tags':      request.args.get('tags', ''),
         'mood':      request.args.get('mood', 'all'),
+        'sort':      request.args.get('sort', ''),
+        'tag_mode':  request.args.get('tag_mode', 'all'),
         'date_from': request.args.get('date_from', ''),
         'date_to':   request.args.get('date_to', ''),
         'page':      request.args.get('page', 1),
     }
 
+    similar = similar_entries(entry.user_id, entry=entry)
+
     return render_template(
         'single_entry.html',     # ⚠️ 保持文件名 single_entry.html
         entry=entry,
+        similar=similar,
         from_search=from_search,
         search_params=search_params
     )
 
 @app.route('/search', methods=['GET'])
+@read_only
 def search_entries():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    user = User.query.get(session['user_id'])
+    user = current_user.get()
 
     # ① 第一次打开 /search（地址栏里没有任何 ?xxx=）→ 不搜索，直接渲染空列表
     if not request.args:
@@ -380,6 +1127,9 @@ def search_entries():
             keyword='',
             tag_text='',
             mood='all',          # HTML 里虽然写的是 "Choose mood"，value 还是 all
+            sort='relevance',
+            tag_mode='all',
+            snippets={},
             date_from='',
             date_to='',
             has_searched=False   # 告诉模板：还没真正搜索
@@ -392,20 +1142,38 @@ def search_entries():
     date_from = request.args.get('date_from', '')
     date_to   = request.args.get('date_to', '')
 
-    query = Entry.query.filter_by(user_id=user.id)
-
-    # 关键词
-    if keyword:
-        like = f"%{keyword}%"
+    query = Entry.query.options(LIST_VIEW).filter_by(user_id=user.id)
+
+    # 按意思找（sort=similar）：关键词不做字面匹配，取语义最接近的一批候选
+    semantic_ids = None
+    if keyword and request.args.get('sort') == 'similar' and app.config['EMBEDDINGS_ENABLED']:
+        semantic_ids = [i for i, _ in similar_entry_ids(user.id, text=keyword, k=SEMANTIC_CANDIDATES)]
+        query = query.filter(Entry.id.in_(semantic_ids))
+
+    # 关键词：有 FTS5 就走全文索引（前缀匹配 + 相关度排序），否则退回 LIKE
+    fts_query = None
+    literal = keyword if semantic_ids is None else ''
+    if literal and app.config['SEARCH_FTS']:
+        fts_query = search_index.build_match_query(literal, user.id)
+    if fts_query:
+        query = (
+            query.join(search_index.fts_table, search_index.fts_table.c.rowid == Entry.id)
+            .filter(search_index.match_clause(fts_query))
+        )
+    elif literal:
+        like = f"%{literal}%"
         query = query.filter(
             (Entry.title.ilike(like)) | (Entry.text.ilike(like))
         )
 
-    # tags（可多个，用逗号）
+    # tags（可多个，用逗号）：精确匹配 entry_tag 表，all = 全部都有，any = 有一个就行
+    tag_mode = request.args.get('tag_mode', 'all')
     if tag_text:
-        tags = [t.strip().lstrip('#') for t in tag_text.split(',') if t.strip()]
-        for t in tags:
-            query = query.filter(Entry.tags.ilike(f"%{t}%"))
+        tags = [t for t in tag_text.split(',') if t.strip()]
+        query = query.filter(Entry.id.in_(entry_tags.matching_entry_ids(user.id, tags, tag_mode)))
+
+    # 排序：有关键词时默认按相关度，否则按时间
+    sort = request.args.get('sort', 'relevance' if fts_query else 'date')
 
     # 心情
     if mood and mood != 'all':
@@ -428,22 +1196,50 @@ def search_entries():
 
     # 分页
     page = request.args.get('page', 1, type=int)
-    pagination = query.order_by(Entry.date_created.desc()).paginate(
-        page=page,
-        per_page=PER_PAGE,
-        error_out=False
-    )
+    if semantic_ids is not None:
+        sort = 'similar'
+        rank = {entry_id: n for n, entry_id in enumerate(semantic_ids)}
+        order = db.case(rank, value=Entry.id) if rank else Entry.id
+        pagination = query.order_by(order).paginate(page=page, per_page=PER_PAGE, error_out=False)
+        pagination.next_cursor = pagination.prev_cursor = None
+    elif fts_query and sort == 'relevance':
+        # 相关度排序没有稳定的 keyset，只能 OFFSET
+        pagination = query.order_by(search_index.rank_column(), Entry.date_created.desc()).paginate(
+            page=page,
+            per_page=PER_PAGE,
+            error_out=False
+        )
+        pagination.next_cursor = pagination.prev_cursor = None
+    else:
+        sort = 'date'
+        signature = tuple(sorted(
+            (k, v) for k, v in request.args.items() if k not in ('page', 'after', 'before')
+        ))
+        total = total_counts.get_or_count(user.id, signature, lambda: query.with_entities(Entry.id).count())
+        pagination = keyset_paginate(
+            query, Entry.date_created, Entry.id,
+            page=page, per_page=PER_PAGE, total=total,
+            after=request.args.get('after'), before=request.args.get('before'),
+        )
     entries = pagination.items
     page_window = build_page_window(pagination)
 
+    # 只给当前页的几条生成高亮摘要
+    snippets = {}
+    if fts_query:
+        snippets = search_index.snippets(db.session.connection(), fts_query, [e.id for e in entries])
+
     return render_template(
         'search.html',
         entries=entries,
         pagination=pagination,
         page_window=page_window,
+        snippets=snippets,
         keyword=keyword,
         tag_text=tag_text,
         mood=mood,
+        sort=sort,
+        tag_mode=tag_mode,
         date_from=date_from,
         date_to=date_to,
         has_searched=True     # 这次是真的搜过了
@@ -468,21 +1264,29 @@ def edit_entry(entry_id):
         if manual_tags:
             # 用户手动输入 → 完全按照用户的来
             entry.tags = manual_tags
+            entry.tags_model = MANUAL
         else:
-            # 用户把 tags 清空了 → 帮他重新自动生成一份
-            entry.tags = extract_tags(entry.text)
+            # 用户把 tags 清空了 → 重新自动生成一份（缓存没有就交给后台）
+            entry.tags = cached_tags(entry.text, entry.user_id)
+            entry.tags_model = tags_version() if entry.tags is not None else None
 
         # —— 新增：编辑时允许手动选择心情 ——
         mood_choice = request.form.get('mood_choice', 'auto')
 
         if mood_choice == 'auto':
-            # 让模型根据最新文本重新判断
-            entry.mood = predict_mood(entry.text)
+            # 让模型根据最新文本重新判断：文本没变会直接命中缓存，否则后台进行
+            mood = cached_mood(entry.text)
+            entry.mood = mood or MOOD_PENDING
+            entry.mood_model = mood_cache_version() if mood else None
         else:
-            # 用户手动选了具体心情 → 直接覆盖
+            # 用户手动选了具体心情 → 直接覆盖；recalc_mood 默认不动它
             entry.mood = mood_choice
+            entry.mood_model = MANUAL
 
         db.session.commit()
+        total_counts.invalidate_user(entry.user_id)
+        if needs_enrichment(entry):
+            schedule_enrichment(entry)
         flash('Entry updated!', 'success')
         return redirect(url_for('view_entries'))
     return render_template('edit_entry.html', entry=entry)
@@ -498,60 +1302,698 @@ def delete_entry(entry_id):
         return redirect(url_for("view_entries"))
     db.session.delete(entry)
     db.session.commit()
+    total_counts.invalidate_user(entry.user_id)
     flash("Entry deleted successfully!", "success")
     return redirect(url_for("view_entries"))
 
 
+@app.route('/export')
+@read_only
+def export_entries():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    fmt = request.args.get('format', 'jsonl')
+    if fmt not in entry_transfer.FORMATS:
+        abort(404)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(
+        stream_with_context(export_stream(session['user_id'], fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename=diary.{fmt}'},
+    )
+
+
+@app.route('/import', methods=['POST'])
+def import_entries_view():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Please choose a .jsonl or .csv file to import.', 'danger')
+        return redirect(url_for('dashboard'))
+    fmt = entry_transfer.guess_format(upload.filename)
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        # 网页导入：先入库，情绪 / 标签交给后台
+        imported, skipped = import_entries(session['user_id'],
+                                           entry_transfer.read_records(stream, fmt),
+                                           enrich='defer')
+    except entry_transfer.ImportStopped as e:
+        flash(f'Import stopped: {e.reason}. {e.progress()}', 'danger')
+        return redirect(url_for('dashboard'))
+    message = f'Imported {imported} entries.'
+    if skipped:
+        message += f' Skipped {skipped} invalid records.'
+    flash(message, 'success')
+    return redirect(url_for('dashboard'))
+
+
 @app.route('/logout')
 def logout():
-    session.clear()
+    current_user.forget()
     flash('Logged out successfully!', 'success')
     return redirect(url_for('login'))
 
 
-def generate_pie_chart(mood_counts):
-    mood_color_map = {
-        'joyful': '#7fd89e',
-        'sad': '#4A5568',
-        'angry': '#FF0000',
-        'fearful': '#9b59b6',
-        'excited': '#FFB6C1',
-        'calm': '#8ac6ee',
-        'neutral': '#bdc3c7',
-        'other': '#dadada'
-    }
-    labels = []
-    values = []
-    colors = []
-    for mood, count in mood_counts.items():
-        labels.append(mood.title())
-        values.append(count)
-        colors.append(mood_color_map.get(mood, mood_color_map['other']))
-    fig, ax = plt.subplots(figsize=(4.6, 4.6))
-    wedges, texts, autotexts = ax.pie(values, labels=labels, colors=colors, autopct='%1.1f%%',
-                                      startangle=140, pctdistance=0.77, textprops={'color': '#457458', 'fontsize': 13},
-                                      wedgeprops={'linewidth': 2, 'edgecolor': '#fcfcfa'}, shadow=True)
-    ax.axis('equal')
-    plt.setp(autotexts, size=13, weight='bold', color="#333")
-    plt.subplots_adjust(left=0.13, right=0.87, top=0.87, bottom=0.13)
-    ax.set_title("Mood Distribution", fontsize=17, color="#457458", weight='bold', pad=16)
-    img = io.BytesIO()
-    plt.savefig(img, format='png', bbox_inches='tight', transparent=True)
-    plt.close(fig)
-    img.seek(0)
-    plot_data = base64.b64encode(img.getvalue()).decode()
-    return plot_data
+def per_shard(command):
+    """Run a CLI command once on every shard, or only on the shard of its ``username``."""
+    @wraps(command)
+    def wrapper(*args, **kwargs):
+        if shard_router is None:
+            return command(*args, **kwargs)
+        names = shard_router.all_names
+        username = kwargs.get('username')
+        if username:
+            user = User.query.filter_by(username=username).first()
+            # 用户不存在时在主库上跑，由命令自己报 "No such user"
+            names = [shard_router.lookup(user.id)[0] if user is not None else sharding.MAIN]
+        db.session.remove()
+        for name in names:
+            if len(names) > 1:
+                print(f"== shard {name} ==")
+            with shard_router.activate(name):
+                command(*args, **kwargs)
+            db.session.remove()
+    return wrapper
+
+
+def _pool_worker_init():
+    # recalc_mood / retag 的进程池：fork 出来的子进程不碰父进程的数据库连接
+    with app.app_context():
+        for engine in (db.engine, read_engine, *shard_engines):
+            if engine is not None:
+                engine.dispose(close=False)
+
+
+def _start_job(job, params, resume):
+    """The checkpoint to resume from (None for a fresh start); raises if the options changed."""
+    with data_engine().begin() as conn:
+        checkpoint = recalc.load_checkpoint(conn, job)
+        if not resume:
+            recalc.reset_checkpoint(conn, job)
+            return None
+    if checkpoint is not None:
+        if checkpoint['params'] != params:
+            raise click.ClickException(
+                f"Job {job!r} was started with {checkpoint['params']}; "
+                f"use the same options or drop --resume to start over.")
+        if checkpoint['finished']:
+            print(f"Job {job!r} already finished ({checkpoint['processed']} entries).")
+        elif checkpoint['last_id']:
+            print(f"Resuming {job!r} after entry {checkpoint['last_id']} ({checkpoint['processed']} done).")
+    return checkpoint
+
+
+def _recalc_worker(texts):
+    """Process-pool entry point for recalc_mood: uncached predictions for one chunk."""
+    return _predict_moods(texts)
+
+
+def _recalc_filters(version, user_id, since, until, stale, scored_by, include_manual):
+    filters = []
+    if user_id is not None:
+        filters.append(Entry.user_id == user_id)
+    if since:
+        filters.append(Entry.date_created >= since)
+    if until:
+        filters.append(Entry.date_created < until + timedelta(days=1))
+    if stale:
+        filters.append(Entry.mood_model.is_(None) | (Entry.mood_model != version))
+    if scored_by:
+        filters.append(Entry.mood_model.is_(None) if scored_by == 'none' else Entry.mood_model == scored_by)
+    if not include_manual:
+        filters.append(Entry.mood_model.is_(None) | (Entry.mood_model != MANUAL))
+    # 还在等后台 enrichment 的不抢
+    filters.append(Entry.mood.is_(None) | (Entry.mood != MOOD_PENDING))
+    return filters
+
+
+def _apply_recalc_chunk(rows, moods, version):
+    """Write one chunk's moods; returns how many moods changed."""
+    read = {r.id: r for r in rows}
+    changed_ids = [r.id for r, mood in zip(rows, moods) if r.mood != mood]
+    new_mood = {r.id: mood for r, mood in zip(rows, moods)}
+    changed = 0
+    # 情绪变了的走 ORM，after_flush 监听器顺带维护 mood_rollup
+    for entry in Entry.query.filter(Entry.id.in_(changed_ids)) if changed_ids else ():
+        old = read[entry.id]
+        if entry.text != old.text or entry.mood != old.mood:
+            continue  # 读出来之后用户又改过，以用户 / enrichment 的为准
+        entry.mood = new_mood[entry.id]
+        entry.mood_model = version
+        changed += 1
+    # 情绪没变的只更新版本号，一条 UPDATE
+    same_ids = [r.id for r, mood in zip(rows, moods) if r.mood == mood and r.mood_model != version]
+    if same_ids:
+        db.session.query(Entry).filter(Entry.id.in_(same_ids), Entry.mood != MOOD_PENDING).update(
+            {Entry.mood_model: version}, synchronize_session=False)
+    return changed
+
+
 @app.cli.command('recalc_mood')
-def recalc_mood():
-    """Recalculate mood for all entries based on current predict_mood()."""
+@click.option('--batch-size', default=256, show_default=True,
+              help='Entries per chunk (one transaction and one checkpoint each).')
+@click.option('--workers', default=1, show_default=True,
+              help='Processes running the model in parallel; 1 runs inline.')
+@click.option('--user', 'username', default=None, help='Only this user.')
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Only entries written on or after this day.')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Only entries written on or before this day.')
+@click.option('--stale', is_flag=True, help='Only entries not scored by the current model / rules version.')
+@click.option('--scored-by', default=None,
+              help="Only entries scored by this mood_model version ('none' for unknown).")
+@click.option('--include-manual', is_flag=True, help='Also overwrite moods the user picked by hand.')
+@click.option('--job', default='recalc_mood', show_default=True, help='Checkpoint name.')
+@click.option('--resume', is_flag=True, help='Continue the job from its last checkpoint.')
+@click.option('--no-cache', is_flag=True, help='Ignore cached moods and re-run the model.')
+@per_shard
+def recalc_mood(batch_size, workers, username, since, until, stale, scored_by, include_manual,
+                job, resume, no_cache):
+    """Recalculate moods in resumable chunks, optionally on several processes."""
+    params = {
+        'user': username, 'since': since and since.date().isoformat(),
+        'until': until and until.date().isoformat(), 'stale': stale, 'scored_by': scored_by,
+        'include_manual': include_manual,
+    }
     with app.app_context():
-        entries = Entry.query.all()
-        for e in entries:
-            old = e.mood
-            e.mood = predict_mood(e.text)
-            print(f"Recalc id={e.id}: {old} -> {e.mood}")
-        db.session.commit()
-        print("Done: all moods recalculated.")
+        user_id = None
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                raise click.ClickException(f"No such user: {username}")
+            user_id = user.id
+
+        checkpoint = _start_job(job, params, resume)
+        if checkpoint is not None and checkpoint['finished']:
+            return
+        # 父进程先把模型加载好，fork 出来的子进程直接共享；加载失败时版本号也随之变成 rules-only
+        if emotion_model.get() is None:
+            print("⚠️ Emotion model not available, recalculating with rules only.")
+        version = mood_cache_version()
+        use_cache = not no_cache
+
+        last_id = checkpoint['last_id'] if checkpoint else 0
+        processed = checkpoint['processed'] if checkpoint else 0
+        changed = checkpoint['changed'] if checkpoint else 0
+
+        filters = _recalc_filters(version, user_id, since, until, stale, scored_by, include_manual)
+        remaining = db.session.query(db.func.count(Entry.id)).filter(Entry.id > last_id, *filters).scalar()
+        progress = recalc.Progress(processed + remaining, done=processed)
+
+        def fetch(after_id, size):
+            # 只读要用的列，不建 ORM 对象
+            return db.session.query(Entry.id, Entry.text, Entry.mood, Entry.mood_model).filter(
+                Entry.id > after_id, *filters).order_by(Entry.id).limit(size).all()
+
+        def jobs():
+            # 命中缓存的在父进程里直接填上，只把没算过的文本交给模型
+            for rows in recalc.iter_chunks(fetch, after_id=last_id, size=batch_size):
+                moods = [nlp_cache.get('mood', version, r.text) if use_cache else MISSING for r in rows]
+                missing = [i for i, m in enumerate(moods) if m is MISSING]
+                yield (rows, moods, missing), [rows[i].text for i in missing]
+
+        pool = recalc.make_pool(workers, initializer=_pool_worker_init)
+        try:
+            results = recalc.map_ordered(_recalc_worker, jobs(), pool=pool,
+                                         in_flight=workers * 2 if pool else 1)
+            for (rows, moods, missing), (computed, reliable) in results:
+                for i, mood in zip(missing, computed):
+                    moods[i] = mood
+                if use_cache and reliable and missing:
+                    nlp_cache.set_many('mood', version, [(rows[i].text, moods[i]) for i in missing])
+                changed += _apply_recalc_chunk(rows, moods, version if reliable else mood_cache_version(False))
+                processed += len(rows)
+                last_id = rows[-1].id
+                # 这块的更新和断点同一个事务提交
+                recalc.save_checkpoint(db.session.connection(), job, params, last_id, processed, changed)
+                db.session.commit()
+                progress.advance(len(rows))
+                print(progress.line(extra=f"{changed} changed"))
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        with data_engine().begin() as conn:
+            recalc.save_checkpoint(conn, job, params, last_id, processed, changed, finished=True)
+        print(f"Done: {processed} entries recalculated, {changed} changed.")
+
+
+def _retag_worker(texts):
+    """Process-pool entry point for retag: encoded noun candidates for one chunk."""
+    return [tagging.encode_counts(c) for c in tagger.candidates_many(texts)]
+
+
+def _apply_retag_chunk(rows, candidates, version):
+    """Re-rank and write one chunk's tags; returns how many tag strings changed."""
+    by_user = {}
+    for r, counts in zip(rows, candidates):
+        by_user.setdefault(r.user_id, []).append((r, counts))
+    new_tags = {}
+    for user_id, items in by_user.items():
+        for (r, _), tags in zip(items, rank_tags(user_id, [c for _, c in items])):
+            new_tags[r.id] = tags
+    read = {r.id: r for r in rows}
+    changed_ids = [r.id for r in rows if r.tags != new_tags[r.id]]
+    changed = 0
+    # 标签变了的走 ORM，after_flush 同步 entry_tag 和全文索引
+    for entry in Entry.query.filter(Entry.id.in_(changed_ids)) if changed_ids else ():
+        old = read[entry.id]
+        if entry.text != old.text or entry.tags != old.tags:
+            continue  # 读出来之后用户又改过
+        entry.tags = new_tags[entry.id]
+        entry.tags_model = version
+        changed += 1
+    same_ids = [r.id for r in rows if r.tags == new_tags[r.id] and r.tags_model != version]
+    if same_ids:
+        db.session.query(Entry).filter(Entry.id.in_(same_ids), Entry.tags.isnot(None)).update(
+            {Entry.tags_model: version}, synchronize_session=False)
+    return changed
+
+
+@app.cli.command('retag')
+@click.option('--batch-size', default=256, show_default=True,
+              help='Entries per chunk (one transaction and one checkpoint each).')
+@click.option('--workers', default=1, show_default=True,
+              help='Processes running the POS tagger in parallel; 1 runs inline.')
+@click.option('--user', 'username', default=None, help='Only this user.')
+@click.option('--stale', is_flag=True, help='Only entries tagged by an older tagger version.')
+@click.option('--include-untracked', is_flag=True,
+              help='Also retag entries saved before tags_model was recorded (their tags may have been typed by hand).')
+@click.option('--job', default='retag', show_default=True, help='Checkpoint name.')
+@click.option('--resume', is_flag=True, help='Continue the job from its last checkpoint.')
+@per_shard
+def retag(batch_size, workers, username, stale, include_untracked, job, resume):
+    """Regenerate automatic tags in resumable chunks, optionally on several processes."""
+    params = {'user': username, 'stale': stale, 'include_untracked': include_untracked}
+    with app.app_context():
+        user_id = None
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                raise click.ClickException(f"No such user: {username}")
+            user_id = user.id
+        checkpoint = _start_job(job, params, resume)
+        if checkpoint is not None and checkpoint['finished']:
+            return
+        version = tags_version()
+        last_id = checkpoint['last_id'] if checkpoint else 0
+        processed = checkpoint['processed'] if checkpoint else 0
+        changed = checkpoint['changed'] if checkpoint else 0
+
+        # 手填的标签不动；NULL 是还在等 enrichment 的
+        auto = Entry.tags_model.isnot(None) & (Entry.tags_model != MANUAL)
+        filters = [Entry.tags.isnot(None), auto | Entry.tags_model.is_(None) if include_untracked else auto]
+        if user_id is not None:
+            filters.append(Entry.user_id == user_id)
+        if stale:
+            filters.append(Entry.tags_model.is_(None) | (Entry.tags_model != version))
+        remaining = db.session.query(db.func.count(Entry.id)).filter(Entry.id > last_id, *filters).scalar()
+        progress = recalc.Progress(processed + remaining, done=processed)
+
+        def fetch(after_id, size):
+            return db.session.query(Entry.id, Entry.user_id, Entry.text, Entry.tags, Entry.tags_model).filter(
+                Entry.id > after_id, *filters).order_by(Entry.id).limit(size).all()
+
+        def jobs():
+            for rows in recalc.iter_chunks(fetch, after_id=last_id, size=batch_size):
+                values = [nlp_cache.get('tag-candidates', version, r.text) for r in rows]
+                missing = [i for i, v in enumerate(values) if v is MISSING]
+                yield (rows, values, missing), [rows[i].text for i in missing]
+
+        pool = recalc.make_pool(workers, initializer=_pool_worker_init)
+        try:
+            results = recalc.map_ordered(_retag_worker, jobs(), pool=pool,
+                                         in_flight=workers * 2 if pool else 1)
+            for (rows, values, missing), computed in results:
+                for i, value in zip(missing, computed):
+                    values[i] = value
+                if missing:
+                    nlp_cache.set_many('tag-candidates', version, [(rows[i].text, values[i]) for i in missing])
+                changed += _apply_retag_chunk(rows, [tagging.decode_counts(v) for v in values], version)
+                processed += len(rows)
+                last_id = rows[-1].id
+                recalc.save_checkpoint(db.session.connection(), job, params, last_id, processed, changed)
+                db.session.commit()
+                progress.advance(len(rows))
+                print(progress.line(label="Retag", extra=f"{changed} changed"))
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        with data_engine().begin() as conn:
+            recalc.save_checkpoint(conn, job, params, last_id, processed, changed, finished=True)
+        print(f"Done: {processed} entries retagged, {changed} changed.")
+
+
+@app.cli.command('rebuild_mood_rollup')
+@click.option('--user', 'username', default=None, help='Only this user.')
+@per_shard
+def rebuild_mood_rollup(username):
+    """Recompute the daily mood rollup from the entry table."""
+    with app.app_context():
+        user_id = None
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                raise click.ClickException(f"No such user: {username}")
+            user_id = user.id
+        with data_engine().begin() as conn:
+            rows = mood_rollup.rebuild(conn, user_id)
+    print(f"Done: {rows} rollup rows written.")
+
+
+@app.cli.command('build_embeddings')
+@click.option('--user', 'username', default=None, help='Only this user.')
+@click.option('--rebuild', is_flag=True, help='Drop existing vectors first (e.g. after changing EMBEDDING_BACKEND).')
+@per_shard
+def build_embeddings(username, rebuild):
+    """Compute the vectors used by "similar entries" for every entry that lacks one."""
+    with app.app_context():
+        user_id = None
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                raise click.ClickException(f"No such user: {username}")
+            user_id = user.id
+        if rebuild:
+            where = "WHERE user_id = :user_id" if user_id is not None else ""
+            with data_engine().begin() as conn:
+                conn.execute(db.text(f"DELETE FROM {embeddings.EMBEDDING_TABLE} {where}"), {"user_id": user_id})
+        start = time.perf_counter()
+        count = ensure_embeddings(user_id)
+    print(f"Done: {count} entries embedded with {embedder.version} in {time.perf_counter() - start:.1f}s.")
+
+
+@app.cli.command('enrich_pending')
+@per_shard
+def enrich_pending():
+    """Synchronously enrich entries left pending (e.g. after a worker restart)."""
+    with app.app_context():
+        ids = [row.id for row in db.session.query(Entry.id).filter(
+            (Entry.mood == MOOD_PENDING) | (Entry.tags.is_(None))
+        )]
+    for entry_id in ids:
+        enrich_entry(entry_id)
+    print(f"Done: {len(ids)} pending entries enriched.")
+
+
+@app.cli.command('nlp_cache')
+@click.option('--purge-stale', is_flag=True,
+              help='Delete persisted results computed under older model/rule versions.')
+def nlp_cache_command(purge_stale):
+    """Show NLP cache statistics."""
+    if purge_stale:
+        removed = nlp_cache.purge_stale('mood', mood_cache_version())
+        removed += nlp_cache.purge_stale('tag-candidates', tags_version())
+        print(f"Purged {removed} stale cache rows.")
+    for key, value in nlp_cache.stats().items():
+        print(f"{key}: {value}")
+
+
+@app.cli.command('rebuild_search_index')
+@click.option('--batch-size', default=1000, show_default=True)
+@per_shard
+def rebuild_search_index(batch_size):
+    """Rebuild the SQLite FTS5 index behind /search from the entry table."""
+    if not app.config['SEARCH_FTS']:
+        print("FTS5 is not available on this database; nothing to rebuild.")
+        return
+    with app.app_context(), data_engine().begin() as conn:
+        # 读和写用同一个连接，避免自己挡住自己的写锁
+        rows = conn.execution_options(yield_per=batch_size).execute(
+            db.select(Entry.id, Entry.user_id, Entry.title, Entry.text, Entry.tags).order_by(Entry.id)
+        )
+        total = search_index.rebuild(conn, rows, batch_size=batch_size)
+    print(f"Done: indexed {total} entries.")
+
+
+@app.cli.command('db_upgrade')
+@click.option('--to', 'target', type=int, default=None, help='Stop after this schema version.')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows per backfill transaction.')
+def db_upgrade(target, batch_size):
+    """Apply pending schema migrations (on every shard)."""
+    for name, engine in _all_engines():
+        applied = migrations.upgrade(engine, target=target, batch_size=batch_size)
+        print(f"Done{name}: applied {len(applied)} migrations, schema version {migrations.current_version(engine)}.")
+
+
+@app.cli.command('db_status')
+def db_status():
+    """Show the schema version and pending migrations (of every shard)."""
+    for name, engine in _all_engines():
+        print(f"Schema version{name}: {migrations.current_version(engine)}")
+        for version, migration_name in migrations.pending(engine):
+            print(f"  pending {version}: {migration_name}")
+
+
+def _all_engines():
+    """(label, engine) of the primary and every shard; the label is empty without shards."""
+    if shard_router is None:
+        return [('', db.engine)]
+    return [(f" [{name}]", shard_router.engine(name)) for name in shard_router.all_names]
+
+
+@app.cli.command('export_entries')
+@click.argument('username')
+@click.option('--format', 'fmt', type=click.Choice(entry_transfer.FORMATS), default='jsonl', show_default=True)
+@click.option('--output', type=click.Path(dir_okay=False, allow_dash=True), default='-', show_default=True)
+@per_shard
+def export_entries_command(username, fmt, output):
+    """Stream all entries of USERNAME as JSONL or CSV."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f"No such user: {username}")
+    out = sys.stdout if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+    try:
+        for chunk in export_stream(user.id, fmt):
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+@app.cli.command('import_entries')
+@click.argument('username')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(entry_transfer.FORMATS), default=None,
+              help='Defaults to the file extension.')
+@click.option('--batch-size', default=500, show_default=True, help='Entries per transaction.')
+@click.option('--enrich', type=click.Choice(IMPORT_ENRICH_MODES), default='batch', show_default=True,
+              help='batch: score moods/tags per batch; defer: leave them pending; none: keep imported values.')
+@per_shard
+def import_entries_command(username, path, fmt, batch_size, enrich):
+    """Import entries for USERNAME from a JSONL or CSV file."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f"No such user: {username}")
+    fmt = fmt or entry_transfer.guess_format(path)
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        try:
+            imported, skipped = import_entries(user.id, entry_transfer.read_records(f, fmt),
+                                               batch_size=batch_size, enrich=enrich)
+        except entry_transfer.ImportStopped as e:
+            enrichment_queue.join()
+            raise click.ClickException(f"Import stopped: {e.reason}. {e.progress()}")
+    if enrich == 'defer':
+        # defer 排进了本进程的队列，等它们做完再退出
+        enrichment_queue.join()
+    print(f"Done: imported {imported} entries, skipped {skipped}.")
+
+
+# ========== 分片维护：状态、搬家、重新平衡、重新压缩 ==========
+def _require_shards():
+    if shard_router is None:
+        raise click.ClickException("Sharding is off; set DB_SHARDS first.")
+
+
+def _reindex_copied(conn, entry_ids):
+    rows = conn.execute(
+        db.text(f"SELECT id, user_id, title, text, tags FROM entry WHERE id IN ({','.join(map(str, entry_ids))})")
+    ).all()
+    search_index.index_entries(conn, [(r[0], r[1], r[2], text_codec.decode(r[3]), r[4]) for r in rows])
+
+
+def move_user_to_shard(user_id, username, target, grace=2.0, log=print):
+    """
+    Move one user's entries (and derived rows) to shard ``target``. Writes
+    from the user are refused with 503 while the copy runs; reads keep
+    going to the old shard until the map is switched. Returns entries moved.
+    """
+    source, _ = shard_router.lookup(user_id)
+    if source == target:
+        return 0
+    src, dst = shard_router.engine(source), shard_router.engine(target)
+    shard_router.set_shard(user_id, source, sharding.MOVING)
+    try:
+        # 等已经在路上的写请求提交
+        time.sleep(grace)
+        with src.connect() as conn:
+            version = conn.execute(db.text("SELECT data_version FROM user WHERE id = :id"),
+                                   {"id": user_id}).scalar() or 0
+        # 版本号 +1：新分片上的页面不会和旧缓存撞 key
+        shard_router.ensure_user(target, user_id, username, version + 1)
+        moved = sharding.copy_user(src, dst, user_id, fts=app.config['SEARCH_FTS'], reindex=_reindex_copied,
+                                   log=log)
+    except BaseException:
+        shard_router.set_shard(user_id, source)
+        raise
+    shard_router.set_shard(user_id, target)
+    # 切换前查到旧分片的请求可能还在读
+    time.sleep(grace)
+    sharding.delete_user(src, user_id, fts=app.config['SEARCH_FTS'], drop_user_row=source != sharding.MAIN)
+    vector_indexes.invalidate_user(user_id)
+    total_counts.invalidate_user(user_id)
+    _requeue_pending(user_id, target)
+    return moved
+
+
+def _requeue_pending(user_id, shard):
+    """Queue the user's unfinished entries on ``shard`` again: jobs that ran during a move were dropped."""
+    with on_shard(shard), app.app_context():
+        query = db.session.query(Entry.id).filter(Entry.user_id == user_id)
+        if app.config['EMBEDDINGS_ENABLED']:
+            query = query.outerjoin(EntryEmbedding, EntryEmbedding.entry_id == Entry.id).filter(
+                (Entry.mood == MOOD_PENDING) | (Entry.tags.is_(None)) | (EntryEmbedding.entry_id.is_(None)))
+        else:
+            query = query.filter((Entry.mood == MOOD_PENDING) | (Entry.tags.is_(None)))
+        ids = [row.id for row in query]
+    # 队列满了的留着 pending，flask enrich_pending 会补上
+    for entry_id in ids:
+        if app.config['ENRICH_MODE'] == 'sync' or not enrichment_queue.submit((user_id, entry_id)):
+            enrich_entry(entry_id, shard=shard)
+    return len(ids)
+
+
+def _file_size(engine):
+    path = engine.url.database
+    total = 0
+    for suffix in ('', '-wal'):
+        if path and os.path.exists(path + suffix):
+            total += os.path.getsize(path + suffix)
+    return total
+
+
+@app.cli.command('shard_status')
+def shard_status():
+    """Users, entries and file size of every shard."""
+    _require_shards()
+    users = shard_router.user_counts()
+    for name in shard_router.all_names:
+        engine = shard_router.engine(name)
+        with engine.connect() as conn:
+            entries = conn.execute(db.text("SELECT count(*) FROM entry")).scalar()
+        print(f"{name}: {users.get(name, 0)} users, {entries} entries, {_file_size(engine) / 1e6:.1f} MB "
+              f"({engine.url.database})")
+
+
+@app.cli.command('move_user')
+@click.argument('username')
+@click.argument('shard')
+@click.option('--grace', default=2.0, show_default=True,
+              help='Seconds to let in-flight requests finish before copying and before deleting.')
+def move_user(username, shard, grace):
+    """Move USERNAME's diary to SHARD ("main" is the primary database)."""
+    _require_shards()
+    if shard not in shard_router.all_names:
+        raise click.ClickException(f"Unknown shard {shard!r}; configured: {', '.join(shard_router.all_names)}")
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f"No such user: {username}")
+    if shard_router.lookup(user.id)[0] == shard:
+        print(f"{username} is already on {shard}.")
+        return
+    start = time.perf_counter()
+    moved = move_user_to_shard(user.id, user.username, shard, grace=grace)
+    # 重新排队的 enrichment 在本进程的后台线程里跑，退出前等它们做完
+    enrichment_queue.join()
+    print(f"Done: moved {moved} entries to {shard} in {time.perf_counter() - start:.1f}s.")
+
+
+@app.cli.command('rebalance_shards')
+@click.option('--drain-main', is_flag=True, help='Also move every user still on the primary database.')
+@click.option('--tolerance', default=0.1, show_default=True, help='Allowed deviation from the mean entry count.')
+@click.option('--grace', default=2.0, show_default=True, help='See move_user.')
+@click.option('--dry-run', is_flag=True, help='Only print the planned moves.')
+def rebalance_shards(drain_main, tolerance, grace, dry_run):
+    """Even out entries across the shards, moving the fewest, biggest diaries."""
+    _require_shards()
+    with db.engine.connect() as conn:
+        placement = {user_id: sharding.MAIN for (user_id,) in conn.execute(db.text("SELECT id FROM user"))}
+        placement.update(conn.execute(db.text(f"SELECT user_id, shard FROM {sharding.MAP_TABLE}")).all())
+    entries = {}
+    for name in shard_router.all_names:
+        with shard_router.engine(name).connect() as conn:
+            counts = conn.execute(db.text("SELECT user_id, count(*) FROM entry GROUP BY user_id")).all()
+        entries.update((user_id, n) for user_id, n in counts if placement.get(user_id) == name)
+    loads = [(user_id, shard, entries.get(user_id, 0)) for user_id, shard in placement.items()
+             if drain_main or shard != sharding.MAIN]
+    moves = sharding.plan_moves(loads, shard_router.names, tolerance=tolerance)
+    usernames = dict(User.query.with_entities(User.id, User.username).all())
+    if not moves:
+        print("Shards are balanced, nothing to move.")
+    for user_id, source, target in moves:
+        print(f"{usernames.get(user_id)}: {source} -> {target} ({entries.get(user_id, 0)} entries)")
+        if not dry_run:
+            move_user_to_shard(user_id, usernames.get(user_id), target, grace=grace, log=lambda *a: None)
+    if moves and not dry_run:
+        enrichment_queue.join()
+        print(f"Done: moved {len(moves)} users.")
+
+
+@app.cli.command('recompress_entries')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--vacuum', is_flag=True, help='VACUUM afterwards so the file actually shrinks.')
+@per_shard
+def recompress_entries(batch_size, vacuum):
+    """Rewrite stored entry text with the current ENTRY_TEXT_COMPRESSION (also undoes it with "none")."""
+    engine = data_engine()
+    last_id = scanned = rewritten = compressed = 0
+    before = _file_size(engine)
+    while True:
+        # 直接读写存储值，不经过 ORM：正文内容没变，不该触发索引 / 向量 / 缓存的更新
+        with engine.begin() as conn:
+            rows = conn.execute(db.text("SELECT id, text FROM entry WHERE id > :last_id ORDER BY id LIMIT :n"),
+                                {"last_id": last_id, "n": batch_size}).all()
+            if not rows:
+                break
+            updates = []
+            for entry_id, stored in rows:
+                value = text_codec.encode(text_codec.decode(stored))
+                compressed += text_codec.is_compressed(value)
+                if type(value) is not type(stored) or value != stored:
+                    updates.append({"id": entry_id, "text": value})
+            if updates:
+                conn.execute(db.text("UPDATE entry SET text = :text WHERE id = :id"), updates)
+        last_id = rows[-1][0]
+        scanned += len(rows)
+        rewritten += len(updates)
+    if vacuum:
+        with engine.connect() as conn:
+            conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+            conn.exec_driver_sql("VACUUM")
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+    print(f"Done: {rewritten} of {scanned} entries rewritten with {app.config['ENTRY_TEXT_COMPRESSION']} "
+          f"({compressed} stored compressed), {before / 1e6:.1f} MB -> {_file_size(engine) / 1e6:.1f} MB.")
+
+
+@app.cli.command('model_info')
+@click.option('--backend', type=click.Choice(EMOTION_BACKENDS), default=None,
+              help='Load this backend instead of EMOTION_BACKEND.')
+@click.option('--sample', default=0, show_default=True, help='Classify this many texts and report throughput.')
+def model_info(backend, sample):
+    """Load the emotion model (if not yet loaded) and report load time and memory."""
+    provider = emotion_model
+    if backend and backend != emotion_model.backend:
+        provider = make_emotion_model(backend)
+    provider.get()
+    for key, value in provider.stats().items():
+        print(f"{key}: {value}")
+    if sample and provider.get() is not None:
+        texts = [f"Entry {i}: today I felt happy, then a bit worried about work." for i in range(sample)]
+        start = time.perf_counter()
+        provider.classify(texts, batch_size=app.config['EMOTION_BATCH_SIZE'],
+                          max_length=app.config['EMOTION_MAX_LENGTH'])
+        elapsed = time.perf_counter() - start
+        print(f"throughput: {sample / elapsed:.1f} texts/s ({elapsed:.2f}s for {sample})")
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,135 @@
+"""
+登录相关的两件事：
+
+- 当前用户：登录时把 (id, username) 记在 session 里，之后每个请求直接用，
+  同一个请求里只解析一次（放在 g 上），不用每个页面都 User.query.get 一遍。
+  session 里没有（升级前登录的）或和 user_id 对不上时才查一次库。
+  缓存的只有 id 和用户名，注册后都不会再变；登录时 remember() 重写，退出时 forget() 清掉，
+  所以不会读到别的用户或已退出用户的旧值。
+- 密码哈希：scrypt / pbkdf2 故意很慢（每次几十到几百毫秒 CPU）。放到一个
+  固定大小的线程池里算（hashlib 计算时会释放 GIL），同时在算 + 排队的数量有上限，
+  登录高峰时多出来的请求直接返回「稍后再试」，不会把所有 worker 线程都占住。
+  哈希参数可配置；用户登录时如果存的哈希是旧参数算的，顺手用新参数重算一遍。
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from flask import g, session
+from werkzeug.security import check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = "scrypt"
+
+
+class SessionUser(NamedTuple):
+    id: int
+    username: str
+
+
+class CurrentUser:
+    """
+    The logged-in user as a SessionUser, memoized per request (on ``g``) and
+    per session (in the signed session cookie). ``load(user_id)`` returns
+    (id, username) or None and is only called when the session has no copy.
+    """
+
+    def __init__(self, load):
+        self.load = load
+
+    def get(self):
+        if "current_user" in g:
+            return g.current_user
+        user = None
+        user_id = session.get("user_id")
+        if user_id is not None:
+            cached = session.get("user")
+            if cached and cached[0] == user_id:
+                user = SessionUser(*cached)
+            else:
+                row = self.load(user_id)
+                user = self.remember(SessionUser(*row)) if row is not None else None
+        g.current_user = user
+        return user
+
+    def remember(self, user):
+        """Log ``user`` in for this session (or refresh the cached copy after it changed)."""
+        user = SessionUser(user.id, user.username)
+        session["user_id"] = user.id
+        session["user"] = list(user)
+        g.current_user = user
+        return user
+
+    def forget(self):
+        """Log the user out of this session, together with the cached copy."""
+        session.pop("user_id", None)
+        session.pop("user", None)
+        g.pop("current_user", None)
+
+
+class HasherBusy(Exception):
+    """Too many password hashes queued; the caller should ask the user to retry."""
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords on a pool of ``workers`` threads, with at
+    most ``max_waiting`` more calls queued. A call that can't get a slot
+    within ``timeout`` seconds raises HasherBusy.
+    """
+
+    def __init__(self, method=DEFAULT_METHOD, workers=2, max_waiting=16, timeout=2.0):
+        self.method = method
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._slots = threading.BoundedSemaphore(workers + max_waiting)
+        self._prefix = None
+        self.counters = {"hashed": 0, "verified": 0, "rehashed": 0, "rejected": 0}
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            self.counters["rejected"] += 1
+            raise HasherBusy()
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        value = self._run(generate_password_hash, password, self.method)
+        self.counters["hashed"] += 1
+        return value
+
+    def verify(self, stored_hash, password):
+        ok = self._run(check_password_hash, stored_hash, password)
+        self.counters["verified"] += 1
+        return ok
+
+    @property
+    def prefix(self):
+        """``method:params`` as werkzeug writes it for the configured method, e.g. "scrypt:32768:8:1"."""
+        if self._prefix is None:
+            # werkzeug 会补全默认参数（"pbkdf2" -> "pbkdf2:sha256:1000000"），算一次空密码拿到完整写法
+            self._prefix = self._run(generate_password_hash, "", self.method).split("$", 1)[0]
+        return self._prefix
+
+    def needs_rehash(self, stored_hash):
+        return stored_hash.split("$", 1)[0] != self.prefix
+
+    def verify_and_update(self, stored_hash, password):
+        """(ok, new_hash): new_hash is set when the password was right but hashed with old parameters."""
+        if not self.verify(stored_hash, password):
+            return False, None
+        try:
+            if not self.needs_rehash(stored_hash):
+                return True, None
+            new_hash = self.hash(password)
+        except HasherBusy:
+            return True, None  # 密码是对的；忙的时候下次登录再重算
+        self.counters["rehashed"] += 1
+        return True, new_hash
+
+    def stats(self):
+        return dict(self.counters, method=self.prefix if self._prefix else self.method)
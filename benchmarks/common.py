@@ -0,0 +1,99 @@
+"""
+Shared helpers: loading the app against a scratch database, timing, and result files.
+"""
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+
+def load_app(db_path):
+    """
+    Import app.py against ``db_path`` instead of diary.db.
+
+    Must run before anything else imports ``app``: the database URL and
+    enrichment mode are read at import time.
+    """
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.abspath(db_path)
+    # 同步补全情绪 / 标签，压测时不会留下后台线程的工作
+    os.environ.setdefault("ENRICH_MODE", "sync")
+    os.environ.setdefault("EMOTION_MODEL_WARMUP", "lazy")
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    return importlib.import_module("app")
+
+
+def summarize(timings_ms, elapsed=None):
+    """p50 / p95 / p99 / mean of per-call timings in ms, plus throughput if ``elapsed`` seconds is given."""
+    if not timings_ms:
+        return {"count": 0}
+    arr = np.asarray(timings_ms, dtype=float)
+    p50, p95, p99 = np.percentile(arr, [50, 95, 99])
+    result = {
+        "count": int(arr.size),
+        "mean_ms": round(float(arr.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(arr.max()), 3),
+    }
+    if elapsed:
+        result["ops_per_second"] = round(arr.size / elapsed, 1)
+    return result
+
+
+def time_calls(fn, iterations, warmup=3):
+    """Call ``fn`` ``iterations`` times and summarize; {'error': ...} if it raises."""
+    try:
+        for _ in range(warmup):
+            fn()
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}".splitlines()[0]}
+    timings = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - t0) * 1000)
+    return summarize(timings, time.perf_counter() - start)
+
+
+def git_revision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, timeout=10,
+        )
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def environment():
+    return {
+        "commit": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def write_results(results, output_dir=DEFAULT_RESULTS_DIR, name=None):
+    os.makedirs(output_dir, exist_ok=True)
+    meta = results.get("meta", {})
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    name = name or f"{stamp}-{meta.get('commit') or 'nocommit'}.json"
+    path = os.path.join(output_dir, name)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return path
@@ -0,0 +1,68 @@
+"""
+Compare two benchmark result files.
+
+    python -m benchmarks.compare OLD.json NEW.json [--threshold 0.15]
+
+Prints p50 / p95 / throughput per benchmark and exits with status 1 when any
+p95 got slower (or throughput dropped) by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def _rows(results):
+    for name, summary in results.get("micro", {}).items():
+        yield f"micro/{name}", summary
+    for route, levels in results.get("load", {}).items():
+        for summary in levels:
+            yield f"load/{route}/c{summary['concurrency']}", summary
+
+
+def _change(old, new):
+    if old in (None, 0) or new is None:
+        return None
+    return (new - old) / old
+
+
+def compare(old, new, threshold=0.15):
+    old_rows = dict(_rows(old))
+    regressions = []
+    print(f"{'benchmark':<40} {'p50 ms':>18} {'p95 ms':>18} {'ops/s':>20}")
+    for name, summary in _rows(new):
+        before = old_rows.get(name)
+        if before is None or "error" in summary or "error" in before:
+            continue
+        p95 = _change(before.get("p95_ms"), summary.get("p95_ms"))
+        ops = _change(before.get("ops_per_second"), summary.get("ops_per_second"))
+        flag = ""
+        if (p95 is not None and p95 > threshold) or (ops is not None and ops < -threshold):
+            flag = "  <-- regression"
+            regressions.append(name)
+        print(f"{name:<40} {before.get('p50_ms'):>8} → {summary.get('p50_ms'):<8}"
+              f" {before.get('p95_ms'):>8} → {summary.get('p95_ms'):<8}"
+              f" {before.get('ops_per_second'):>9} → {summary.get('ops_per_second'):<9}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative slowdown.")
+    args = parser.parse_args(argv)
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"{old['meta'].get('commit')} ({old['meta'].get('timestamp')}) → "
+          f"{new['meta'].get('commit')} ({new['meta'].get('timestamp')})")
+    regressions = compare(old, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
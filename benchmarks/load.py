@@ -0,0 +1,98 @@
+"""
+Route load test through the Flask test client: each worker thread gets its
+own logged-in client and issues a fixed number of requests against one route.
+"""
+import random
+import threading
+import time
+
+from benchmarks.common import summarize
+
+SEARCH_WORDS = ["happy", "work", "family", "walk", "worried", "project", "dinner", "calm"]
+
+
+def _client(A, user_id):
+    client = A.app.test_client()
+    # 直接写 session，跳过 /login 的密码哈希
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+    return client
+
+
+def _scenarios(max_page):
+    def dashboard(client, rng):
+        return client.get("/dashboard")
+
+    def view_entries(client, rng):
+        return client.get(f"/view_entries?page={rng.randint(1, max_page)}")
+
+    def search(client, rng):
+        return client.get(f"/search?keyword={rng.choice(SEARCH_WORDS)}&sort=relevance")
+
+    def add_entry(client, rng):
+        word = rng.choice(SEARCH_WORDS)
+        return client.post("/add_entry", data={
+            "title": "Load test",
+            "text": f"Today was {word}. Load test entry {rng.random()}",
+            "tags": "loadtest",
+            "date": "",
+        })
+
+    return {"dashboard": dashboard, "view_entries": view_entries,
+            "search": search, "add_entry": add_entry}
+
+
+def run_scenario(A, fn, user_ids, concurrency, requests_per_worker, seed=42):
+    timings, errors = [], []
+    lock = threading.Lock()
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(n):
+        rng = random.Random(seed + n)
+        client = _client(A, user_ids[n % len(user_ids)])
+        local, bad = [], 0
+        barrier.wait()
+        for _ in range(requests_per_worker):
+            t0 = time.perf_counter()
+            resp = fn(client, rng)
+            local.append((time.perf_counter() - t0) * 1000)
+            if resp.status_code >= 400:
+                bad += 1
+        with lock:
+            timings.extend(local)
+            errors.append(bad)
+
+    threads = [threading.Thread(target=worker, args=(n,), daemon=True) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    result = summarize(timings, elapsed)
+    result["concurrency"] = concurrency
+    result["errors"] = sum(errors)
+    return result
+
+
+def run(A, usernames, concurrency_levels=(1, 2, 4, 8), requests_per_worker=50,
+        routes=None, log=print):
+    """Return {route: [summary per concurrency level]}."""
+    with A.app.app_context():
+        users = A.User.query.filter(A.User.username.in_(usernames)).all()
+        user_ids = [u.id for u in users]
+        per_user = min(A.Entry.query.filter_by(user_id=uid).count() for uid in user_ids)
+    max_page = max(1, per_user // A.PER_PAGE)
+
+    scenarios = _scenarios(max_page)
+    results = {}
+    for name in routes or scenarios:
+        results[name] = []
+        for concurrency in concurrency_levels:
+            summary = run_scenario(A, scenarios[name], user_ids, concurrency, requests_per_worker)
+            results[name].append(summary)
+            log(f"  {name:<13} c={concurrency:<3} {summary.get('ops_per_second', 0):>8} req/s  "
+                f"p50 {summary.get('p50_ms')} ms  p95 {summary.get('p95_ms')} ms  "
+                f"p99 {summary.get('p99_ms')} ms  errors {summary['errors']}")
+    return results
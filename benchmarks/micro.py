@@ -0,0 +1,56 @@
+"""
+Micro-benchmarks of the NLP / chart / paging hot paths, cold (cache bypassed) and warm.
+"""
+import random
+from types import SimpleNamespace
+
+import charts
+
+from benchmarks.common import time_calls
+from benchmarks.synthetic import make_text
+
+_COUNTS = {"joyful": 40, "sad": 12, "angry": 5, "fearful": 7, "excited": 20, "calm": 30, "neutral": 9}
+
+
+def _cold_chart(render, cache):
+    def run():
+        cache.cache_clear()
+        return render(_COUNTS)
+    return run
+
+
+def run(A, iterations=200, seed=42):
+    """Return {benchmark name: summary} for the app module ``A``."""
+    rng = random.Random(seed)
+    texts = [make_text(rng, rng.choice(["joyful", "sad", "calm", "neutral"]), 4) for _ in range(iterations)]
+    cycle = iter(range(10 ** 9))
+
+    def next_text():
+        return texts[next(cycle) % len(texts)]
+
+    long_text = " ".join(texts[:20])
+    windows = [SimpleNamespace(pages=pages, page=page) for pages in (1, 5, 50, 5000)
+               for page in (1, pages // 2 or 1, pages)]
+
+    with A.app.app_context():
+        results = {
+            "predict_mood.cold": time_calls(lambda: A.predict_moods([next_text()], use_cache=False), iterations),
+            "predict_mood.cached": time_calls(lambda: A.predict_mood(texts[0]), iterations),
+            "predict_moods.batch32.cold": time_calls(
+                lambda: A.predict_moods([next_text() for _ in range(32)], use_cache=False),
+                max(1, iterations // 32),
+            ),
+            "mood_from_label.rules": time_calls(lambda: A.mood_from_label(next_text()), iterations),
+            "extract_tags.cold": time_calls(lambda: A._extract_tags(next_text()), iterations),
+            "extract_tags.cold.long": time_calls(lambda: A._extract_tags(long_text), max(1, iterations // 10)),
+            "extract_tags.cached": time_calls(lambda: A.extract_tags(texts[0]), iterations),
+            "generate_pie_chart.cold": time_calls(
+                _cold_chart(charts.generate_pie_chart, charts._render_png), max(1, iterations // 20)
+            ),
+            "generate_pie_chart.cached": time_calls(lambda: charts.generate_pie_chart(_COUNTS), iterations),
+            "render_mood_svg.cold": time_calls(_cold_chart(charts.render_mood_svg, charts._render_svg), iterations),
+            "build_page_window": time_calls(
+                lambda: [A.build_page_window(p) for p in windows], iterations
+            ),
+        }
+    return results
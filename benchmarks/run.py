@@ -0,0 +1,71 @@
+"""
+Run the benchmark suite and store the results as JSON.
+
+    python -m benchmarks.run                        # 3 users x 2000 entries, all parts
+    python -m benchmarks.run --entries 20000 --concurrency 1 4 16
+    python -m benchmarks.run --skip load
+    python -m benchmarks.compare benchmarks/results/A.json benchmarks/results/B.json
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+from benchmarks import common, load, micro, synthetic
+
+PARTS = ("micro", "load")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=None,
+                        help="Scratch SQLite file (default: a new temp file; reuse one to skip data generation).")
+    parser.add_argument("--users", type=int, default=3)
+    parser.add_argument("--entries", type=int, default=2000, help="Entries per synthetic user.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--iterations", type=int, default=200, help="Calls per micro-benchmark.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=50, help="Requests per worker per level.")
+    parser.add_argument("--routes", nargs="+", default=None,
+                        choices=["dashboard", "view_entries", "search", "add_entry"])
+    parser.add_argument("--skip", nargs="+", default=[], choices=PARTS)
+    parser.add_argument("--output-dir", default=common.DEFAULT_RESULTS_DIR)
+    parser.add_argument("--name", default=None, help="Result file name (default: <timestamp>-<commit>.json).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="diary-bench-"), "bench.db")
+    print(f"Scratch database: {db_path}")
+    A = common.load_app(db_path)
+
+    print(f"Generating {args.users} users x {args.entries} entries")
+    usernames = synthetic.generate(A, users=args.users, entries_per_user=args.entries, seed=args.seed)
+
+    results = {
+        "meta": dict(common.environment(), config={
+            k: v for k, v in vars(args).items() if k not in ("output_dir", "name")
+        }, emotion_backend=A.app.config['EMOTION_BACKEND']),
+    }
+    if "micro" not in args.skip:
+        print("Micro-benchmarks")
+        results["micro"] = micro.run(A, iterations=args.iterations, seed=args.seed)
+        for name, summary in results["micro"].items():
+            if "error" in summary:
+                print(f"  {name:<28} error: {summary['error']}")
+            else:
+                print(f"  {name:<28} p50 {summary['p50_ms']:>9} ms  p95 {summary['p95_ms']:>9} ms  "
+                      f"p99 {summary['p99_ms']:>9} ms  {summary['ops_per_second']:>9} ops/s")
+    if "load" not in args.skip:
+        print("Route load test")
+        results["load"] = load.run(A, usernames, concurrency_levels=args.concurrency,
+                                   requests_per_worker=args.requests, routes=args.routes)
+
+    path = common.write_results(results, args.output_dir, args.name)
+    print(f"Results written to {path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Synthetic users and diary entries for benchmarking, written through the
+app's own bulk import (so the search index and tag table are filled too).
+"""
+import random
+from datetime import datetime, timedelta
+
+USERNAME_PREFIX = "bench_user_"
+PASSWORD = "bench-password"
+
+_MOOD_WORDS = {
+    "joyful": ["happy", "glad", "grateful", "cheerful"],
+    "sad": ["sad", "lonely", "miserable", "unhappy"],
+    "angry": ["angry", "annoyed", "furious", "irritated"],
+    "fearful": ["worried", "anxious", "nervous", "scared"],
+    "excited": ["excited", "thrilled", "pumped", "energetic"],
+    "calm": ["calm", "relaxed", "peaceful", "fine"],
+    "neutral": ["busy", "ordinary", "long", "quiet"],
+}
+_SUBJECTS = ["work", "the gym", "my family", "the project", "dinner", "the weekend",
+             "school", "the garden", "a long walk", "the meeting", "my friends", "reading"]
+_TAGS = ["work", "family", "health", "travel", "books", "music", "food", "friends",
+         "sport", "study", "money", "home"]
+_FILLER = ("Later I spent some time on {subject} and thought about what comes next. "
+           "Nothing special happened in the evening. ")
+
+
+def make_text(rng, mood, sentences):
+    word = rng.choice(_MOOD_WORDS[mood])
+    parts = [f"Today I felt {word} about {rng.choice(_SUBJECTS)}."]
+    for _ in range(sentences):
+        parts.append(_FILLER.format(subject=rng.choice(_SUBJECTS)))
+    return " ".join(parts)
+
+
+def make_records(rng, count, start=None, sentences=(1, 6)):
+    start = start or datetime(2023, 1, 1)
+    moods = list(_MOOD_WORDS)
+    for i in range(count):
+        mood = rng.choice(moods)
+        yield {
+            "title": f"Day {i + 1}",
+            "text": make_text(rng, mood, rng.randint(*sentences)),
+            "tags": ", ".join(rng.sample(_TAGS, rng.randint(0, 3))),
+            "mood": mood,
+            "date_created": (start + timedelta(hours=rng.randint(0, 24 * 730))).isoformat(),
+        }
+
+
+def generate(A, users=3, entries_per_user=1000, seed=42, batch_size=1000, log=print):
+    """
+    Create ``users`` users with ``entries_per_user`` entries each in the app's
+    database (``A`` is the imported app module). Existing benchmark users are
+    reused and topped up. Returns the usernames.
+    """
+    rng = random.Random(seed)
+    names = []
+    with A.app.app_context():
+        for n in range(users):
+            username = f"{USERNAME_PREFIX}{n}"
+            user = A.User.query.filter_by(username=username).first()
+            if user is None:
+                user = A.User(username=username, password=A.password_hasher.hash(PASSWORD))
+                A.db.session.add(user)
+                A.db.session.commit()
+            have = A.Entry.query.filter_by(user_id=user.id).count()
+            if have < entries_per_user:
+                imported, _ = A.import_entries(
+                    user.id, make_records(rng, entries_per_user - have),
+                    batch_size=batch_size, enrich="none",
+                )
+                log(f"  {username}: +{imported} entries")
+            names.append(username)
+    return names
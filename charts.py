@@ -0,0 +1,167 @@
+"""
+Mood 饼图：默认用纯 Python 拼 SVG（热路径上不需要 matplotlib），
+PNG 版本保留给需要位图的地方，matplotlib 只在第一次用到时才 import。
+"""
+import base64
+import hashlib
+import io
+import math
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+MOOD_COLORS = {
+    'joyful': '#7fd89e',
+    'sad': '#4A5568',
+    'angry': '#FF0000',
+    'fearful': '#9b59b6',
+    'excited': '#FFB6C1',
+    'calm': '#8ac6ee',
+    'neutral': '#bdc3c7',
+    'other': '#dadada'
+}
+
+TITLE = "Mood Distribution"
+START_ANGLE = 140  # 和原来 matplotlib 版一致：从 140° 开始逆时针
+
+
+def _normalize(mood_counts):
+    # 顺序固定下来，同样的分布 → 同样的 key / ETag / 图
+    return tuple(sorted((m, int(c)) for m, c in mood_counts.items() if c))
+
+
+def chart_etag(mood_counts):
+    raw = repr(_normalize(mood_counts)).encode("utf-8")
+    return hashlib.sha1(raw).hexdigest()[:16]
+
+
+def render_mood_svg(mood_counts):
+    return _render_svg(_normalize(mood_counts))
+
+
+def _point(cx, cy, r, degrees):
+    rad = math.radians(degrees)
+    # SVG 的 y 轴向下，逆时针要减
+    return cx + r * math.cos(rad), cy - r * math.sin(rad)
+
+
+@lru_cache(maxsize=256)
+def _render_svg(items):
+    size, cx, cy, r = 460, 230, 250, 150
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size + 20}" '
+        f'role="img" aria-label="{TITLE}">',
+        f'<text x="{cx}" y="40" text-anchor="middle" font-size="24" font-weight="bold" '
+        f'fill="#457458" font-family="Nunito, Segoe UI, sans-serif">{TITLE}</text>',
+    ]
+    total = sum(count for _, count in items)
+    if not total:
+        parts.append('</svg>')
+        return "".join(parts)
+
+    angle = START_ANGLE
+    for mood, count in items:
+        share = count / total
+        sweep = share * 360
+        color = MOOD_COLORS.get(mood, MOOD_COLORS['other'])
+        if share >= 0.9999:
+            parts.append(f'<circle cx="{cx}" cy="{cy}" r="{r}" fill="{color}" '
+                         f'stroke="#fcfcfa" stroke-width="3"/>')
+        else:
+            x1, y1 = _point(cx, cy, r, angle)
+            x2, y2 = _point(cx, cy, r, angle + sweep)
+            large = 1 if sweep > 180 else 0
+            parts.append(
+                f'<path d="M{cx},{cy} L{x1:.2f},{y1:.2f} A{r},{r} 0 {large} 0 {x2:.2f},{y2:.2f} Z" '
+                f'fill="{color}" stroke="#fcfcfa" stroke-width="3"/>'
+            )
+        mid = angle + sweep / 2
+        px, py = _point(cx, cy, r * 0.7, mid)
+        lx, ly = _point(cx, cy, r * 1.18, mid)
+        anchor = "start" if math.cos(math.radians(mid)) > 0.1 else \
+            "end" if math.cos(math.radians(mid)) < -0.1 else "middle"
+        parts.append(
+            f'<text x="{px:.1f}" y="{py + 6:.1f}" text-anchor="middle" font-size="18" '
+            f'font-weight="bold" fill="#333" font-family="Nunito, Segoe UI, sans-serif">'
+            f'{share * 100:.1f}%</text>'
+        )
+        parts.append(
+            f'<text x="{lx:.1f}" y="{ly + 6:.1f}" text-anchor="{anchor}" font-size="18" '
+            f'fill="#457458" font-family="Nunito, Segoe UI, sans-serif">{escape(mood.title())}</text>'
+        )
+        angle += sweep
+    parts.append('</svg>')
+    return "".join(parts)
+
+
+@lru_cache(maxsize=64)
+def _render_png(items):
+    # 用面向对象的 Figure，不碰 pyplot 的全局状态，多线程下也安全
+    from matplotlib.figure import Figure
+
+    labels = [mood.title() for mood, _ in items]
+    values = [count for _, count in items]
+    colors = [MOOD_COLORS.get(mood, MOOD_COLORS['other']) for mood, _ in items]
+    fig = Figure(figsize=(4.6, 4.6))
+    ax = fig.subplots()
+    wedges, texts, autotexts = ax.pie(values, labels=labels, colors=colors, autopct='%1.1f%%',
+                                      startangle=START_ANGLE, pctdistance=0.77,
+                                      textprops={'color': '#457458', 'fontsize': 13},
+                                      wedgeprops={'linewidth': 2, 'edgecolor': '#fcfcfa'}, shadow=True)
+    ax.axis('equal')
+    for t in autotexts:
+        t.set_size(13)
+        t.set_weight('bold')
+        t.set_color("#333")
+    fig.subplots_adjust(left=0.13, right=0.87, top=0.87, bottom=0.13)
+    ax.set_title(TITLE, fontsize=17, color="#457458", weight='bold', pad=16)
+    img = io.BytesIO()
+    fig.savefig(img, format='png', bbox_inches='tight', transparent=True)
+    return img.getvalue()
+
+
+def render_mood_png(mood_counts):
+    return _render_png(_normalize(mood_counts))
+
+
+def generate_pie_chart(mood_counts):
+    """Base64 PNG of the mood pie chart (kept for callers that inline an image)."""
+    return base64.b64encode(render_mood_png(mood_counts)).decode()
+
+
+@lru_cache(maxsize=256)
+def _render_trend_svg(values, width, height):
+    # 心情曲线（-1 ~ 1）：没有数据的日子断开，不连线
+    pad = 6
+    n = len(values)
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {width} {height}" '
+             f'role="img" aria-label="Mood trend">']
+    mid = height / 2
+    parts.append(f'<line x1="{pad}" y1="{mid}" x2="{width - pad}" y2="{mid}" '
+                 f'stroke="#d5e6da" stroke-dasharray="4 4"/>')
+    step = (width - 2 * pad) / max(n - 1, 1)
+    segment = []
+    segments = []
+    for i, v in enumerate(values):
+        if v is None:
+            if segment:
+                segments.append(segment)
+            segment = []
+            continue
+        y = mid - v * (height / 2 - pad)
+        segment.append(f"{pad + i * step:.1f},{y:.1f}")
+    if segment:
+        segments.append(segment)
+    for seg in segments:
+        if len(seg) == 1:
+            x, y = seg[0].split(",")
+            parts.append(f'<circle cx="{x}" cy="{y}" r="2.5" fill="#4b7f69"/>')
+        else:
+            parts.append(f'<polyline points="{" ".join(seg)}" fill="none" stroke="#4b7f69" '
+                         f'stroke-width="2.5" stroke-linejoin="round" stroke-linecap="round"/>')
+    parts.append('</svg>')
+    return "".join(parts)
+
+
+def render_trend_svg(values, width=300, height=80):
+    """Sparkline of daily scores in [-1, 1]; None marks days without data."""
+    return _render_trend_svg(tuple(values), width, height)
@@ -0,0 +1,133 @@
+"""
+数据库连接层：SQLite PRAGMA、连接池参数，以及给只读页面用的只读连接。
+
+多个 gunicorn worker 同时写 diary.db 时，默认的 rollback journal 会让读写互相挡住，
+很快就 "database is locked"。这里统一在每个新连接上打开 WAL、busy_timeout 等设置；
+重的只读页面（列表 / 搜索 / dashboard）可以走单独的只读连接（或只读副本）。
+"""
+import os
+from functools import wraps
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+import sharding
+
+READ_ENGINE_KEY = "diary_read_engine"
+SHARD_ROUTER_KEY = "diary_shard_router"
+
+
+def database_config(basedir):
+    """Database settings from the environment, with the old single-file defaults."""
+    url = os.environ.get('DATABASE_URL', 'sqlite:///' + os.path.join(basedir, 'diary.db'))
+    return {
+        'SQLALCHEMY_DATABASE_URI': url,
+        # 只读连接：DATABASE_READ_URL 指向副本；或者 DB_READ_ONLY=1 用同一个文件的只读连接
+        'DATABASE_READ_URL': os.environ.get('DATABASE_READ_URL'),
+        'DB_READ_ONLY': os.environ.get('DB_READ_ONLY', '0') == '1',
+        'SQLITE_JOURNAL_MODE': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'SQLITE_SYNCHRONOUS': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'SQLITE_BUSY_TIMEOUT_MS': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'SQLITE_CACHE_SIZE_KB': int(os.environ.get('SQLITE_CACHE_SIZE_KB', 20000)),
+        'SQLITE_MMAP_SIZE': int(os.environ.get('SQLITE_MMAP_SIZE', 0)),
+        'SQLALCHEMY_ENGINE_OPTIONS': engine_options(url),
+        # 按用户分片（见 sharding.py）：DB_SHARDS=a,b 或 a=sqlite:////disk1/a.db,b=...
+        'DB_SHARDS': os.environ.get('DB_SHARDS', ''),
+        'DB_SHARD_DIR': os.environ.get('DB_SHARD_DIR', basedir),
+    }
+
+
+def engine_options(url):
+    if url in ('sqlite://', 'sqlite:///:memory:'):
+        # 内存库用的是单连接池，没有这些参数
+        return {}
+    # SQLite 同一时间只有一个写者，连接多了只会排队：池子按 worker 线程数配就够了
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 3600)),
+    }
+
+
+def _read_only_url(url):
+    # sqlite:///path → 用 URI 模式打开同一个文件，mode=ro
+    path = url[len('sqlite:///'):]
+    return f"sqlite:///file:{path}?mode=ro&uri=true"
+
+
+def configure_sqlite(engine, config, read_only=False):
+    """Apply the SQLite pragmas to every new DBAPI connection of ``engine``."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_conn, connection_record):
+        cur = dbapi_conn.cursor()
+        cur.execute(f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+        if not read_only:
+            # journal_mode 是库级别的设置，只读连接改不了
+            cur.execute(f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+            cur.execute(f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}")
+        cur.execute(f"PRAGMA cache_size = -{int(config['SQLITE_CACHE_SIZE_KB'])}")
+        cur.execute("PRAGMA temp_store = MEMORY")
+        if config['SQLITE_MMAP_SIZE']:
+            cur.execute(f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}")
+        cur.close()
+
+
+def init_read_engine(app, primary_engine):
+    """Create the optional read-only engine used by @read_only views."""
+    url = app.config['DATABASE_READ_URL']
+    if not url and app.config['DB_READ_ONLY'] and primary_engine.dialect.name == 'sqlite':
+        url = _read_only_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if not url:
+        return None
+    engine = create_engine(url, **app.config['SQLALCHEMY_ENGINE_OPTIONS'])
+    configure_sqlite(engine, app.config, read_only=True)
+    app.extensions[READ_ENGINE_KEY] = engine
+    return engine
+
+
+def init_shard_router(app, primary_engine):
+    """The ShardRouter for DB_SHARDS, or None when sharding is off."""
+    urls = sharding.parse_shards(app.config['DB_SHARDS'], app.config['DB_SHARD_DIR'])
+    if not urls:
+        return None
+    engines = {}
+    for name, url in urls.items():
+        engine = create_engine(url, **engine_options(url))
+        configure_sqlite(engine, app.config)
+        engines[name] = engine
+    router = sharding.ShardRouter(primary_engine, engines)
+    app.extensions[SHARD_ROUTER_KEY] = router
+    return router
+
+
+class RoutingSession(Session):
+    """
+    Sends everything to the user's shard when one is active (see sharding.py);
+    otherwise queries of @read_only views go to the read engine and everything
+    else (and any flush) to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None:
+            shard = sharding.active_engine()
+            if shard is not None:
+                return shard
+        if bind is None and not self._flushing and has_app_context() and g.get('db_read_only'):
+            engine = current_app.extensions.get(READ_ENGINE_KEY)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    """Mark a view as read-only so its queries may use the read-only connection."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
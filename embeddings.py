@@ -0,0 +1,179 @@
+"""
+日记向量（embedding）：给「相似日记」用。
+
+- 编码器：默认 hashing（纯 NumPy 的特征哈希，词 + 相邻词对，不需要下载模型）；
+  EMBEDDING_BACKEND=sentence-transformers 时用本地 sentence-transformers 模型，
+  加载失败自动退回 hashing。
+- 存储：entry_embedding 表，每篇日记一行，向量按 float16 存成 blob（384 维 = 768 字节）。
+  model 列记录是哪个编码器算的，换编码器后旧向量自动视为缺失。
+"""
+import re
+import threading
+import zlib
+
+import numpy as np
+from sqlalchemy import text
+
+EMBEDDING_TABLE = "entry_embedding"
+BACKENDS = ("hashing", "sentence-transformers")
+DEFAULT_ST_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEncoder:
+    """Signed feature hashing of words and word pairs, log-scaled and L2-normalized."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text_):
+        words = _WORD_RE.findall(text_.lower())
+        pairs = [f"{a} {b}" for a, b in zip(words, words[1:])]
+        return words + pairs, len(words)
+
+    def encode(self, texts, batch_size=None):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text_ in enumerate(texts):
+            features, n_words = self._features(text_)
+            if not features:
+                continue
+            hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features),
+                                 dtype=np.uint32, count=len(features))
+            index = (hashes % self.dim).astype(np.intp)
+            # 符号用另一组 bit，和桶号无关；词对权重减半，单词命中为主
+            sign = np.where((hashes >> 16) & 1, -1.0, 1.0).astype(np.float32)
+            sign[n_words:] *= 0.5
+            np.add.at(out[row], index, sign)
+        # 次数取 log，长日记里的高频词不会压过其他词
+        out = np.sign(out) * np.log1p(np.abs(out))
+        return _normalize(out)
+
+
+class SentenceTransformerEncoder:
+    def __init__(self, model_name=DEFAULT_ST_MODEL):
+        # sentence-transformers / torch 只在选了这个后端时才 import
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"st:{model_name}"
+
+    def encode(self, texts, batch_size=64):
+        vectors = self.model.encode(list(texts), batch_size=batch_size, convert_to_numpy=True,
+                                    normalize_embeddings=True, show_progress_bar=False)
+        return vectors.astype(np.float32)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class EmbeddingProvider:
+    """Creates the encoder once per process, on first use."""
+
+    def __init__(self, backend="hashing", model_name=DEFAULT_ST_MODEL, dim=384):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+        self.backend = backend
+        self.model_name = model_name
+        self.dim = dim
+        self._encoder = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._encoder is not None:
+            return self._encoder
+        with self._lock:
+            if self._encoder is None:
+                encoder = None
+                if self.backend == "sentence-transformers":
+                    try:
+                        encoder = SentenceTransformerEncoder(self.model_name)
+                    except Exception as e:
+                        print("⚠️ Could not load sentence-transformers model, using hashing embeddings:", e)
+                self._encoder = encoder or HashingEncoder(self.dim)
+        return self._encoder
+
+    @property
+    def version(self):
+        """Name of the encoder actually in use; stored with every vector."""
+        return self.get().name
+
+    def encode(self, texts, batch_size=64):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.get().dim), dtype=np.float32)
+        return self.get().encode(texts, batch_size=batch_size)
+
+
+def entry_text(title, body):
+    return f"{title or ''}\n{body or ''}".strip()
+
+
+# ---------- 存储 ----------
+
+def to_blob(vector):
+    return np.asarray(vector, dtype=np.float16).tobytes()
+
+
+def from_blobs(blobs, dim):
+    if not blobs:
+        return np.zeros((0, dim), dtype=np.float16)
+    return np.frombuffer(b"".join(blobs), dtype=np.float16).reshape(len(blobs), dim)
+
+
+def store(connection, rows, model):
+    """Upsert ``rows`` of (entry_id, user_id, float32 vector)."""
+    params = [{"entry_id": entry_id, "user_id": user_id, "model": model,
+               "dim": len(vector), "vector": to_blob(vector)}
+              for entry_id, user_id, vector in rows]
+    if params:
+        connection.execute(
+            text(f"INSERT OR REPLACE INTO {EMBEDDING_TABLE} (entry_id, user_id, model, dim, vector) "
+                 "VALUES (:entry_id, :user_id, :model, :dim, :vector)"),
+            params,
+        )
+    return len(params)
+
+
+def delete_for_entries(connection, entry_ids):
+    for start in range(0, len(entry_ids), 500):
+        ids = ",".join(str(int(i)) for i in entry_ids[start:start + 500])
+        connection.execute(text(f"DELETE FROM {EMBEDDING_TABLE} WHERE entry_id IN ({ids})"))
+
+
+def missing_entries(connection, model, user_id=None, limit=256, after_id=0):
+    """(id, user_id, title, text) of entries with no vector from ``model``, in id order."""
+    where = "AND e.user_id = :user_id" if user_id is not None else ""
+    return connection.execute(
+        text(f"SELECT e.id, e.user_id, e.title, e.text FROM entry e "
+             f"LEFT JOIN {EMBEDDING_TABLE} v ON v.entry_id = e.id AND v.model = :model "
+             f"WHERE v.entry_id IS NULL AND e.id > :after_id {where} ORDER BY e.id LIMIT :limit"),
+        {"model": model, "user_id": user_id, "limit": limit, "after_id": after_id},
+    ).all()
+
+
+def load_user_vectors(connection, user_id, model):
+    """(entry ids, float16 matrix) of one user's vectors from ``model``."""
+    rows = connection.execute(
+        text(f"SELECT entry_id, dim, vector FROM {EMBEDDING_TABLE} "
+             f"WHERE user_id = :user_id AND model = :model ORDER BY entry_id"),
+        {"user_id": user_id, "model": model},
+    ).all()
+    if not rows:
+        return np.zeros(0, dtype=np.int64), None
+    dim = rows[0][1]
+    return np.array([r[0] for r in rows], dtype=np.int64), from_blobs([r[2] for r in rows], dim)
+
+
+def load_vector(connection, entry_id, model):
+    row = connection.execute(
+        text(f"SELECT dim, vector FROM {EMBEDDING_TABLE} WHERE entry_id = :id AND model = :model"),
+        {"id": entry_id, "model": model},
+    ).first()
+    if row is None:
+        return None
+    return np.frombuffer(row[1], dtype=np.float16).astype(np.float32)
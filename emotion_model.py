@@ -0,0 +1,228 @@
+"""
+情绪模型加载层：按需加载 HuggingFace 分类器，而不是在 import app 时就加载。
+
+- lazy：第一次调用 predict_mood 时才加载（默认）；
+- background：启动后在后台线程里预热，不阻塞 /login 等页面；
+- preload：在 import 时同步加载，并 gc.freeze()，配合 gunicorn --preload
+  让 fork 出来的 worker 通过 copy-on-write 共享同一份模型内存。
+
+后端（EMOTION_BACKEND）：
+- transformers：原来的 PyTorch 全精度 pipeline；
+- quantized：同一个模型，Linear 层做 int8 动态量化，CPU 上更快、更省内存；
+- onnx：ONNX Runtime 跑同一个模型（optimum 导出，或 model_path 指向已导出的目录）；
+- sklearn：ml_model.py 训练的 TF-IDF + LogisticRegression（models/ 下的 joblib）；
+- rules：不加载任何模型，只用 mood_rules 的关键词规则。
+所有后端都输出同一套 HuggingFace 标签（joy / sadness / neutral ...），
+再由 mood_rules.mood_from_label 映射成 7 种情绪。
+"""
+import gc
+import os
+import resource
+import threading
+import time
+
+EMOTION_MODEL_NAME = "j-hartmann/emotion-english-distilroberta-base"
+WARMUP_MODES = ("lazy", "background", "preload")
+BACKENDS = ("transformers", "quantized", "onnx", "sklearn", "rules")
+SKLEARN_MODEL_FILE = "sentiment_model.joblib"
+SKLEARN_VECTORIZER_FILE = "tfidf_vectorizer.joblib"
+# sklearn 模型只分正 / 负面：正面概率落在中间这一段就算 neutral
+SKLEARN_NEUTRAL_BAND = (0.4, 0.6)
+
+
+def _top_label(pred):
+    # 兼容不同返回格式：可能是 {label,score}、[ {label,score} ] 或 [ [ {..} ] ]
+    while isinstance(pred, list):
+        pred = pred[0]
+    return pred["label"].lower()
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (falls back to peak RSS)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        # ru_maxrss 在 Linux 上是 KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class EmotionModelProvider:
+    """Loads the emotion classifier once per process, on first use."""
+
+    def __init__(self, model_name=EMOTION_MODEL_NAME, backend="transformers", model_path=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown emotion backend {backend!r}, expected one of {BACKENDS}")
+        self.model_name = model_name
+        self.backend = backend
+        # onnx：已导出模型的目录；sklearn：joblib 文件所在目录
+        self.model_path = model_path
+        self._classifier = None
+        self._loaded = False
+        self._error = None
+        self._lock = threading.Lock()
+        self._warmup_thread = None
+        self.load_seconds = None
+        self.rss_before_mb = None
+        self.rss_after_mb = None
+        self.loaded_in_pid = None
+
+    @property
+    def version(self):
+        """Identifies what produces the labels, for cache keys."""
+        if self.backend == "sklearn":
+            return f"sklearn:{self.model_path or 'models'}"
+        return f"{self.backend}:{self.model_name}"
+
+    def _build(self):
+        # 返回 predict(texts, max_length) -> labels；transformers / torch 只在真正需要时才 import
+        if self.backend == "sklearn":
+            return self._build_sklearn()
+        from transformers import pipeline
+        if self.backend == "onnx":
+            from optimum.onnxruntime import ORTModelForSequenceClassification
+            from transformers import AutoTokenizer
+            source = self.model_path or self.model_name
+            model = ORTModelForSequenceClassification.from_pretrained(
+                source, export=self.model_path is None
+            )
+            classifier = pipeline(
+                "text-classification",
+                model=model,
+                tokenizer=AutoTokenizer.from_pretrained(source),
+                top_k=1,
+            )
+        else:
+            classifier = pipeline(
+                "text-classification",
+                model=self.model_name,
+                top_k=1  # 只要得分最高的那一个标签
+            )
+            if self.backend == "quantized":
+                import torch
+                classifier.model = torch.quantization.quantize_dynamic(
+                    classifier.model, {torch.nn.Linear}, dtype=torch.qint8
+                )
+
+        def predict(texts, max_length):
+            preds = classifier(texts, batch_size=len(texts), truncation=True, max_length=max_length)
+            return [_top_label(pred) for pred in preds]
+        return predict
+
+    def _build_sklearn(self):
+        import joblib
+        directory = self.model_path or "models"
+        model = joblib.load(os.path.join(directory, SKLEARN_MODEL_FILE))
+        vectorizer = joblib.load(os.path.join(directory, SKLEARN_VECTORIZER_FILE))
+        positive = list(model.classes_).index(1)
+        low, high = SKLEARN_NEUTRAL_BAND
+
+        def predict(texts, max_length):
+            # 二分类情感模型：分不出 anger / fear，负面一律当 sadness
+            probs = model.predict_proba(vectorizer.transform(texts))[:, positive]
+            return ["joy" if p >= high else "sadness" if p <= low else "neutral" for p in probs]
+        return predict
+
+    def _load(self):
+        self.rss_before_mb = current_rss_mb()
+        start = time.perf_counter()
+        try:
+            if self.backend == "rules":
+                print("ℹ️ EMOTION_BACKEND=rules, using keyword rules only.")
+            else:
+                self._classifier = self._build()
+                print(f"✅ Emotion model ({self.backend}) loaded in {time.perf_counter() - start:.2f}s.")
+        except Exception as e:
+            self._classifier = None
+            self._error = e
+            print("⚠️ Could not load emotion model, fallback to TextBlob rules:", e)
+        self.load_seconds = time.perf_counter() - start
+        self.rss_after_mb = current_rss_mb()
+        self.loaded_in_pid = os.getpid()
+        self._loaded = True
+
+    def get(self):
+        """Return the classifier, loading it if needed; None if it cannot be loaded."""
+        if self._loaded:
+            return self._classifier
+        with self._lock:
+            if not self._loaded:
+                self._load()
+        return self._classifier
+
+    def classify(self, texts, batch_size=32, max_length=512):
+        """
+        Return the top emotion label for each text, in input order.
+
+        Texts are sorted by length and cut into batches, so each batch is
+        padded only up to its own longest member; anything beyond
+        ``max_length`` tokens is truncated instead of failing the batch.
+        Returns None when the model is unavailable.
+        """
+        classifier = self.get()
+        if classifier is None:
+            return None
+        texts = list(texts)
+        labels = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), batch_size):
+            bucket = order[start:start + batch_size]
+            preds = classifier([texts[i] for i in bucket], max_length)
+            for i, label in zip(bucket, preds):
+                labels[i] = label
+        return labels
+
+    @property
+    def is_loaded(self):
+        return self._loaded
+
+    @property
+    def failed(self):
+        """True once a load has been attempted and did not produce a classifier."""
+        return self._loaded and self._classifier is None
+
+    def warmup(self):
+        """Start loading in a daemon thread so the first request doesn't pay for it."""
+        if self._loaded or self._warmup_thread is not None:
+            return
+        self._warmup_thread = threading.Thread(
+            target=self.get, name="emotion-model-warmup", daemon=True
+        )
+        self._warmup_thread.start()
+
+    def preload(self):
+        """
+        Load synchronously and move everything allocated so far into the
+        permanent GC generation, so pre-forked workers don't touch (and copy)
+        the model's pages when the collector runs.
+        """
+        self.get()
+        if hasattr(gc, "freeze"):
+            gc.collect()
+            gc.freeze()
+
+    def start(self, mode):
+        if mode == "preload":
+            self.preload()
+        elif mode == "background":
+            self.warmup()
+        elif mode != "lazy":
+            raise ValueError(f"Unknown warmup mode {mode!r}, expected one of {WARMUP_MODES}")
+
+    def stats(self):
+        rss_delta = None
+        if self.rss_before_mb is not None and self.rss_after_mb is not None:
+            rss_delta = round(self.rss_after_mb - self.rss_before_mb, 1)
+        return {
+            "backend": self.backend,
+            "model": self.model_name if self.backend != "sklearn" else self.model_path or "models",
+            "loaded": self._loaded,
+            "available": self._classifier is not None,
+            "error": str(self._error) if self._error else None,
+            "load_seconds": round(self.load_seconds, 3) if self.load_seconds is not None else None,
+            "rss_delta_mb": rss_delta,
+            "rss_mb": round(current_rss_mb(), 1),
+            "loaded_in_pid": self.loaded_in_pid,
+            "pid": os.getpid(),
+        }
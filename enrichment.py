@@ -0,0 +1,136 @@
+"""
+后台 enrichment 队列：保存日记时先写入 pending 状态，
+情绪 / 标签由本地线程池异步补上，请求不再等 NLP 跑完。
+"""
+import os
+import queue
+import threading
+import time
+
+
+class EnrichmentQueue:
+    """
+    A bounded, coalescing job queue served by a small pool of worker threads.
+
+    Jobs are identified by a key: any hashable value, passed as is to the
+    handler (the app uses (user id, entry id)). Submitting a key that is
+    already waiting is a no-op; submitting a key that is currently being
+    processed schedules exactly one re-run afterwards, so a burst of edits to
+    the same entry costs at most two passes. ``handler(key)`` is retried with
+    exponential backoff; after ``max_retries`` failures ``on_failure(key, exc)``
+    is called instead.
+    """
+
+    def __init__(self, handler, workers=2, maxsize=1000, max_retries=3,
+                 retry_delay=0.5, on_failure=None, name="enrichment"):
+        self.handler = handler
+        self.on_failure = on_failure
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.name = name
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._waiting = set()
+        self._running = set()
+        self._rerun = set()
+        self._threads = []
+        self._pid = None
+        self.counters = {
+            "submitted": 0, "coalesced": 0, "rejected": 0,
+            "done": 0, "retried": 0, "failed": 0,
+        }
+
+    def _ensure_started(self):
+        # 线程不会跨 fork 存活：每个 worker 进程第一次提交时再启动自己的线程
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+
+    def submit(self, key, attempt=0):
+        """Queue ``key``; returns False if the queue is full and the caller should run it inline."""
+        self._ensure_started()
+        with self._lock:
+            if attempt == 0:
+                if key in self._waiting:
+                    self.counters["coalesced"] += 1
+                    return True
+                if key in self._running:
+                    self._rerun.add(key)
+                    self.counters["coalesced"] += 1
+                    return True
+            try:
+                self._queue.put_nowait((key, attempt))
+            except queue.Full:
+                self.counters["rejected"] += 1
+                return False
+            self._waiting.add(key)
+            self.counters["submitted"] += 1
+            return True
+
+    def _run(self):
+        while True:
+            key, attempt = self._queue.get()
+            with self._lock:
+                self._waiting.discard(key)
+                self._running.add(key)
+            try:
+                self.handler(key)
+            except Exception as e:
+                self._handle_error(key, attempt, e)
+            else:
+                self.counters["done"] += 1
+            finally:
+                with self._lock:
+                    self._running.discard(key)
+                    rerun = key in self._rerun
+                    self._rerun.discard(key)
+                if rerun:
+                    self.submit(key)
+                self._queue.task_done()
+
+    def _handle_error(self, key, attempt, exc):
+        if attempt + 1 < self.max_retries:
+            self.counters["retried"] += 1
+            delay = self.retry_delay * (2 ** attempt)
+            timer = threading.Timer(delay, self._resubmit, args=(key, attempt + 1, exc))
+            timer.daemon = True
+            timer.start()
+            return
+        self.counters["failed"] += 1
+        print(f"Enrichment failed for {key!r} after {attempt + 1} attempts:", exc)
+        if self.on_failure is not None:
+            try:
+                self.on_failure(key, exc)
+            except Exception as e:
+                print(f"Enrichment failure handler error for {key!r}:", e)
+
+    def _resubmit(self, key, attempt, exc):
+        if not self.submit(key, attempt=attempt):
+            self._handle_error(key, self.max_retries, exc)
+
+    def join(self, timeout=None):
+        """
+        Wait until the queue is drained (retries scheduled on timers are not
+        awaited). Returns False if ``timeout`` seconds passed first.
+        """
+        if self._pid != os.getpid():
+            # 这个进程还没启动过 worker：队列里的东西（fork 时从父进程带过来的）不归它处理
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def stats(self):
+        return dict(self.counters, queued=self._queue.qsize(), running=len(self._running))
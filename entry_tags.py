@@ -0,0 +1,80 @@
+"""
+规范化标签表 entry_tag(entry_id, tag, user_id)：
+Entry.tags 仍然保留逗号拼接的字符串用来展示，查询 / 统计都走这张表。
+"""
+from sqlalchemy import column, func, select, table, text
+
+TAG_TABLE = "entry_tag"
+MAX_TAG_LENGTH = 100
+
+entry_tag = table(TAG_TABLE, column("entry_id"), column("tag"), column("user_id"))
+
+
+def parse_tags(tags):
+    """'School, #exam, school' -> ['school', 'exam'] (lowercase, no '#', no duplicates)."""
+    if not tags:
+        return []
+    seen = []
+    for raw in tags.split(","):
+        tag = raw.strip().lstrip("#").strip().lower()[:MAX_TAG_LENGTH]
+        if tag and tag not in seen:
+            seen.append(tag)
+    return seen
+
+
+def delete_for_entries(connection, entry_ids):
+    for start in range(0, len(entry_ids), 500):
+        ids = ",".join(str(int(i)) for i in entry_ids[start:start + 500])
+        connection.execute(text(f"DELETE FROM {TAG_TABLE} WHERE entry_id IN ({ids})"))
+
+
+def replace_many(connection, rows):
+    """Rewrite the tag rows of ``rows`` of (entry_id, user_id, tags)."""
+    rows = list(rows)
+    delete_for_entries(connection, [row[0] for row in rows])
+    return backfill(connection, rows)
+
+
+def backfill(connection, rows, batch_size=1000):
+    """Insert tag rows for ``rows`` of (entry_id, user_id, tags); returns the number of entries."""
+    insert = text(f"INSERT OR IGNORE INTO {TAG_TABLE} (entry_id, tag, user_id) "
+                  "VALUES (:entry_id, :tag, :user_id)")
+    batch, total = [], 0
+    for entry_id, user_id, tag_string in rows:
+        batch.extend({"entry_id": entry_id, "tag": t, "user_id": user_id}
+                     for t in parse_tags(tag_string))
+        total += 1
+        if len(batch) >= batch_size:
+            connection.execute(insert, batch)
+            batch = []
+    if batch:
+        connection.execute(insert, batch)
+    return total
+
+
+def matching_entry_ids(user_id, tag_list, mode="all"):
+    """
+    Subquery of entry ids carrying the given tags:
+    mode='all' → every tag (AND), mode='any' → at least one (OR).
+    """
+    wanted = parse_tags(",".join(tag_list))
+    query = select(entry_tag.c.entry_id).where(
+        entry_tag.c.user_id == user_id, entry_tag.c.tag.in_(wanted)
+    )
+    if mode == "all" and len(wanted) > 1:
+        query = query.group_by(entry_tag.c.entry_id).having(
+            func.count(entry_tag.c.tag) == len(wanted)
+        )
+    return query
+
+
+def tag_counts(connection, user_id, limit=20):
+    """[(tag, count), ...] for one user, most used first."""
+    query = (
+        select(entry_tag.c.tag, func.count().label("n"))
+        .where(entry_tag.c.user_id == user_id)
+        .group_by(entry_tag.c.tag)
+        .order_by(func.count().desc(), entry_tag.c.tag)
+        .limit(limit)
+    )
+    return [(tag, n) for tag, n in connection.execute(query)]
@@ -0,0 +1,143 @@
+"""
+日记批量导入 / 导出（JSONL、CSV），全部流式处理，内存占用和条数无关。
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from itertools import islice
+
+EXPORT_FIELDS = ["id", "title", "text", "tags", "mood", "date_created"]
+FORMATS = ("jsonl", "csv")
+
+
+class ImportStopped(ValueError):
+    """
+    The file became unreadable part way through. The first ``processed``
+    records were already committed (``imported`` of them saved, the rest
+    skipped as invalid); nothing after them was.
+    """
+
+    def __init__(self, reason, imported, skipped):
+        super().__init__(f"{reason} (after {imported} entries were imported)")
+        self.reason = reason
+        self.imported = imported
+        self.skipped = skipped
+
+    @property
+    def processed(self):
+        return self.imported + self.skipped
+
+    def progress(self):
+        if not self.processed:
+            return "Nothing was imported."
+        return (f"Imported {self.imported} entries from the first {self.processed} records before that; "
+                f"remove those records before uploading the fixed file, or they will be imported twice.")
+
+
+def guess_format(filename, default="jsonl"):
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    return default
+
+
+def read_records(stream, fmt):
+    """Yield one dict per record from a text stream."""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+        return
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {line_no}: invalid JSON ({e})")
+        if not isinstance(record, dict):
+            raise ValueError(f"line {line_no}: expected a JSON object")
+        yield record
+
+
+def _string(record, *names):
+    """The first non-empty of ``names`` as a string ("" if none); ValueError for other JSON types."""
+    for name in names:
+        value = record.get(name)
+        if value is None or value == "":
+            continue
+        if not isinstance(value, str):
+            raise ValueError(f"{name} must be a string, not {type(value).__name__}")
+        return value
+    return ""
+
+
+def normalize_record(record, valid_moods):
+    """
+    Pick the fields we import from a raw record.
+    Raises ValueError for records without text, with an unreadable date or
+    with a field of the wrong type.
+    """
+    text = _string(record, "text").strip()
+    if not text:
+        raise ValueError("missing text")
+    date_created = _string(record, "date_created", "date").strip()
+    if date_created:
+        try:
+            date_created = datetime.fromisoformat(date_created)
+        except ValueError:
+            raise ValueError(f"bad date {date_created!r}")
+    else:
+        date_created = None
+    mood = _string(record, "mood").strip().lower()
+    tags = record.get("tags")
+    if isinstance(tags, list):
+        if not all(isinstance(t, str) for t in tags):
+            raise ValueError("tags must be a list of strings")
+        tags = ", ".join(tags)
+    else:
+        tags = _string(record, "tags")
+    return {
+        "title": _string(record, "title")[:150],
+        "text": text,
+        "tags": tags.strip() or None,
+        "mood": mood if mood in valid_moods else None,
+        "date_created": date_created,
+    }
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _export_dict(row):
+    record = dict(zip(EXPORT_FIELDS, row))
+    if record["date_created"] is not None:
+        record["date_created"] = record["date_created"].isoformat()
+    return record
+
+
+def export_jsonl(rows):
+    """Yield one JSON line per row of EXPORT_FIELDS values."""
+    for row in rows:
+        yield json.dumps(_export_dict(row), ensure_ascii=False) + "\n"
+
+
+def export_csv(rows):
+    """Yield a header line and then one CSV line per row."""
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(_export_dict(row))
+        yield buf.getvalue()
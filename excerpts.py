@@ -0,0 +1,28 @@
+"""
+列表页 / 搜索页卡片用的摘要和字数，保存日记时算好存在 entry 上，
+翻页时只读这两列，不用把整篇正文读出来。
+"""
+import re
+
+EXCERPT_LENGTH = 160
+
+_SPACE_RE = re.compile(r"\s+")
+# 中日文按字算，其他按连续的字母数字算一个词
+_WORD_RE = re.compile(r"[぀-ヿ㐀-鿿]|[^\W぀-ヿ㐀-鿿]+")
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """The start of ``text`` on one line, cut at a word boundary with "..." when longer than ``length``."""
+    flat = _SPACE_RE.sub(" ", text or "").strip()
+    if len(flat) <= length:
+        return flat
+    cut = flat[:length]
+    space = cut.rfind(" ")
+    # 没有合适的空格（比如中文）就直接按字数截
+    if space > length // 2:
+        cut = cut[:space]
+    return cut.rstrip(" ,.;:!?，。；：！？") + "..."
+
+
+def word_count(text):
+    return len(_WORD_RE.findall(text or ""))
@@ -0,0 +1,308 @@
+"""
+性能观测：热路径计时 span、按路由的延迟直方图、Prometheus 格式的 /metrics，
+以及可选的采样 profiler（慢请求时把调用栈按 flamegraph 的 folded 格式写到文件）。
+
+默认全部关闭：span() 只判断一个全局开关就返回空的 context manager，
+不注册任何 Flask / SQLAlchemy 钩子，几乎没有开销。
+
+    METRICS_ENABLED=1        打开 span、直方图、/metrics 和 Server-Timing 响应头
+    METRICS_TOKEN=...        /metrics 需要 "Authorization: Bearer <token>"
+    PROFILE_SLOW_MS=500      打开采样 profiler，超过 500ms 的请求落盘
+    PROFILE_INTERVAL_MS=5    采样间隔
+    PROFILE_DIR=profiles     folded 栈文件的目录（flamegraph.pl / speedscope 可直接打开）
+"""
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import wraps
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+REQUEST_METRIC = "diary_request_duration_seconds"
+SPAN_METRIC = "diary_span_duration_seconds"
+
+_enabled = False
+_NULL = nullcontext()
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect_left(self.buckets, seconds)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((labels, ([*s[0]], s[1], s[2])) for labels, s in self._series.items())
+        for labels, (counts, total, count) in items:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_histogram = Histogram(REQUEST_METRIC, "Request latency by endpoint.", ("endpoint", "method", "status"))
+span_histogram = Histogram(SPAN_METRIC, "Time spent in instrumented hot paths.", ("span",))
+_gauges = []
+
+
+def enabled():
+    return _enabled
+
+
+def observe(name, seconds):
+    """Record ``seconds`` for span ``name`` (and add it to the current request's Server-Timing)."""
+    span_histogram.observe((name,), seconds)
+    if has_request_context():
+        spans = g.setdefault("_spans", {})
+        total, count = spans.get(name, (0.0, 0))
+        spans[name] = (total + seconds, count + 1)
+
+
+@contextmanager
+def _span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def span(name):
+    """``with span("model.classify"): ...``; a shared no-op when metrics are off."""
+    return _span(name) if _enabled else _NULL
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def register_gauges(fn):
+    """``fn()`` returns {metric name: value}; collected on every /metrics scrape."""
+    _gauges.append(fn)
+    return fn
+
+
+def render_metrics():
+    lines = request_histogram.render() + span_histogram.render()
+    for fn in _gauges:
+        try:
+            values = fn()
+        except Exception as e:
+            print("Metrics gauge failed:", e)
+            continue
+        for name, value in sorted(values.items()):
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ========== 采样 profiler ==========
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class SlowRequestProfiler:
+    """
+    Samples the stacks of threads that are serving a request every
+    ``interval`` seconds; requests slower than ``slow_ms`` are written out as
+    folded stacks ("frame;frame;frame count" per line).
+    """
+
+    def __init__(self, slow_ms, interval=0.005, out_dir="profiles"):
+        self.slow_ms = slow_ms
+        self.interval = interval
+        self.out_dir = out_dir
+        self._active = {}
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # gunicorn fork 之后每个 worker 自己起一个采样线程
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name="request-sampler", daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for ident, samples in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+    def begin(self):
+        self._ensure_thread()
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = Counter()
+        return ident
+
+    def end(self, ident, duration, label):
+        with self._lock:
+            samples = self._active.pop(ident, None)
+        if not samples or duration * 1000 < self.slow_ms:
+            return None
+        os.makedirs(self.out_dir, exist_ok=True)
+        stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        path = os.path.join(self.out_dir, f"{stamp}-{label}-{int(duration * 1000)}ms.folded")
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        print(f"Slow request {label} took {duration * 1000:.0f}ms, stacks written to {path}")
+        return path
+
+
+# ========== Flask / SQLAlchemy 接入 ==========
+
+def _instrument_engine(engine):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_query_start")
+        if starts:
+            observe("db.query", time.perf_counter() - starts.pop())
+
+
+def _instrument_session(session_class):
+    @event.listens_for(session_class, "before_commit")
+    def _before_commit(session):
+        session.info["_commit_start"] = time.perf_counter()
+
+    @event.listens_for(session_class, "after_commit")
+    def _after_commit(session):
+        start = session.info.pop("_commit_start", None)
+        if start is not None:
+            observe("db.commit", time.perf_counter() - start)
+
+
+def _endpoint_label():
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+
+def init_app(app, engines=(), session_class=None):
+    """Wire everything up according to app.config; a no-op when both switches are off."""
+    global _enabled
+    metrics_on = app.config.get("METRICS_ENABLED", False)
+    profiler = None
+    if app.config.get("PROFILE_SLOW_MS"):
+        profiler = SlowRequestProfiler(
+            app.config["PROFILE_SLOW_MS"],
+            interval=app.config.get("PROFILE_INTERVAL_MS", 5) / 1000,
+            out_dir=app.config.get("PROFILE_DIR", "profiles"),
+        )
+    if not metrics_on and profiler is None:
+        return None
+
+    if metrics_on:
+        _enabled = True
+        for engine in engines:
+            _instrument_engine(engine)
+        if session_class is not None:
+            _instrument_session(session_class)
+
+        @app.route("/metrics")
+        def metrics():
+            token = app.config.get("METRICS_TOKEN")
+            if token and request.headers.get("Authorization") != f"Bearer {token}":
+                abort(403)
+            return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    @app.before_request
+    def _start_timer():
+        g._request_start = time.perf_counter()
+        if profiler is not None:
+            g._profile_ident = profiler.begin()
+
+    @app.after_request
+    def _record(response):
+        start = g.pop("_request_start", None)
+        if start is None:
+            return response
+        duration = time.perf_counter() - start
+        endpoint = _endpoint_label()
+        if metrics_on and request.endpoint != "metrics":
+            request_histogram.observe((endpoint, request.method, str(response.status_code)), duration)
+            spans = g.get("_spans")
+            if spans:
+                response.headers["Server-Timing"] = ", ".join(
+                    f"{name.replace('.', '-')};dur={total * 1000:.1f}" for name, (total, _) in spans.items()
+                )
+        if profiler is not None:
+            ident = g.pop("_profile_ident", None)
+            if ident is not None:
+                label = (request.endpoint or "unmatched").replace(".", "_")
+                profiler.end(ident, duration, label)
+        return response
+
+    if profiler is not None:
+        @app.teardown_request
+        def _drop_sample(exc):
+            # 出异常时 after_request 不会执行，这里把采样登记清掉
+            ident = g.pop("_profile_ident", None)
+            if ident is not None:
+                profiler.end(ident, 0, "error")
+
+    return profiler
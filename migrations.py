@@ -0,0 +1,261 @@
+"""
+版本化数据库迁移，替代原来的 migrate_*.py 一次性脚本。
+
+- 已应用的版本记录在 schema_migrations 表里；
+- 每个迁移都必须可以重复执行（新库由 db.create_all() 建好，迁移只补缺的东西）；
+- 大表回填按 id 分批，每批一个短事务，不会长时间锁住整个库，中途中断可以直接重跑。
+
+新增迁移：在文件末尾用 @migration(下一个版本号, "说明") 注册一个函数。
+"""
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import embeddings
+import entry_tags
+import excerpts
+import mood_rollup
+import recalc
+import search_index
+import text_codec
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TEXT NOT NULL)"
+    ))
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def current_version(engine):
+    return max(applied_versions(engine), default=0)
+
+
+def pending(engine):
+    done = applied_versions(engine)
+    return [(v, name) for v, name, _ in MIGRATIONS if v not in done]
+
+
+def upgrade(engine, target=None, batch_size=1000, log=print):
+    """Apply every pending migration up to ``target``; returns the versions applied."""
+    done = applied_versions(engine)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        log(f"Applying migration {version}: {name}")
+        fn(engine, batch_size=batch_size, log=log)
+        with engine.begin() as conn:
+            conn.execute(
+                text("INSERT OR IGNORE INTO schema_migrations (version, name, applied_at) "
+                     "VALUES (:v, :n, :t)"),
+                {"v": version, "n": name, "t": datetime.utcnow().isoformat()},
+            )
+        applied.append(version)
+    return applied
+
+
+# ---------- helpers ----------
+
+def column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(text(f"PRAGMA table_info({table})")))
+
+
+def add_column(conn, table, column, ddl):
+    if column_exists(conn, table, column):
+        return False
+    try:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    except OperationalError as e:
+        # 另一个 worker 同时启动、先加上了
+        if "duplicate column" not in str(e):
+            raise
+        return False
+    return True
+
+
+def backfill_in_batches(engine, select_sql, handle, batch_size=1000, log=print, label="rows",
+                        params=None):
+    """
+    Walk ``select_sql`` in id order, one short transaction per batch.
+
+    ``select_sql`` must select ``id`` first and contain ``id > :last_id`` and
+    ``LIMIT :batch_size``; ``handle(conn, rows)`` writes the batch.
+    """
+    last_id, total = 0, 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(select_sql), dict(params or {}, last_id=last_id, batch_size=batch_size)
+            ).all()
+            if not rows:
+                break
+            handle(conn, rows)
+        last_id = rows[-1][0]
+        total += len(rows)
+        log(f"  {label}: {total} done")
+    return total
+
+
+# ---------- migrations ----------
+
+@migration(1, "add entry.title and entry.tags")
+def _add_title_and_tags(engine, batch_size, log):
+    with engine.begin() as conn:
+        add_column(conn, "entry", "title", "TEXT DEFAULT ''")
+        add_column(conn, "entry", "tags", "TEXT")
+
+
+@migration(2, "add entry.mood")
+def _add_mood(engine, batch_size, log):
+    # 旧脚本写成了不存在的 entries 表
+    with engine.begin() as conn:
+        add_column(conn, "entry", "mood", "TEXT")
+
+
+@migration(3, "composite indexes on entry")
+def _entry_indexes(engine, batch_size, log):
+    with engine.begin() as conn:
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_entry_user_mood ON entry (user_id, mood)"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_entry_user_date_id ON entry (user_id, date_created, id)"
+        ))
+
+
+@migration(4, "entry_tag table backfilled from entry.tags")
+def _entry_tag_table(engine, batch_size, log):
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {entry_tags.TAG_TABLE} ("
+            " entry_id INTEGER NOT NULL REFERENCES entry (id) ON DELETE CASCADE,"
+            f" tag VARCHAR({entry_tags.MAX_TAG_LENGTH}) NOT NULL,"
+            " user_id INTEGER NOT NULL,"
+            " PRIMARY KEY (entry_id, tag))"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_entry_tag_user_tag ON {entry_tags.TAG_TABLE} (user_id, tag, entry_id)"
+        ))
+    backfill_in_batches(
+        engine,
+        "SELECT id, user_id, tags FROM entry WHERE id > :last_id ORDER BY id LIMIT :batch_size",
+        lambda conn, rows: entry_tags.backfill(conn, rows),
+        batch_size=batch_size, log=log, label="entry tags",
+    )
+
+
+@migration(5, "entry_fts full-text index backfill")
+def _entry_fts(engine, batch_size, log):
+    with engine.begin() as conn:
+        if not search_index.ensure_schema(conn):
+            log("  FTS5 not available, skipped")
+            return
+    backfill_in_batches(
+        engine,
+        f"SELECT id, user_id, title, text, tags FROM entry WHERE id > :last_id "
+        f"AND NOT EXISTS (SELECT 1 FROM {search_index.FTS_TABLE} WHERE rowid = entry.id) "
+        f"ORDER BY id LIMIT :batch_size",
+        lambda conn, rows: search_index.index_entries(
+            conn, [(r[0], r[1], r[2], text_codec.decode(r[3]), r[4]) for r in rows]),
+        batch_size=batch_size, log=log, label="search index",
+    )
+
+
+@migration(6, "mood_rollup daily counts")
+def _mood_rollup(engine, batch_size, log):
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {mood_rollup.ROLLUP_TABLE} ("
+            " user_id INTEGER NOT NULL, day VARCHAR(10) NOT NULL, mood VARCHAR(50) NOT NULL,"
+            " count INTEGER NOT NULL, PRIMARY KEY (user_id, day, mood))"
+        ))
+        user_ids = [row[0] for row in conn.execute(text("SELECT DISTINCT user_id FROM entry"))]
+    # 每个用户一个短事务
+    for n, user_id in enumerate(user_ids, 1):
+        with engine.begin() as conn:
+            mood_rollup.rebuild(conn, user_id)
+        if n % 100 == 0 or n == len(user_ids):
+            log(f"  mood rollup: {n}/{len(user_ids)} users")
+
+
+@migration(7, "entry_embedding table")
+def _entry_embedding(engine, batch_size, log):
+    with engine.begin() as conn:
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {embeddings.EMBEDDING_TABLE} ("
+            " entry_id INTEGER NOT NULL REFERENCES entry (id) ON DELETE CASCADE,"
+            " user_id INTEGER NOT NULL, model VARCHAR(200) NOT NULL, dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL, PRIMARY KEY (entry_id))"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_entry_embedding_user_model "
+            f"ON {embeddings.EMBEDDING_TABLE} (user_id, model)"
+        ))
+        has_entries = conn.execute(text("SELECT 1 FROM entry LIMIT 1")).first() is not None
+    # 向量取决于配置的编码器，不在迁移里算：交给 flask build_embeddings 或查询时补算
+    if has_entries:
+        log("  run `flask build_embeddings` to compute vectors for existing entries")
+
+
+@migration(8, "add entry.mood_model and recalc_checkpoint table")
+def _recalc_checkpoint(engine, batch_size, log):
+    # 旧日记的 mood_model 留空：不知道是哪个版本算的，recalc_mood --stale 会把它们算进去
+    with engine.begin() as conn:
+        add_column(conn, "entry", "mood_model", "VARCHAR(200)")
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {recalc.CHECKPOINT_TABLE} ("
+            " job VARCHAR(100) NOT NULL PRIMARY KEY, params TEXT,"
+            " last_id INTEGER NOT NULL DEFAULT 0, processed INTEGER NOT NULL DEFAULT 0,"
+            " changed INTEGER NOT NULL DEFAULT 0, started_at VARCHAR(32), updated_at VARCHAR(32),"
+            " finished_at VARCHAR(32))"
+        ))
+
+
+@migration(9, "add entry.excerpt and entry.word_count")
+def _entry_excerpt(engine, batch_size, log):
+    with engine.begin() as conn:
+        add_column(conn, "entry", "excerpt", f"VARCHAR({excerpts.EXCERPT_LENGTH + 3})")
+        add_column(conn, "entry", "word_count", "INTEGER")
+
+    def handle(conn, rows):
+        conn.execute(
+            text("UPDATE entry SET excerpt = :excerpt, word_count = :word_count WHERE id = :id"),
+            [{"id": row[0], "excerpt": excerpts.make_excerpt(body), "word_count": excerpts.word_count(body)}
+             for row, body in ((row, text_codec.decode(row[1])) for row in rows)],
+        )
+
+    backfill_in_batches(
+        engine,
+        "SELECT id, text FROM entry WHERE id > :last_id AND excerpt IS NULL ORDER BY id LIMIT :batch_size",
+        handle, batch_size=batch_size, log=log, label="excerpts",
+    )
+
+
+@migration(10, "add entry.tags_model")
+def _add_tags_model(engine, batch_size, log):
+    # 旧日记的标签分不清是手填的还是自动生成的，留空；flask retag --include-untracked 才会动它们
+    with engine.begin() as conn:
+        add_column(conn, "entry", "tags_model", "VARCHAR(50)")
+
+
+@migration(11, "add user.data_version")
+def _add_data_version(engine, batch_size, log):
+    # 从 0 开始就行：整页缓存是空的，之后每次写日记 +1
+    with engine.begin() as conn:
+        add_column(conn, "user", "data_version", "INTEGER NOT NULL DEFAULT 0")
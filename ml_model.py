@@ -1,56 +1,252 @@
 # ml_model.py
-import nltk
-from nltk.corpus import movie_reviews
+"""
+Train the TF-IDF + LogisticRegression sentiment model on NLTK movie_reviews.
+
+    python ml_model.py                    # seed 42, grid search on all cores
+    python ml_model.py --seed 7 --n-jobs 4 --C 0.5 1 2 4
+
+Every run writes a versioned directory models/<version>/ with the model, the
+vectorizer and report.json (params, metrics, inference latency, file hashes),
+and by default also refreshes models/sentiment_model.joblib and
+models/tfidf_vectorizer.joblib, which the app's sklearn backend loads.
+Vectorized features are cached per (corpus, seed, split, vectorizer params),
+so re-running with a different grid skips the TF-IDF step.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
 import random
-import numpy as np
-from sklearn.model_selection import train_test_split
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+import shutil
+import time
+from datetime import datetime
+
 import joblib
-import os
+import numpy as np
+
+MODEL_FILE = "sentiment_model.joblib"
+VECTORIZER_FILE = "tfidf_vectorizer.joblib"
+REPORT_FILE = "report.json"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output-dir", default="models")
+    parser.add_argument("--version", default=None, help="Artifact version (default: UTC timestamp).")
+    parser.add_argument("--cache-dir", default=".feature_cache", help="Where vectorized features are cached.")
+    parser.add_argument("--no-cache", action="store_true", help="Always re-vectorize.")
+    parser.add_argument("--n-jobs", type=int, default=-1, help="Parallel grid-search jobs (-1 = all cores).")
+    parser.add_argument("--cv", type=int, default=5, help="Cross-validation folds.")
+    parser.add_argument("--C", type=float, nargs="+", default=[0.25, 1.0, 4.0, 16.0], help="Grid of C values.")
+    parser.add_argument("--max-features", type=int, default=10000)
+    parser.add_argument("--test-size", type=float, default=0.2)
+    parser.add_argument("--latency-samples", type=int, default=200)
+    parser.add_argument("--no-download", action="store_true", help="Fail instead of downloading movie_reviews.")
+    parser.add_argument("--keep-current", action="store_true",
+                        help="Don't overwrite the unversioned artifacts the app loads.")
+    return parser.parse_args(argv)
 
-# Ensure NLTK data is available
-nltk.download('movie_reviews')
 
 # 1. Load data
-documents = []
-labels = []
-for fileid in movie_reviews.fileids():
-    words = movie_reviews.raw(fileid)
-    documents.append(words)
-    label = movie_reviews.categories(fileid)[0]  # 'pos' or 'neg'
-    labels.append(1 if label == 'pos' else 0)
-
-# 2. Shuffle and split
-combined = list(zip(documents, labels))
-random.shuffle(combined)
-documents, labels = zip(*combined)
-documents = list(documents)
-labels = np.array(labels)
-
-X_train, X_test, y_train, y_test = train_test_split(documents, labels, test_size=0.2, random_state=42, stratify=labels)
-
-# 3. Vectorize (TF-IDF)
-vectorizer = TfidfVectorizer(max_features=10000, ngram_range=(1,2), stop_words='english')
-X_train_tfidf = vectorizer.fit_transform(X_train)
-X_test_tfidf = vectorizer.transform(X_test)
-
-# 4. Train model
-model = LogisticRegression(max_iter=1000)
-model.fit(X_train_tfidf, y_train)
-
-# 5. Evaluate
-y_pred = model.predict(X_test_tfidf)
-acc = accuracy_score(y_test, y_pred)
-print(f"Validation Accuracy: {acc:.4f}\n")
-print("Classification Report:")
-print(classification_report(y_test, y_pred))
-print("Confusion Matrix:")
-print(confusion_matrix(y_test, y_pred))
-
-# 6. Save model + vectorizer
-os.makedirs("models", exist_ok=True)
-joblib.dump(model, "models/sentiment_model.joblib")
-joblib.dump(vectorizer, "models/tfidf_vectorizer.joblib")
-print("Saved model to models/sentiment_model.joblib and vectorizer to models/tfidf_vectorizer.joblib")
+def load_corpus(download=True):
+    import nltk
+    try:
+        nltk.data.find("corpora/movie_reviews")
+    except LookupError:
+        if not download:
+            raise
+        nltk.download("movie_reviews", quiet=True)
+    from nltk.corpus import movie_reviews
+
+    # fileids 排序后再打乱，同一个 seed 每次得到同样的顺序
+    fileids = sorted(movie_reviews.fileids())
+    documents = [movie_reviews.raw(f) for f in fileids]
+    labels = np.array([1 if movie_reviews.categories(f)[0] == "pos" else 0 for f in fileids])
+    return fileids, documents, labels
+
+
+def vectorizer_params(args):
+    return {
+        "max_features": args.max_features,
+        "ngram_range": (1, 2),
+        "stop_words": "english",
+        "dtype": np.float32,  # 稀疏矩阵用 float32，内存减半
+    }
+
+
+def _cache_key(fileids, args):
+    raw = json.dumps({
+        "corpus": hashlib.sha256("\n".join(fileids).encode()).hexdigest(),
+        "seed": args.seed,
+        "test_size": args.test_size,
+        "vectorizer": {k: str(v) for k, v in vectorizer_params(args).items()},
+    }, sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+# 2. Split + 3. Vectorize (TF-IDF), cached
+def build_features(fileids, documents, labels, args):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.model_selection import train_test_split
+
+    cache_path = None
+    if not args.no_cache:
+        os.makedirs(args.cache_dir, exist_ok=True)
+        cache_path = os.path.join(args.cache_dir, f"features-{_cache_key(fileids, args)}.joblib")
+        if os.path.exists(cache_path):
+            print(f"Using cached features {cache_path}")
+            return joblib.load(cache_path)
+
+    order = list(range(len(documents)))
+    random.Random(args.seed).shuffle(order)
+    docs = [documents[i] for i in order]
+    y = labels[order]
+    X_train, X_test, y_train, y_test = train_test_split(
+        docs, y, test_size=args.test_size, random_state=args.seed, stratify=y
+    )
+
+    start = time.perf_counter()
+    vectorizer = TfidfVectorizer(**vectorizer_params(args))
+    features = {
+        "vectorizer": vectorizer,
+        "X_train": vectorizer.fit_transform(X_train),
+        "X_test": vectorizer.transform(X_test),
+        "y_train": y_train,
+        "y_test": y_test,
+        "test_docs": X_test,
+        "vectorize_seconds": round(time.perf_counter() - start, 3),
+    }
+    if cache_path:
+        joblib.dump(features, cache_path)
+    return features
+
+
+# 4. Train model (parallel grid search over C)
+def train(features, args):
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import GridSearchCV, StratifiedKFold
+
+    search = GridSearchCV(
+        LogisticRegression(max_iter=1000, random_state=args.seed),
+        {"C": args.C},
+        cv=StratifiedKFold(n_splits=args.cv, shuffle=True, random_state=args.seed),
+        scoring="accuracy",
+        n_jobs=args.n_jobs,
+    )
+    start = time.perf_counter()
+    search.fit(features["X_train"], features["y_train"])
+    return search, round(time.perf_counter() - start, 3)
+
+
+# 5. Evaluate: accuracy + inference latency as the app uses it (one text at a time, and batched)
+def evaluate(model, features):
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+
+    y_test = features["y_test"]
+    y_pred = model.predict(features["X_test"])
+    return {
+        "accuracy": round(float(accuracy_score(y_test, y_pred)), 4),
+        "classification_report": classification_report(y_test, y_pred, output_dict=True),
+        "confusion_matrix": confusion_matrix(y_test, y_pred).tolist(),
+    }
+
+
+def measure_latency(model, vectorizer, docs, samples):
+    docs = list(docs[:samples])
+    timings = []
+    for doc in docs:
+        start = time.perf_counter()
+        model.predict_proba(vectorizer.transform([doc]))
+        timings.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    model.predict_proba(vectorizer.transform(docs))
+    batch_seconds = time.perf_counter() - start
+    return {
+        "samples": len(docs),
+        "single_ms_p50": round(float(np.percentile(timings, 50)), 3),
+        "single_ms_p95": round(float(np.percentile(timings, 95)), 3),
+        "batch_texts_per_second": round(len(docs) / batch_seconds, 1) if batch_seconds else None,
+    }
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 6. Save model + vectorizer + report
+def save_artifacts(model, vectorizer, report, args):
+    version_dir = os.path.join(args.output_dir, report["version"])
+    os.makedirs(version_dir, exist_ok=True)
+    model_path = os.path.join(version_dir, MODEL_FILE)
+    vectorizer_path = os.path.join(version_dir, VECTORIZER_FILE)
+    joblib.dump(model, model_path)
+    joblib.dump(vectorizer, vectorizer_path)
+    report["artifacts"] = {
+        MODEL_FILE: _sha256(model_path),
+        VECTORIZER_FILE: _sha256(vectorizer_path),
+    }
+    with open(os.path.join(version_dir, REPORT_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+
+    if not args.keep_current:
+        # 原来的路径：app 的 sklearn 后端从这里加载
+        shutil.copyfile(model_path, os.path.join(args.output_dir, MODEL_FILE))
+        shutil.copyfile(vectorizer_path, os.path.join(args.output_dir, VECTORIZER_FILE))
+    return version_dir
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    import sklearn
+
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    version = args.version or datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+
+    fileids, documents, labels = load_corpus(download=not args.no_download)
+    features = build_features(fileids, documents, labels, args)
+    search, train_seconds = train(features, args)
+    model = search.best_estimator_
+    vectorizer = features["vectorizer"]
+
+    metrics = evaluate(model, features)
+    latency = measure_latency(model, vectorizer, features["test_docs"], args.latency_samples)
+    report = {
+        "version": version,
+        "seed": args.seed,
+        "created_at": datetime.utcnow().isoformat(),
+        "train_size": int(features["X_train"].shape[0]),
+        "test_size": int(features["X_test"].shape[0]),
+        "vectorizer": {k: str(v) for k, v in vectorizer_params(args).items()},
+        "vocabulary_size": len(vectorizer.vocabulary_),
+        "grid": {"C": args.C},
+        "best_params": search.best_params_,
+        "cv_accuracy": round(float(search.best_score_), 4),
+        "vectorize_seconds": features["vectorize_seconds"],
+        "train_seconds": train_seconds,
+        "metrics": metrics,
+        "latency": latency,
+        "versions": {
+            "python": platform.python_version(),
+            "sklearn": sklearn.__version__,
+            "numpy": np.__version__,
+        },
+    }
+    version_dir = save_artifacts(model, vectorizer, report, args)
+
+    print(f"Best params: {search.best_params_} (cv accuracy {report['cv_accuracy']:.4f})")
+    print(f"Validation Accuracy: {metrics['accuracy']:.4f}")
+    print(f"Latency: p50 {latency['single_ms_p50']} ms / p95 {latency['single_ms_p95']} ms per text, "
+          f"{latency['batch_texts_per_second']} texts/s batched")
+    print(f"Saved artifacts and report to {version_dir}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""
+情绪趋势分析：在 mood_rollup 的每日汇总上用 NumPy 做向量化计算
+（周 / 月汇总、滑动平均、连续记录天数），代价只和天数有关。
+"""
+from datetime import date, timedelta
+
+import numpy as np
+
+MOODS = ("joyful", "excited", "calm", "neutral", "fearful", "sad", "angry", "pending")
+# 情绪分值：用来画「心情曲线」；pending（还没分析完）算作有记录，但不计分
+MOOD_VALENCE = {
+    "joyful": 1.0,
+    "excited": 1.0,
+    "calm": 0.5,
+    "neutral": 0.0,
+    "fearful": -0.75,
+    "sad": -1.0,
+    "angry": -1.0,
+}
+PERIODS = ("day", "week", "month")
+
+
+class MoodSeries:
+    """Dense day × mood count matrix over [start, end]; days without entries are zero rows."""
+
+    def __init__(self, days, moods, counts):
+        self.days = days
+        self.moods = moods
+        self.counts = counts
+
+    @classmethod
+    def from_rows(cls, rows, start, end, moods=MOODS):
+        """``rows`` of (iso day, mood, count) as returned by mood_rollup.daily_rows()."""
+        days = np.arange(np.datetime64(start, "D"), np.datetime64(end, "D") + 1)
+        counts = np.zeros((len(days), len(moods)), dtype=np.int32)
+        if rows and len(days):
+            column = {m: i for i, m in enumerate(moods)}
+            day_idx, mood_idx, values = [], [], []
+            for day, mood, count in rows:
+                if mood in column:
+                    day_idx.append(day)
+                    mood_idx.append(column[mood])
+                    values.append(count)
+            if values:
+                offsets = (np.array(day_idx, dtype="datetime64[D]") - days[0]).astype(np.int64)
+                inside = (offsets >= 0) & (offsets < len(days))
+                np.add.at(counts, (offsets[inside], np.array(mood_idx)[inside]), np.array(values)[inside])
+        return cls(days, tuple(moods), counts)
+
+    @property
+    def totals(self):
+        return self.counts.sum(axis=1)
+
+    def scores(self):
+        """Mean valence per day; NaN on days without scored entries."""
+        weights = np.array([MOOD_VALENCE.get(m, 0.0) for m in self.moods])
+        n = self.counts[:, [m in MOOD_VALENCE for m in self.moods]].sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(n > 0, self.counts @ weights / n, np.nan)
+
+    def resample(self, period):
+        """(period start days, summed counts) per week (Monday-based) or month."""
+        if period == "day":
+            return self.days, self.counts
+        if period == "week":
+            # 1970-01-01 是星期四：+3 后对 7 取余就是「距周一的天数」
+            weekday = (self.days.astype(np.int64) + 3) % 7
+            keys = self.days - weekday.astype("timedelta64[D]")
+        elif period == "month":
+            keys = self.days.astype("datetime64[M]").astype("datetime64[D]")
+        else:
+            raise ValueError(f"Unknown period {period!r}, expected one of {PERIODS}")
+        if not len(keys):
+            return keys, self.counts
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        return keys[starts], np.add.reduceat(self.counts, starts, axis=0)
+
+
+def rolling_mean(values, window):
+    """Trailing mean over ``window`` points, ignoring NaN; NaN where the window has no data."""
+    if window < 1:
+        # 负数会让下面的切片从另一头取，算出错的结果而不报错
+        raise ValueError(f"window must be at least 1, got {window!r}")
+    values = np.asarray(values, dtype=float)
+    valid = ~np.isnan(values)
+    csum = np.cumsum(np.where(valid, values, 0.0))
+    ccount = np.cumsum(valid)
+    csum[window:] = csum[window:] - csum[:-window]
+    ccount[window:] = ccount[window:] - ccount[:-window]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(ccount > 0, csum / ccount, np.nan)
+
+
+def streaks(active):
+    """
+    (current, longest) run of consecutive True values in ``active``. The
+    current streak is the run ending on the last element, or on the one
+    before it (today's entry may not be written yet).
+    """
+    active = np.asarray(active, dtype=bool)
+    if not active.any():
+        return 0, 0
+    padded = np.r_[False, active, False].astype(np.int8)
+    edges = np.diff(padded)
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)  # exclusive
+    lengths = run_ends - run_starts
+    current = 0
+    if run_ends[-1] >= len(active) - 1:
+        current = int(lengths[-1])
+    return current, int(lengths.max())
+
+
+def _as_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _score_or_none(value):
+    return None if np.isnan(value) else round(float(value), 3)
+
+
+def _period_rows(moods, keys, counts, scores):
+    return [
+        {"start": str(k), "entries": int(c.sum()), "score": _score_or_none(s),
+         "moods": {m: int(n) for m, n in zip(moods, c) if n}}
+        for k, c, s in zip(keys, counts, scores)
+    ]
+
+
+def summary(rows, today=None, days=90, window=7):
+    """
+    Everything the dashboard shows, from all of a user's rollup ``rows``:
+    streaks over the whole history, and weekly / rolling trends over the
+    last ``days`` days.
+    """
+    today = today or date.today()
+    if not rows:
+        return {"has_data": False, "current_streak": 0, "longest_streak": 0}
+    first = _as_date(rows[0][0])
+    history = MoodSeries.from_rows(rows, min(first, today), today)
+    current, longest = streaks(history.totals > 0)
+
+    start = today - timedelta(days=days - 1)
+    recent = MoodSeries.from_rows(rows, start, today)
+    scores = recent.scores()
+    rolling = rolling_mean(scores, window)
+    week_days, week_counts = recent.resample("week")
+    week_scores = MoodSeries(week_days, recent.moods, week_counts).scores()
+    return {
+        "has_data": True,
+        "current_streak": current,
+        "longest_streak": longest,
+        "days": [str(d) for d in recent.days],
+        "rolling_score": [_score_or_none(v) for v in rolling],
+        "window": window,
+        "weeks": _period_rows(recent.moods, week_days, week_counts, week_scores),
+        "entries_in_range": int(recent.totals.sum()),
+    }
+
+
+def trend(rows, start, end, period="week", window=None):
+    """Counts and mean score per ``period`` over [start, end], for the JSON endpoint."""
+    series = MoodSeries.from_rows(rows, start, end)
+    keys, counts = series.resample(period)
+    scores = MoodSeries(keys, series.moods, counts).scores()
+    if window:
+        scores = rolling_mean(scores, window)
+    return _period_rows(series.moods, keys, counts, scores)
@@ -0,0 +1,96 @@
+"""
+每日情绪汇总表 mood_rollup：(user_id, day, mood) → count。
+
+新增 / 修改 / 删除日记（包括 recalc_mood、批量导入）时由 app.py 的 after_flush
+监听器按增量维护，dashboard 的饼图和趋势图都从这里读，不再扫 entry 全表：
+查询代价只和天数有关，和日记条数无关。
+"""
+from collections import Counter
+
+from sqlalchemy import text
+
+ROLLUP_TABLE = "mood_rollup"
+DEFAULT_MOOD = "neutral"
+
+
+def day_key(date_created):
+    # 和 SQLite 的 date(date_created) 一样的格式
+    return date_created.date().isoformat()
+
+
+def row_key(user_id, date_created, mood):
+    return user_id, day_key(date_created), mood or DEFAULT_MOOD
+
+
+def apply_deltas(connection, deltas):
+    """Add ``deltas`` ({(user_id, day, mood): +n / -n}) to the rollup in one upsert."""
+    params = [{"user_id": u, "day": d, "mood": m, "delta": n}
+              for (u, d, m), n in deltas.items() if n]
+    if not params:
+        return 0
+    connection.execute(
+        text(f"INSERT INTO {ROLLUP_TABLE} (user_id, day, mood, count) "
+             "VALUES (:user_id, :day, :mood, :delta) "
+             "ON CONFLICT (user_id, day, mood) DO UPDATE SET count = count + excluded.count"),
+        params,
+    )
+    # 只回头看这次减过的 key，走主键，不扫整张表
+    emptied = [p for p in params if p["delta"] < 0]
+    if emptied:
+        connection.execute(
+            text(f"DELETE FROM {ROLLUP_TABLE} "
+                 "WHERE user_id = :user_id AND day = :day AND mood = :mood AND count <= 0"),
+            emptied,
+        )
+    return len(params)
+
+
+def entry_deltas(inserted=(), deleted=(), moved=()):
+    """
+    Build rollup deltas from (user_id, date_created, mood) tuples: +1 for
+    ``inserted``, -1 for ``deleted``; ``moved`` holds (old, new) pairs.
+    """
+    deltas = Counter()
+    for row in inserted:
+        deltas[row_key(*row)] += 1
+    for row in deleted:
+        deltas[row_key(*row)] -= 1
+    for old, new in moved:
+        deltas[row_key(*old)] -= 1
+        deltas[row_key(*new)] += 1
+    return deltas
+
+
+def rebuild(connection, user_id=None):
+    """Recompute the rollup from entry (for one user, or everyone)."""
+    where = "WHERE user_id = :user_id" if user_id is not None else ""
+    params = {"user_id": user_id, "default": DEFAULT_MOOD}
+    connection.execute(text(f"DELETE FROM {ROLLUP_TABLE} {where}"), params)
+    result = connection.execute(
+        text(f"INSERT INTO {ROLLUP_TABLE} (user_id, day, mood, count) "
+             f"SELECT user_id, date(date_created), coalesce(mood, :default), count(*) "
+             f"FROM entry {where} GROUP BY 1, 2, 3"),
+        params,
+    )
+    return result.rowcount
+
+
+def mood_totals(connection, user_id):
+    """{mood: count} over all days."""
+    rows = connection.execute(
+        text(f"SELECT mood, sum(count) FROM {ROLLUP_TABLE} WHERE user_id = :user_id GROUP BY mood"),
+        {"user_id": user_id},
+    )
+    return {mood: int(total) for mood, total in rows if total}
+
+
+def daily_rows(connection, user_id, start=None, end=None):
+    """(day, mood, count) rows ordered by day; ``start`` / ``end`` are inclusive ISO dates."""
+    sql = f"SELECT day, mood, count FROM {ROLLUP_TABLE} WHERE user_id = :user_id"
+    if start is not None:
+        sql += " AND day >= :start"
+    if end is not None:
+        sql += " AND day <= :end"
+    return connection.execute(
+        text(sql + " ORDER BY day"), {"user_id": user_id, "start": start, "end": end}
+    ).all()
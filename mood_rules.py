@@ -0,0 +1,153 @@
+"""
+情绪规则：关键词表 + TextBlob 极性，把模型标签映射成 7 种情绪，模型不可用时整套规则兜底。
+
+关键词在 import 时编译成一个正则，一遍扫描就知道文本里出现了哪几类词；
+按词边界匹配（允许 -s / -ed / -ing / -ness / -ly 这类词尾，以 y 结尾的词也认 y→i 的变形，
+如 happiness、angrily、loneliness），"made" 不再算 "mad"，"download" 不再算 "down"。
+TextBlob 极性只在规则真正用到时才计算，大多数命中关键词的文本根本不用建 TextBlob。
+"""
+import re
+
+from textblob import TextBlob
+
+# 关键词表：既给 transformer 做细分，也给 fallback 用
+MOOD_KEYWORDS = {
+    "angry": ["angry", "mad", "furious", "irritated", "annoyed", "rage", "pissed"],
+    "fearful": ["scared", "afraid", "fear", "terrified", "worried", "anxious", "nervous"],
+    "sad": ["sad", "depressed", "unhappy", "down", "miserable", "cry", "lonely"],
+    "joyful": ["happy", "joy", "delighted", "glad", "cheerful", "grateful"],
+    "excited": ["excited", "thrilled", "energetic", "pumped", "ecstatic", "hyped"],
+    "calm": ["calm", "relaxed", "peaceful", "chill", "okay", "fine"],
+}
+# 纯规则时的优先级：越靠前越优先
+RULE_ORDER = ("angry", "fearful", "excited", "sad", "joyful", "calm")
+NEGATIVE_MOODS = frozenset({"sad", "fearful", "angry"})
+
+_SUFFIXES = r"(?:s|es|ed|d|ing|ful|ly|ness|er|est)?"
+
+
+def _stem(word):
+    # happy -> happ(?:y|i)：happiness / happily / happier 和 happy 本身都能匹配（joy、okay 不变）
+    if len(word) > 2 and word.endswith("y") and word[-2] not in "aeiou":
+        return re.escape(word[:-1]) + "(?:y|i)"
+    return re.escape(word)
+
+
+def _compile(keywords):
+    groups = []
+    for mood, words in keywords.items():
+        # 长词在前，避免 "joy" 先吃掉 "joyful" 之类
+        alternatives = "|".join(_stem(w) for w in sorted(words, key=len, reverse=True))
+        groups.append(f"(?P<{mood}>{alternatives})")
+    return re.compile(r"\b(?:" + "|".join(groups) + r")" + _SUFFIXES + r"\b")
+
+
+_KEYWORD_RE = _compile(MOOD_KEYWORDS)
+
+
+def keyword_moods(text):
+    """The set of keyword groups that occur in ``text`` (one regex pass)."""
+    return frozenset(m.lastgroup for m in _KEYWORD_RE.finditer(text.lower()))
+
+
+def polarity(text):
+    return TextBlob(text).sentiment.polarity
+
+
+class _LazyPolarity:
+    # 第一次用到时才跑 TextBlob，之后复用
+    __slots__ = ("text", "_value")
+
+    def __init__(self, text):
+        self.text = text
+        self._value = None
+
+    def __call__(self):
+        if self._value is None:
+            self._value = polarity(self.text)
+        return self._value
+
+
+def rule_based(found, polarity_of):
+    for mood in RULE_ORDER:
+        if mood in found:
+            return mood
+    p = polarity_of()
+    if p > 0.3:
+        return "joyful"
+    elif p < -0.3:
+        return "sad"
+    else:
+        return "neutral"
+
+
+def mood_from_label(text, label=None):
+    """
+    把模型输出的标签映射成我们的 7 种情绪。
+    label 为 None（模型不可用 / 出错）时，回退到 TextBlob + 关键词规则。
+    """
+    # 空文本直接 Neutral
+    if not text.strip():
+        return "neutral"
+
+    found = keyword_moods(text)
+    polarity_of = _LazyPolarity(text)
+
+    # 模型没给出标签，直接用旧规则
+    if label is None:
+        return rule_based(found, polarity_of)
+
+    # ------- 将 HuggingFace 标签映射到我们的 7 种情绪 -------
+    # 模型标签：大概是 joy, anger, sadness, fear, neutral, surprise
+
+    # 🎯 特别照顾 calm：如果用户一直在强调 calm / relaxed，
+    # 但整体情绪不是很强烈，就倾向于给 calm。
+    def try_calm():
+        # 有 calm 词、没有明显负面、极性在 -0.1 ~ 0.5 之间 → 认为是 calm
+        if "calm" in found and found.isdisjoint(NEGATIVE_MOODS) and -0.1 < polarity_of() < 0.5:
+            return "calm"
+        return None
+
+    # 1) joy
+    if label == "joy":
+        # 先看看能不能判成 calm（比如 "I'm really calm now."）
+        calm_result = try_calm()
+        if calm_result:
+            return calm_result
+
+        # 很开心、极端正向 → excited
+        if "excited" in found or polarity_of() > 0.6:
+            return "excited"
+        else:
+            return "joyful"
+
+    # 2) sadness
+    if label == "sadness":
+        return "sad"
+
+    # 3) anger
+    if label == "anger":
+        return "angry"
+
+    # 4) fear
+    if label == "fear":
+        return "fearful"
+
+    # 5) neutral
+    if label == "neutral":
+        # neutral 里优先给 calm，但要确保没有强烈负面词
+        calm_result = try_calm()
+        if calm_result:
+            return calm_result
+        return "neutral"
+
+    # 6) surprise
+    if label == "surprise":
+        # 惊喜 or 受惊吓：看一下极性
+        if polarity_of() >= 0:
+            return "excited"
+        else:
+            return "fearful"
+
+    # 兜底：遇到奇怪标签就退回规则版
+    return rule_based(found, polarity_of)
@@ -0,0 +1,168 @@
+"""
+情绪 / 标签结果缓存：按「规范化文本的 hash + 命名空间 + 版本号」做 key。
+
+文本没变就不会再跑模型；模型或规则升级时只需要改对应命名空间的版本号，
+其他命名空间（比如 tags）的缓存不受影响。
+两层：进程内 LRU + 可选的 SQLite 持久层（多个 worker / 重启之间共享）。
+持久层命中时的 last_used 只在内存里记下，攒够一批（或下次写入时）再一起写回，读缓存不会变成每次一个写事务。
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+TOUCH_BATCH = 500
+
+
+def normalize_text(text):
+    # 只折叠空白：大小写 / 标点会影响 TextBlob 极性，不能丢
+    return " ".join(text.split())
+
+
+def make_key(namespace, version, text):
+    raw = f"{namespace}\0{version}\0{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()
+
+
+class _SQLiteTier:
+    def __init__(self, path, max_rows):
+        self.path = path
+        self.max_rows = max_rows
+        self._local = threading.local()
+        self._writes = 0
+        self._touched = {}
+        self._touch_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS nlp_cache ("
+            " key TEXT PRIMARY KEY, namespace TEXT NOT NULL, version TEXT NOT NULL,"
+            " value TEXT NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_nlp_cache_last_used ON nlp_cache (last_used)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT value FROM nlp_cache WHERE key = ?", (key,)).fetchone()
+        return MISSING if row is None else row[0]
+
+    def touch(self, key):
+        """Note a hit; last_used is written back in batches of TOUCH_BATCH."""
+        with self._touch_lock:
+            self._touched[key] = time.time()
+            if len(self._touched) < TOUCH_BATCH:
+                return
+        self._flush_touches(commit=True)
+
+    def _flush_touches(self, commit):
+        with self._touch_lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        conn = self._conn()
+        conn.executemany("UPDATE nlp_cache SET last_used = ? WHERE key = ?",
+                         [(when, key) for key, when in touched.items()])
+        if commit:
+            conn.commit()
+
+    def set_many(self, items):
+        """items: iterable of (key, namespace, version, value)."""
+        now = time.time()
+        conn = self._conn()
+        rows = [(k, ns, str(v), val, now) for k, ns, v, val in items]
+        # 攒着的 last_used 顺带在同一个事务里写掉
+        self._flush_touches(commit=False)
+        conn.executemany("INSERT OR REPLACE INTO nlp_cache VALUES (?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        self._writes += len(rows)
+        if self._writes >= 1000:
+            self._writes = 0
+            self.prune()
+
+    def prune(self):
+        conn = self._conn()
+        (count,) = conn.execute("SELECT COUNT(*) FROM nlp_cache").fetchone()
+        if count <= self.max_rows:
+            return 0
+        excess = count - self.max_rows
+        conn.execute(
+            "DELETE FROM nlp_cache WHERE key IN ("
+            " SELECT key FROM nlp_cache ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        conn.commit()
+        return excess
+
+    def purge_stale(self, namespace, version):
+        conn = self._conn()
+        cur = conn.execute(
+            "DELETE FROM nlp_cache WHERE namespace = ? AND version != ?", (namespace, str(version))
+        )
+        conn.commit()
+        return cur.rowcount
+
+
+class NLPCache:
+    """Two-tier memo cache for NLP results (values are strings)."""
+
+    def __init__(self, max_entries=10000, sqlite_path=None, sqlite_max_rows=1_000_000):
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._persistent = _SQLiteTier(sqlite_path, sqlite_max_rows) if sqlite_path else None
+        self.counters = {"hits": 0, "persistent_hits": 0, "misses": 0, "evictions": 0}
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_entries:
+                self._lru.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def get(self, namespace, version, text):
+        key = make_key(namespace, version, text)
+        with self._lock:
+            value = self._lru.get(key, MISSING)
+            if value is not MISSING:
+                self._lru.move_to_end(key)
+                self.counters["hits"] += 1
+                return value
+        if self._persistent is not None:
+            value = self._persistent.get(key)
+            if value is not MISSING:
+                self.counters["persistent_hits"] += 1
+                self._persistent.touch(key)
+                self._remember(key, value)
+                return value
+        self.counters["misses"] += 1
+        return MISSING
+
+    def set_many(self, namespace, version, pairs):
+        """pairs: iterable of (text, value)."""
+        items = [(make_key(namespace, version, text), namespace, version, value)
+                 for text, value in pairs]
+        for key, _, _, value in items:
+            self._remember(key, value)
+        if self._persistent is not None and items:
+            self._persistent.set_many(items)
+
+    def purge_stale(self, namespace, version):
+        """Drop persisted results of ``namespace`` computed under any other version."""
+        if self._persistent is None:
+            return 0
+        return self._persistent.purge_stale(namespace, version)
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["persistent_hits"] + self.counters["misses"]
+        hit_rate = (lookups - self.counters["misses"]) / lookups if lookups else 0.0
+        return dict(self.counters, size=len(self._lru), hit_rate=round(hit_rate, 3),
+                    persistent=self._persistent.path if self._persistent else None)
@@ -0,0 +1,111 @@
+"""
+Keyset（游标）分页：按 (date_created, id) 倒序翻页，
+下一页 / 上一页用「上一页最后一条」的 key 做 WHERE 条件，不再 OFFSET。
+对外的属性和 Flask-SQLAlchemy 的 Pagination 一样，模板和 build_page_window 不用改。
+"""
+import math
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+
+def encode_cursor(date_created, entry_id):
+    return f"{date_created.isoformat()}_{entry_id}"
+
+
+def decode_cursor(cursor):
+    """'2024-05-01T08:30:00_42' -> (datetime, 42); None if malformed."""
+    if not cursor:
+        return None
+    try:
+        stamp, entry_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(stamp), int(entry_id)
+    except ValueError:
+        return None
+
+
+class TotalCountCache:
+    """
+    Short-lived cache of COUNT(*) results for the page buttons.
+
+    Keyed by (user_id, query signature). Writes by that user drop their
+    entries; the TTL bounds staleness for anything else.
+    """
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get_or_count(self, user_id, signature, count):
+        key = (user_id, signature)
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None and hit[1] > now:
+                return hit[0]
+        total = count()
+        with self._lock:
+            if len(self._data) >= self.max_entries:
+                self._data.clear()
+            self._data[key] = (total, now + self.ttl)
+        return total
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [k for k in self._data if k[0] == user_id]:
+                del self._data[key]
+
+
+class KeysetPagination:
+    def __init__(self, items, page, per_page, total, has_next, next_cursor, prev_cursor):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.pages = max(1, math.ceil(total / per_page)) if total else 0
+        self.has_next = has_next
+        self.has_prev = page > 1
+        self.next_num = page + 1 if has_next else None
+        self.prev_num = page - 1 if page > 1 else None
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def keyset_paginate(query, date_col, id_col, page, per_page, total,
+                    after=None, before=None):
+    """
+    Page through ``query`` newest first.
+
+    ``after`` (the last row of the previous page) and ``before`` (the first
+    row of the next page) are cursors from encode_cursor(); with neither, the
+    page number is used as an OFFSET, which only happens when jumping to an
+    arbitrary page.
+    """
+    page = max(page, 1)
+    after_key, before_key = decode_cursor(after), decode_cursor(before)
+    key = tuple_(date_col, id_col)
+
+    if before_key is not None:
+        rows = (query.filter(key > tuple_(*before_key))
+                .order_by(date_col.asc(), id_col.asc())
+                .limit(per_page).all())
+        rows.reverse()
+        # 往回翻：后面一定还有（就是我们刚离开的那一页）
+        has_next = True
+    else:
+        q = query.order_by(date_col.desc(), id_col.desc())
+        if after_key is not None:
+            q = q.filter(key < tuple_(*after_key))
+        else:
+            q = q.offset((page - 1) * per_page)
+        rows = q.limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        rows = rows[:per_page]
+
+    next_cursor = encode_cursor(rows[-1].date_created, rows[-1].id) if rows and has_next else None
+    prev_cursor = encode_cursor(rows[0].date_created, rows[0].id) if rows and page > 1 else None
+    return KeysetPagination(rows, page, per_page, total, has_next, next_cursor, prev_cursor)
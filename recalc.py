@@ -0,0 +1,147 @@
+"""
+可恢复的批量重算（flask recalc_mood）。
+
+- 按 id 递增分块读 (id, text)，内存只和块大小有关；
+- 推理可以分给进程池，最多同时 ``workers * 2`` 个块在路上；
+- 每块结果按顺序提交，断点（最后一个 id）和这块的更新在同一个事务里写进
+  recalc_checkpoint，中途中断后 --resume 从断点继续，不会漏也不会重复；
+- 每块打印进度：已处理 / 总数、每秒条数和预计剩余时间。
+"""
+import json
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import text
+
+CHECKPOINT_TABLE = "recalc_checkpoint"
+
+
+# ---------- 断点 ----------
+
+def load_checkpoint(connection, job):
+    row = connection.execute(
+        text(f"SELECT last_id, processed, changed, params, finished_at FROM {CHECKPOINT_TABLE} WHERE job = :job"),
+        {"job": job},
+    ).first()
+    if row is None:
+        return None
+    return {"last_id": row[0], "processed": row[1], "changed": row[2],
+            "params": json.loads(row[3] or "{}"), "finished": row[4] is not None}
+
+
+def save_checkpoint(connection, job, params, last_id, processed, changed, finished=False):
+    now = datetime.utcnow().isoformat()
+    connection.execute(
+        text(f"INSERT INTO {CHECKPOINT_TABLE} "
+             "(job, params, last_id, processed, changed, started_at, updated_at, finished_at) "
+             "VALUES (:job, :params, :last_id, :processed, :changed, :now, :now, :finished) "
+             "ON CONFLICT (job) DO UPDATE SET params = excluded.params, last_id = excluded.last_id, "
+             "processed = excluded.processed, changed = excluded.changed, "
+             "updated_at = excluded.updated_at, finished_at = excluded.finished_at"),
+        {"job": job, "params": json.dumps(params, sort_keys=True), "last_id": last_id,
+         "processed": processed, "changed": changed, "now": now, "finished": now if finished else None},
+    )
+
+
+def reset_checkpoint(connection, job):
+    connection.execute(text(f"DELETE FROM {CHECKPOINT_TABLE} WHERE job = :job"), {"job": job})
+
+
+# ---------- 分块 ----------
+
+def iter_chunks(fetch, after_id=0, size=256):
+    """
+    Keyset iteration: ``fetch(after_id, size)`` returns rows whose first
+    column is the id, in id order. Yields lists of rows until exhausted.
+    """
+    while True:
+        rows = fetch(after_id, size)
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1][0]
+
+
+class Progress:
+    """Throughput and ETA for a job of ``total`` items, ``done`` of which were finished by an earlier run."""
+
+    def __init__(self, total, done=0, clock=time.monotonic):
+        self.total = total
+        self.done = done
+        self._start_done = done
+        self._clock = clock
+        self._start = clock()
+
+    def advance(self, n):
+        self.done += n
+
+    @property
+    def rate(self):
+        elapsed = self._clock() - self._start
+        return (self.done - self._start_done) / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Seconds left at the current rate, or None before the first chunk."""
+        rate = self.rate
+        if not rate:
+            return None
+        return max(0.0, (self.total - self.done) / rate)
+
+    def line(self, label="Recalc", extra=""):
+        pct = 100.0 * self.done / self.total if self.total else 100.0
+        eta = "--:--" if self.eta is None else _clock_text(self.eta)
+        line = f"{label}: {self.done}/{self.total} ({pct:.1f}%), {self.rate:.0f}/s, ETA {eta}"
+        return f"{line}, {extra}" if extra else line
+
+
+def _clock_text(seconds):
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    return f"{hours}:{rest // 60:02d}:{rest % 60:02d}" if hours else f"{rest // 60:02d}:{rest % 60:02d}"
+
+
+# ---------- 并行推理 ----------
+
+def _start_method():
+    # fork：子进程直接继承父进程已经加载好的模型（copy-on-write），不用每个再加载一遍
+    methods = multiprocessing.get_all_start_methods()
+    return "fork" if "fork" in methods else methods[0]
+
+
+def make_pool(workers, initializer=None):
+    """A process pool for ``workers`` > 1, or None to run inline."""
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(_start_method()),
+                               initializer=initializer)
+
+
+def _done_future(fn, arg):
+    future = Future()
+    try:
+        future.set_result(fn(arg))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def map_ordered(fn, jobs, pool=None, in_flight=2):
+    """
+    ``jobs`` yields (tag, arg); yields (tag, fn(arg)) in input order. With a
+    ``pool`` at most ``in_flight`` calls are queued at once, so ``jobs`` is
+    consumed lazily; without one each call runs inline.
+    """
+    pending = deque()
+    for tag, arg in jobs:
+        future = pool.submit(fn, arg) if pool is not None else _done_future(fn, arg)
+        pending.append((tag, future))
+        if len(pending) >= in_flight:
+            tag, future = pending.popleft()
+            yield tag, future.result()
+    while pending:
+        tag, future = pending.popleft()
+        yield tag, future.result()
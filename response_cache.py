@@ -0,0 +1,206 @@
+"""
+整页响应缓存：按 (用户, 路由, 参数, 用户数据版本号) 做 key。
+
+user.data_version 在这个用户的日记每次增 / 改 / 删时 +1，和改动在同一个事务里
+（见 app._sync_derived_tables）。版本一变旧 key 就不会再被读到，不用逐条删缓存，
+多个 worker 之间也不用互相通知。ETag 由同一个 key 算出：浏览器带 If-None-Match
+回来、版本没变时直接 304，连缓存都不用读。
+
+后端（RESPONSE_CACHE_BACKEND）：
+    memory    进程内 LRU（默认）
+    sqlite    本机 SQLite 文件（RESPONSE_CACHE_PATH），同一台机器上的 worker / 重启之间共享
+    none      关掉
+也可以写 "package.module:Class"，类实现 get(key) / set(key, value) / clear() 即可。
+"""
+import hashlib
+import importlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, make_response, request, session
+
+
+class MemoryBackend:
+    """Per-process LRU of ``max_entries`` responses, each kept at most ``ttl`` seconds."""
+
+    def __init__(self, max_entries=500, ttl=600, **_):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class SQLiteBackend:
+    """Responses in a local SQLite file, shared by every worker on the host."""
+
+    def __init__(self, path, max_entries=5000, ttl=600, **_):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_cache ("
+            " key TEXT PRIMARY KEY, mimetype TEXT NOT NULL, body BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_page_cache_expires ON page_cache (expires)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT mimetype, body FROM page_cache WHERE key = ? AND expires >= ?", (key, time.time())
+        ).fetchone()
+        return None if row is None else (row[0], bytes(row[1]))
+
+    def set(self, key, value):
+        mimetype, body = value
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO page_cache VALUES (?, ?, ?, ?)",
+                     (key, mimetype, body, time.time() + self.ttl))
+        conn.commit()
+        self._writes += 1
+        if self._writes >= 100:
+            self._writes = 0
+            self.prune()
+
+    def prune(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM page_cache WHERE expires < ?", (time.time(),))
+        conn.execute(
+            "DELETE FROM page_cache WHERE key IN ("
+            " SELECT key FROM page_cache ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,)
+        )
+        conn.commit()
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM page_cache")
+        conn.commit()
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM page_cache").fetchone()[0]
+
+
+BACKENDS = {"memory": MemoryBackend, "sqlite": SQLiteBackend}
+
+
+def make_backend(name, **options):
+    """A backend by name or "module:Class" path; None for "none"."""
+    if not name or name == "none":
+        return None
+    if name in BACKENDS:
+        return BACKENDS[name](**options)
+    module, _, cls = name.partition(":")
+    if not cls:
+        raise ValueError(f"Unknown response cache backend {name!r}, expected one of "
+                         f"{sorted(BACKENDS)}, 'none' or 'module:Class'")
+    return getattr(importlib.import_module(module), cls)(**options)
+
+
+class ResponseCache:
+    """
+    Caches whole GET responses per logged-in user. ``version_of(user_id)``
+    returns the user's current data version (None skips caching);
+    ``namespace`` is mixed into every key, bump it when templates change.
+    """
+
+    def __init__(self, backend, version_of, namespace=""):
+        self.backend = backend
+        self.version_of = version_of
+        self.namespace = str(namespace)
+        self.counters = {"hits": 0, "misses": 0, "not_modified": 0, "bypassed": 0}
+
+    def key(self, user_id, version):
+        # 日期也算进去：dashboard 的连续天数 / 最近 90 天过了零点就该变
+        args = sorted(request.args.items(multi=True))
+        raw = (f"{self.namespace}\0{user_id}\0{version}\0{time.strftime('%Y-%m-%d', time.gmtime())}\0"
+               f"{request.endpoint}\0{sorted(request.view_args.items())}\0{args}")
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user_id = session.get("user_id")
+            # 有待显示的 flash 消息时页面是一次性的，不读也不存
+            if self.backend is None or request.method != "GET" or user_id is None or session.get("_flashes"):
+                self.counters["bypassed"] += 1
+                return view(*args, **kwargs)
+            version = self.version_of(user_id)
+            if version is None:
+                self.counters["bypassed"] += 1
+                return view(*args, **kwargs)
+
+            key = self.key(user_id, version)
+            if key in request.if_none_match:
+                self.counters["not_modified"] += 1
+                return self._finish(Response(status=304), key)
+            value = self.backend.get(key)
+            if value is not None:
+                self.counters["hits"] += 1
+                mimetype, body = value
+                return self._finish(Response(body, mimetype=mimetype), key)
+
+            self.counters["misses"] += 1
+            response = make_response(view(*args, **kwargs))
+            # 只存正常渲染的页面：重定向 / 404 / 过程中 flash 了消息的都照常返回
+            if response.status_code != 200 or response.direct_passthrough or session.get("_flashes"):
+                return response
+            self.backend.set(key, (response.mimetype, response.get_data()))
+            return self._finish(response, key)
+        return wrapper
+
+    @staticmethod
+    def _finish(response, key):
+        response.set_etag(key)
+        # 浏览器每次都回来问一下（带 If-None-Match），版本没变就是 304
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.vary.add("Cookie")
+        return response
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"] + self.counters["not_modified"]
+        hit_rate = (lookups - self.counters["misses"]) / lookups if lookups else 0.0
+        size = len(self.backend) if self.backend is not None else 0
+        return dict(self.counters, size=size, hit_rate=round(hit_rate, 3))
@@ -0,0 +1,140 @@
+"""
+SQLite FTS5 全文索引：给 /search 的关键词查询用，替代 ilike('%kw%') 全表扫描。
+
+索引表 entry_fts 的 rowid 就是 entry.id；owner 列存 "u<user_id>"，
+查询时和关键词一起交给 MATCH，先在倒排索引里按用户缩小范围。
+同步由 app.py 里的 ORM 事件完成（新增 / 修改 / 删除日记时）。
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import column, table, text
+from sqlalchemy.exc import OperationalError
+
+FTS_TABLE = "entry_fts"
+CONTENT_COLUMNS = "title text tags"
+_HL_START, _HL_END = "\x02", "\x03"
+
+fts_table = table(FTS_TABLE, column("rowid"), column("rank"))
+
+_CREATE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    " title, text, tags, owner,"
+    " tokenize = 'unicode61 remove_diacritics 2',"
+    " prefix = '2 3')"
+)
+
+
+def ensure_schema(connection):
+    """Create the FTS table; returns False when SQLite has no FTS5 (or isn't SQLite)."""
+    if connection.dialect.name != "sqlite":
+        return False
+    try:
+        connection.execute(text(_CREATE_SQL))
+    except OperationalError as e:
+        print("⚠️ SQLite FTS5 not available, /search falls back to LIKE:", e)
+        return False
+    return True
+
+
+def _owner(user_id):
+    return f"u{user_id}"
+
+
+def remove_entries(connection, entry_ids):
+    for start in range(0, len(entry_ids), 500):
+        ids = ",".join(str(int(i)) for i in entry_ids[start:start + 500])
+        connection.execute(text(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({ids})"))
+
+
+def reindex_entries(connection, rows):
+    """Replace the index rows of ``rows`` of (id, user_id, title, text, tags)."""
+    rows = list(rows)
+    remove_entries(connection, [row[0] for row in rows])
+    return index_entries(connection, rows)
+
+
+def index_entries(connection, rows):
+    """Add ``rows`` of (id, user_id, title, text, tags) to the index in one statement."""
+    params = [{"id": entry_id, "title": title or "", "text": body or "",
+               "tags": tags or "", "owner": _owner(user_id)}
+              for entry_id, user_id, title, body, tags in rows]
+    if params:
+        connection.execute(
+            text(f"INSERT INTO {FTS_TABLE} (rowid, title, text, tags, owner) "
+                 "VALUES (:id, :title, :text, :tags, :owner)"),
+            params,
+        )
+    return len(params)
+
+
+def rebuild(connection, rows, batch_size=1000):
+    """Re-create the index from ``rows`` of (id, user_id, title, text, tags)."""
+    connection.execute(text(f"DELETE FROM {FTS_TABLE}"))
+    batch, total = [], 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            total += index_entries(connection, batch)
+            batch = []
+    total += index_entries(connection, batch)
+    connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    return total
+
+
+def build_match_query(keyword, user_id):
+    """
+    Turn free text into an FTS5 query: every word must match, as a prefix
+    ("run" finds "running"), in the title, text or tags. Returns None when
+    the keyword has no words.
+    """
+    words = re.findall(r"\w+", keyword, re.UNICODE)
+    if not words:
+        return None
+    terms = " AND ".join(f'"{w}"*' for w in words)
+    # 关键词只查内容列，否则 "u" 之类会前缀匹配到 owner 列的 "u<id>"，把所有日记都搜出来
+    return f'owner:"{_owner(user_id)}" AND {{{CONTENT_COLUMNS}}}:({terms})'
+
+
+def match_clause(match_query):
+    return text(f"{FTS_TABLE} MATCH :fts_query").bindparams(fts_query=match_query)
+
+
+def rank_column():
+    # FTS5 的 rank 默认就是 bm25()，越小越相关
+    return fts_table.c.rank
+
+
+def snippets(connection, match_query, entry_ids, tokens=24):
+    """{entry_id: Markup} with matched words wrapped in <mark>."""
+    if not entry_ids:
+        return {}
+    ids = ",".join(str(int(i)) for i in entry_ids)
+    rows = connection.execute(
+        text(f"SELECT rowid, snippet({FTS_TABLE}, 1, :hs, :he, '…', :tokens) "
+             f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q AND rowid IN ({ids})"),
+        {"hs": _HL_START, "he": _HL_END, "tokens": tokens, "q": match_query},
+    )
+    result = {}
+    for entry_id, snip in rows:
+        safe = str(escape(snip or ""))
+        result[entry_id] = Markup(safe.replace(_HL_START, "<mark>").replace(_HL_END, "</mark>"))
+    return result
+
+
+def document_frequencies(connection, user_id, words, batch_size=50):
+    """{word: number of the user's entries whose title or text contains it} (exact word, no prefix)."""
+    words = sorted({w for w in words if re.fullmatch(r"\w+", w, re.UNICODE)})
+    result = {}
+    for start in range(0, len(words), batch_size):
+        chunk = words[start:start + batch_size]
+        # 每个词一个 MATCH 子查询，合成一条语句
+        parts = " UNION ALL ".join(
+            f"SELECT :w{i}, count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :q{i}" for i in range(len(chunk))
+        )
+        params = {}
+        for i, word in enumerate(chunk):
+            params[f"w{i}"] = word
+            params[f"q{i}"] = f'owner:"{_owner(user_id)}" AND {{title text}}:"{word}"'
+        result.update(connection.execute(text(parts), params).all())
+    return result
@@ -0,0 +1,306 @@
+"""
+按用户分片：每个用户的日记（连同全文索引、标签、向量、情绪汇总）整个放在一个 SQLite 分片里。
+
+- 主库（SQLALCHEMY_DATABASE_URI）仍然存账号，外加 user_shard 映射表；
+  没有映射的用户留在主库，也就是名叫 "main" 的分片，所以开分片前的老数据不用动。
+- 新注册的用户按 user id 的 hash 固定分到一个分片，写进映射表之后就不会变，
+  分片数以后改了也不会把老用户挪走（要挪用 flask move_user / rebalance_shards）。
+- 每个分片都是一个完整的库（同样的表、迁移和 FTS），里面有一行影子 user 记录
+  （密码是不可用的 "!"），外键和 user.data_version 都在分片内部闭合。
+- 请求开始时按 session 里的用户查一次映射，把分片放进 ContextVar，
+  RoutingSession.get_bind 据此把这个请求的所有查询和写入发到对应分片。
+- 各分片的 entry.id 由主库的 id_block 表按块分配（hi/lo），全局唯一，
+  搬家时 id 不变，链接和全文索引的 rowid 都不用改。
+
+    DB_SHARDS=a,b,c               分片文件 <DB_SHARD_DIR>/a.db 等（默认和 diary.db 同目录）
+    DB_SHARDS=a=sqlite:////disk1/a.db,b=sqlite:////disk2/b.db   每个分片单独指定 URL
+"""
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import text
+
+MAIN = "main"
+MAP_TABLE = "user_shard"
+ID_BLOCK_TABLE = "id_block"
+ACTIVE = "active"
+MOVING = "moving"
+# 搬家时按这个顺序拷贝 / 删除；entry_fts 另外按 entry 重建
+USER_TABLES = ("entry", "entry_tag", "entry_embedding", "mood_rollup")
+UNUSABLE_PASSWORD = "!"
+
+_active = ContextVar("diary_shard", default=None)
+
+
+def parse_shards(spec, shard_dir):
+    """{name: url} from "a,b" or "a=url,b=url"."""
+    shards = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, url = item.partition("=")
+        name = name.strip()
+        if name == MAIN:
+            raise ValueError(f"Shard name {MAIN!r} is reserved for the primary database")
+        shards[name] = url.strip() or "sqlite:///" + os.path.join(shard_dir, f"{name}.db")
+    return shards
+
+
+def home_shard(user_id, names):
+    """The shard a new user is assigned to: stable for a given list of names."""
+    return names[zlib.crc32(str(user_id).encode("ascii")) % len(names)]
+
+
+def ensure_schema(connection):
+    """Shard map and id allocator tables, on the primary database."""
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {MAP_TABLE} ("
+        " user_id INTEGER NOT NULL PRIMARY KEY, shard VARCHAR(100) NOT NULL,"
+        f" state VARCHAR(20) NOT NULL DEFAULT '{ACTIVE}', updated_at REAL)"
+    ))
+    connection.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {ID_BLOCK_TABLE} (name VARCHAR(50) NOT NULL PRIMARY KEY,"
+        " next_id INTEGER NOT NULL)"
+    ))
+
+
+# ---------- 当前分片 ----------
+
+def active_engine():
+    """Engine of the shard activated for this request / job, or None for the primary."""
+    current = _active.get()
+    return current[1] if current is not None else None
+
+
+def active_name():
+    current = _active.get()
+    return current[0] if current is not None else MAIN
+
+
+def leave(token):
+    _active.reset(token)
+
+
+class ShardRouter:
+    """The shard engines plus the user -> shard map kept on the primary."""
+
+    def __init__(self, primary, engines):
+        self.primary = primary
+        self.engines = dict(engines)
+        self.names = sorted(self.engines)
+
+    @property
+    def all_names(self):
+        return [MAIN] + self.names
+
+    def engine(self, name):
+        if name == MAIN:
+            return self.primary
+        try:
+            return self.engines[name]
+        except KeyError:
+            raise KeyError(f"Unknown shard {name!r}; configured: {self.all_names}") from None
+
+    def enter(self, name):
+        """Make ``name`` the active shard; pass the returned token to leave()."""
+        return _active.set(None if name == MAIN else (name, self.engine(name)))
+
+    @contextmanager
+    def activate(self, name):
+        token = self.enter(name)
+        try:
+            yield
+        finally:
+            leave(token)
+
+    def lookup(self, user_id, connection=None):
+        """(shard, state) of one user; users without a row live on the primary."""
+        def read(conn):
+            return conn.execute(text(f"SELECT shard, state FROM {MAP_TABLE} WHERE user_id = :id"),
+                                {"id": user_id}).first()
+        if connection is not None:
+            row = read(connection)
+        else:
+            with self.primary.connect() as conn:
+                row = read(conn)
+        return (row[0], row[1]) if row is not None else (MAIN, ACTIVE)
+
+    def set_shard(self, user_id, shard, state=ACTIVE):
+        with self.primary.begin() as conn:
+            conn.execute(
+                text(f"INSERT INTO {MAP_TABLE} (user_id, shard, state, updated_at) VALUES (:id, :shard, :state, :now) "
+                     "ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard, state = excluded.state, "
+                     "updated_at = excluded.updated_at"),
+                {"id": user_id, "shard": shard, "state": state, "now": time.time()},
+            )
+
+    def ensure_user(self, shard, user_id, username, data_version=0):
+        """Shadow user row on a shard; on main (the real row) only raises data_version."""
+        if shard == MAIN:
+            with self.primary.begin() as conn:
+                conn.execute(text("UPDATE user SET data_version = max(data_version, :version) WHERE id = :id"),
+                             {"id": user_id, "version": data_version})
+            return
+        with self.engine(shard).begin() as conn:
+            conn.execute(
+                text("INSERT INTO user (id, username, password, data_version) "
+                     "VALUES (:id, :username, :password, :version) "
+                     "ON CONFLICT (id) DO UPDATE SET username = excluded.username, "
+                     "data_version = max(user.data_version, excluded.data_version)"),
+                {"id": user_id, "username": username, "password": UNUSABLE_PASSWORD, "version": data_version},
+            )
+
+    def assign(self, user_id, username):
+        """Place a new user on their home shard; returns the shard name."""
+        shard = home_shard(user_id, self.names)
+        self.ensure_user(shard, user_id, username)
+        self.set_shard(user_id, shard)
+        return shard
+
+    def user_counts(self):
+        """{shard: number of users} from the map (unmapped users count towards main)."""
+        with self.primary.connect() as conn:
+            mapped = dict(conn.execute(text(f"SELECT shard, count(*) FROM {MAP_TABLE} GROUP BY shard")).all())
+            on_main = conn.execute(text(
+                f"SELECT count(*) FROM user u LEFT JOIN {MAP_TABLE} m ON m.user_id = u.id "
+                f"WHERE m.user_id IS NULL OR m.shard = '{MAIN}'")).scalar()
+        counts = {name: mapped.get(name, 0) for name in self.names}
+        counts[MAIN] = on_main
+        return counts
+
+
+# ---------- 全局 entry id ----------
+
+class IdAllocator:
+    """
+    Hands out ids from blocks of ``block_size`` reserved in the primary's
+    id_block table, so every shard's ids are globally unique.
+    """
+
+    def __init__(self, engine, name="entry", block_size=1000):
+        self.engine = engine
+        self.name = name
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = self._end = 0
+        self._pid = None
+
+    def start_at(self, first_id):
+        """Make sure ids handed out from now on are >= ``first_id``."""
+        with self.engine.begin() as conn:
+            conn.execute(
+                text(f"INSERT INTO {ID_BLOCK_TABLE} (name, next_id) VALUES (:name, :first) "
+                     "ON CONFLICT (name) DO UPDATE SET next_id = max(next_id, excluded.next_id)"),
+                {"name": self.name, "first": first_id},
+            )
+
+    def _reserve(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"UPDATE {ID_BLOCK_TABLE} SET next_id = next_id + :n WHERE name = :name"),
+                         {"n": self.block_size, "name": self.name})
+            end = conn.execute(text(f"SELECT next_id FROM {ID_BLOCK_TABLE} WHERE name = :name"),
+                               {"name": self.name}).scalar()
+        self._next, self._end = end - self.block_size, end
+
+    def next_id(self):
+        with self._lock:
+            # fork 出来的进程不能接着用父进程手里的那一块
+            if self._pid != os.getpid() or self._next >= self._end:
+                self._reserve()
+                self._pid = os.getpid()
+            value = self._next
+            self._next += 1
+            return value
+
+
+# ---------- 搬家 ----------
+
+def _columns(connection, table):
+    return [row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))]
+
+
+def _delete_user_rows(connection, user_id, fts):
+    if fts:
+        connection.execute(text(
+            "DELETE FROM entry_fts WHERE rowid IN (SELECT id FROM entry WHERE user_id = :id)"), {"id": user_id})
+    for table in reversed(USER_TABLES):
+        connection.execute(text(f"DELETE FROM {table} WHERE user_id = :id"), {"id": user_id})
+
+
+def copy_user(src, dst, user_id, fts, reindex, batch_size=1000, log=print):
+    """
+    Copy one user's rows from engine ``src`` to ``dst`` in a single
+    destination transaction, replacing whatever a failed earlier attempt
+    left there. Values are copied as stored (compressed text stays
+    compressed); ``reindex(conn, entry_ids)`` rebuilds their FTS rows.
+    Returns the number of entries copied.
+    """
+    copied = 0
+    with src.connect() as source, dst.begin() as target:
+        _delete_user_rows(target, user_id, fts)
+        for table in USER_TABLES:
+            target_columns = set(_columns(target, table))
+            columns = [c for c in _columns(source, table) if c in target_columns]
+            names = ", ".join(columns)
+            insert = text(f"INSERT INTO {table} ({names}) VALUES ({', '.join(':' + c for c in columns)})")
+            rows = source.execution_options(yield_per=batch_size).execute(
+                text(f"SELECT {names} FROM {table} WHERE user_id = :id"), {"id": user_id})
+            for chunk in rows.partitions(batch_size):
+                target.execute(insert, [dict(zip(columns, row)) for row in chunk])
+                if table == "entry":
+                    copied += len(chunk)
+                    if fts:
+                        reindex(target, [row[columns.index("id")] for row in chunk])
+                    log(f"  {copied} entries copied")
+    return copied
+
+
+def delete_user(engine, user_id, fts, drop_user_row):
+    with engine.begin() as conn:
+        _delete_user_rows(conn, user_id, fts)
+        if drop_user_row:
+            conn.execute(text("DELETE FROM user WHERE id = :id"), {"id": user_id})
+
+
+# ---------- 重新平衡 ----------
+
+def plan_moves(loads, shards, tolerance=0.1):
+    """
+    Greedy plan that evens out entry counts across ``shards``.
+
+    ``loads`` is [(user_id, current shard, entries)]. Users on shards not in
+    ``shards`` (e.g. main when draining it) always move, to the emptiest
+    shard. Then, biggest users first, a user leaves a shard that is more
+    than ``tolerance`` above the mean for the emptiest shard whenever that
+    narrows the gap between the two. Returns [(user_id, from, to)].
+    """
+    totals = {name: 0 for name in shards}
+    for _, shard, entries in loads:
+        if shard in totals:
+            totals[shard] += entries
+    origin = {user_id: shard for user_id, shard, _ in loads}
+    placed = dict(origin)
+    by_size = sorted(loads, key=lambda r: (-r[2], r[0]))
+    for user_id, shard, entries in by_size:
+        if shard not in totals:
+            target = min(shards, key=totals.get)
+            totals[target] += entries
+            placed[user_id] = target
+    mean = sum(totals.values()) / len(shards) if shards else 0
+    for user_id, _, entries in by_size:
+        shard = placed[user_id]
+        if not entries or totals[shard] <= mean * (1 + tolerance):
+            continue
+        target = min(shards, key=totals.get)
+        if totals[target] + entries >= totals[shard]:
+            continue
+        totals[shard] -= entries
+        totals[target] += entries
+        placed[user_id] = target
+    return [(user_id, origin[user_id], placed[user_id])
+            for user_id, _, _ in by_size if placed[user_id] != origin[user_id]]
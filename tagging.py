@@ -0,0 +1,148 @@
+"""
+自动标签：从正文里挑名词做候选，再按 TF-IDF 排序取前几个。
+
+- 词性标注用 NLTK 的 averaged perceptron，每个进程只加载一次，可以整批标注；
+  没装标注模型数据时退回「去掉停用词的所有词」，不会报错。
+- 排序：词频（取 log）× IDF。IDF 优先来自这个用户自己的日记（全文索引里的文档频率），
+  日记太少时用 models/tfidf_vectorizer.joblib 里训练好的 idf_，都没有就只看词频。
+  这样「每篇都出现的词」排在后面，真正有区分度的词排在前面。
+"""
+import math
+import re
+import threading
+from collections import Counter
+
+MAX_TAGS = 5
+MIN_WORD_LENGTH = 3
+MAX_WORD_LENGTH = 30
+
+_SENTENCE_RE = re.compile(r"[.!?;\n]+")
+_TOKEN_RE = re.compile(r"[^\W\d_]+(?:['’-][^\W\d_]+)*", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a about above after again against all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have having
+he her here hers herself him himself his how i if in into is it its itself just me more most my myself no
+nor not now of off on once only or other our ours ourselves out over own same she should so some such than
+that the their theirs them themselves then there these they this those through to too under until up very
+was we were what when where which while who whom why will with would you your yours yourself yourselves
+today yesterday tomorrow day days time times thing things lot lots bit way ways something anything nothing
+everything someone anyone everyone really maybe still even much many every got get gets getting went go goes
+going gone made make makes making felt feel feels feeling feelings think thought know knew want wanted
+""".split())
+
+
+def tokenize(text):
+    """Sentences as lists of word tokens (no punctuation), for the POS tagger."""
+    return [tokens for tokens in (_TOKEN_RE.findall(s) for s in _SENTENCE_RE.split(text or "")) if tokens]
+
+
+def _keep(word):
+    return MIN_WORD_LENGTH <= len(word) <= MAX_WORD_LENGTH and word not in STOPWORDS
+
+
+class Tagger:
+    """Noun candidates for many texts at once; loads the POS model on first use."""
+
+    def __init__(self):
+        self._pos = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _get(self):
+        if self._loaded:
+            return self._pos
+        with self._lock:
+            if not self._loaded:
+                try:
+                    from nltk.tag import PerceptronTagger
+                    self._pos = PerceptronTagger()
+                except LookupError:
+                    print("⚠️ NLTK POS tagger data not found, tagging without part-of-speech filter "
+                          "(python -m nltk.downloader averaged_perceptron_tagger_eng)")
+                except Exception as e:
+                    print("⚠️ NLTK POS tagger not available, tagging without part-of-speech filter:", e)
+                self._loaded = True
+        return self._pos
+
+    @property
+    def kind(self):
+        return "pos" if self._get() is not None else "plain"
+
+    def candidates_many(self, texts):
+        """[Counter(word -> count)] per text."""
+        per_text = [tokenize(t) for t in texts]
+        pos = self._get()
+        if pos is None:
+            return [Counter(w.lower() for sentence in sentences for w in sentence if _keep(w.lower()))
+                    for sentences in per_text]
+        # 所有句子一次性交给标注器，再按原文切回去
+        flat = [sentence for sentences in per_text for sentence in sentences]
+        tagged = iter(pos.tag_sents(flat)) if flat else iter(())
+        result = []
+        for sentences in per_text:
+            counts = Counter()
+            for _ in sentences:
+                for word, tag in next(tagged):
+                    word = word.lower()
+                    if tag.startswith("NN") and _keep(word):
+                        counts[word] += 1
+            result.append(counts)
+        return result
+
+
+# ---------- 缓存编码：nlp_cache 里存的是字符串 ----------
+
+def encode_counts(counts):
+    return " ".join(f"{word}:{n}" for word, n in sorted(counts.items()))
+
+
+def decode_counts(value):
+    counts = Counter()
+    for item in value.split():
+        word, _, n = item.rpartition(":")
+        counts[word] = int(n)
+    return counts
+
+
+# ---------- IDF 和排序 ----------
+
+class Idf:
+    """Word -> idf, with ``default`` for unseen words (rare, so the highest weight)."""
+
+    def __init__(self, table=None, default=1.0):
+        self.table = table or {}
+        self.default = default
+
+    def __call__(self, word):
+        return self.table.get(word, self.default)
+
+
+def corpus_idf(doc_count, document_frequencies):
+    """Smoothed idf (same formula as scikit-learn's TfidfVectorizer) from a user's own entries."""
+    def idf(df):
+        return math.log((1 + doc_count) / (1 + df)) + 1
+    return Idf({w: idf(df) for w, df in document_frequencies.items()}, default=idf(0))
+
+
+def load_vectorizer_idf(path):
+    """Idf from a fitted TfidfVectorizer saved with joblib; None when it can't be loaded."""
+    try:
+        import joblib
+        vectorizer = joblib.load(path)
+        words = vectorizer.get_feature_names_out()
+        return Idf(dict(zip(words, (float(v) for v in vectorizer.idf_))), default=float(vectorizer.idf_.max()))
+    except Exception as e:
+        print("⚠️ Could not load TF-IDF vectorizer for tag ranking:", e)
+        return None
+
+
+def rank(counts, idf=None, limit=MAX_TAGS):
+    """The ``limit`` best candidates by (1 + log tf) * idf, ties alphabetical."""
+    idf = idf or Idf()
+    scored = sorted(counts.items(), key=lambda item: (-(1 + math.log(item[1])) * idf(item[0]), item[0]))
+    return [word for word, _ in scored[:limit]]
+
+
+def format_tags(words):
+    return ", ".join(words)
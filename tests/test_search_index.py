@@ -0,0 +1,29 @@
+from sqlalchemy import create_engine, text
+
+import search_index
+
+
+def _search(conn, keyword, user_id):
+    query = search_index.build_match_query(keyword, user_id)
+    return sorted(conn.execute(
+        text(f"SELECT rowid FROM {search_index.FTS_TABLE} WHERE {search_index.FTS_TABLE} MATCH :q"),
+        {"q": query},
+    ).scalars())
+
+
+def test_keywords_do_not_match_owner_column():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        assert search_index.ensure_schema(conn)
+        search_index.index_entries(conn, [
+            (1, 1, "Morning", "went running by the river", "sport"),
+            (2, 1, "Umbrella", "rain all day", ""),
+            (3, 1, "Quiet", "nothing much", "home"),
+            (4, 2, "Other user", "an umbrella too", ""),
+        ])
+        # owner 列的值是 "u1"，"u" 不能把用户的所有日记都匹配出来
+        assert _search(conn, "u", 1) == [2]
+        assert _search(conn, "u1", 1) == []
+        assert _search(conn, "run", 1) == [1]
+        assert _search(conn, "sport", 1) == [1]
+        assert _search(conn, "umbrella", 2) == [4]
@@ -0,0 +1,93 @@
+"""
+日记正文压缩存储：Entry.text 用 CompressedText 类型，写入时压缩、读出时自动解压。
+
+- 压缩后的值存成 BLOB，开头是 4 字节魔数 b"\\x00dz" + 编码标记（z = zlib，s = zstd）；
+  没压缩的（老数据、压了反而更大的短日记、关掉压缩时写的）照旧是 TEXT，
+  读的时候按类型区分，所以新老数据可以混着放，随时开关都不用迁移。
+- zstd 需要装 zstandard；没装时选 zstd 会退回 zlib。读到 zstd 压缩的数据却没装 zstandard 会报错。
+- 全文索引 entry_fts 里另存了一份明文（搜索和摘要高亮要用），不受这里影响。
+
+    ENTRY_TEXT_COMPRESSION=none|zlib|zstd   默认 none
+    ENTRY_TEXT_COMPRESSION_LEVEL=6
+"""
+import zlib
+
+from sqlalchemy.types import Text, TypeDecorator
+
+CODECS = ("none", "zlib", "zstd")
+MAGIC = b"\x00dz"
+_TAGS = {"zlib": b"z", "zstd": b"s"}
+
+_codec = "none"
+_level = 6
+
+
+def _zstd():
+    import zstandard
+    return zstandard
+
+
+def configure(codec="none", level=6):
+    """Pick the codec for new writes; returns the one actually used."""
+    global _codec, _level
+    if codec not in CODECS:
+        raise ValueError(f"Unknown text compression {codec!r}, expected one of {CODECS}")
+    if codec == "zstd":
+        try:
+            _zstd()
+        except ImportError:
+            print("⚠️ zstandard is not installed, compressing entry text with zlib instead (pip install zstandard)")
+            codec = "zlib"
+    _codec, _level = codec, level
+    return codec
+
+
+def encode(text, codec=None):
+    """Compressed bytes for ``text``, or ``text`` itself when compression is off or doesn't help."""
+    codec = codec or _codec
+    if text is None or codec == "none":
+        return text
+    raw = text.encode("utf-8")
+    if codec == "zstd":
+        body = _zstd().ZstdCompressor(level=_level).compress(raw)
+    else:
+        body = zlib.compress(raw, _level)
+    if len(body) + len(MAGIC) + 1 >= len(raw):
+        return text
+    return MAGIC + _TAGS[codec] + body
+
+
+def decode(value):
+    """The text behind a stored value (plain TEXT or a compressed BLOB)."""
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if not is_compressed(value):
+        return value.decode("utf-8")
+    tag, body = value[len(MAGIC):len(MAGIC) + 1], value[len(MAGIC) + 1:]
+    if tag == _TAGS["zlib"]:
+        return zlib.decompress(body).decode("utf-8")
+    if tag == _TAGS["zstd"]:
+        return _zstd().ZstdDecompressor().decompress(body).decode("utf-8")
+    raise ValueError(f"Unknown compressed text tag {tag!r}")
+
+
+def is_compressed(value):
+    """True for a stored value written by encode() in compressed form."""
+    return isinstance(value, (bytes, memoryview)) and bytes(value[:len(MAGIC)]) == MAGIC
+
+
+class CompressedText(TypeDecorator):
+    """A TEXT column whose values are compressed with the configured codec."""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return encode(value)
+
+    def process_result_value(self, value, dialect):
+        return decode(value)
+
+    def coerce_compared_value(self, op, value):
+        # LIKE / = 的参数按明文绑定，不能被压缩
+        return Text()
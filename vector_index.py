@@ -0,0 +1,124 @@
+"""
+每个用户一份的向量索引，做余弦相似度 top-k。
+
+日记少时直接整块矩阵乘（BruteForceIndex）；超过阈值就建一个简单的 IVF 索引：
+球面 k-means 把向量分成 ~sqrt(n) 个簇，查询时只扫最近的 nprobe 个簇。
+向量都已 L2 归一化，点积就是余弦相似度。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _top_k(scores, k):
+    if k >= len(scores):
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+class BruteForceIndex:
+    kind = "brute-force"
+
+    def __init__(self, ids, vectors):
+        self.ids = np.asarray(ids)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _search_rows(self, rows, query, k, exclude):
+        scores = self.vectors[rows] @ query
+        if exclude:
+            scores[np.isin(self.ids[rows], list(exclude))] = -np.inf
+        best = _top_k(scores, k)
+        return [(int(self.ids[rows][i]), float(scores[i])) for i in best if np.isfinite(scores[i])]
+
+    def search(self, query, k=5, exclude=()):
+        """[(entry_id, cosine similarity)] best first."""
+        if not len(self.ids):
+            return []
+        return self._search_rows(slice(None), np.asarray(query, dtype=np.float32), k, exclude)
+
+
+class IVFIndex(BruteForceIndex):
+    kind = "ivf"
+
+    def __init__(self, ids, vectors, nlist=None, nprobe=8, iterations=8, seed=0):
+        super().__init__(ids, vectors)
+        n = len(self.ids)
+        self.nlist = nlist or max(1, int(np.sqrt(n)))
+        self.nprobe = min(nprobe, self.nlist)
+        self.centroids, assign = self._kmeans(iterations, np.random.default_rng(seed))
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(self.nlist)]
+
+    def _kmeans(self, iterations, rng):
+        x = self.vectors
+        # 数据多时只在一个样本上训练质心，再把全部向量分配过去
+        sample = x[rng.choice(len(x), size=min(len(x), self.nlist * 64), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            centroids = np.where(empty[:, None], centroids, sums / np.where(norms == 0, 1, norms))
+        assign = np.empty(len(x), dtype=np.int64)
+        for start in range(0, len(x), 8192):
+            assign[start:start + 8192] = np.argmax(x[start:start + 8192] @ centroids.T, axis=1)
+        return centroids.astype(np.float32), assign
+
+    def search(self, query, k=5, exclude=()):
+        if not len(self.ids):
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        probes = _top_k(self.centroids @ query, self.nprobe)
+        rows = np.concatenate([self.lists[c] for c in probes])
+        if len(rows) < k:
+            return super().search(query, k, exclude)
+        return self._search_rows(rows, query, k, exclude)
+
+
+def build_index(ids, vectors, ivf_threshold=5000, nprobe=8):
+    if ivf_threshold and len(ids) >= ivf_threshold:
+        return IVFIndex(ids, vectors, nprobe=nprobe)
+    return BruteForceIndex(ids, vectors)
+
+
+class IndexCache:
+    """
+    Per-process cache of built indexes keyed by (user_id, model). Writes by
+    a user drop their index; ``ttl`` bounds staleness from other workers.
+    """
+
+    def __init__(self, max_users=64, ttl=300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, user_id, model, build):
+        key = (user_id, model)
+        now = time.monotonic()
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is not None and hit[1] > now:
+                self._data.move_to_end(key)
+                return hit[0]
+        index = build()
+        with self._lock:
+            self._data[key] = (index, now + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_users:
+                self._data.popitem(last=False)
+        return index
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [k for k in self._data if k[0] == user_id]:
+                del self._data[key]